@@ -0,0 +1,246 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tracemalloc
+import tempfile
+import pandas as pd
+
+from pathlib import Path
+from itertools import count
+from contextlib import closing
+from datetime import datetime
+from dataclasses import dataclass, asdict
+from extractor.data_extractor import Extractor
+from cleaner.cleaner import DaylioCleaner, create_entry_tags, create_mood_groups
+from fitbit_sleep import clean_sleep_data, sleep_segments
+from sql_cmds import DbConnection, create_tables, create_views, load_sleep_levels, refresh_materialized, search_notes, write_frame
+from sql_cmds.features import FEATURES_TABLE, refresh_daily_features
+from sql_cmds.materialize import MATERIALIZED_TABLES
+from sql_cmds.query_plans import view_names
+
+from .synthetic import SyntheticConfig, write_dataset
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = PROJECT_DIR / "benchmarks" / "results"
+
+DEFAULT_SCALES = [1, 10, 100]
+
+# a stage this much slower than in the baseline is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+@dataclass
+class StageResult:
+    stage: str
+    scale: float
+    rows: int
+    seconds: float
+    min_seconds: float
+    peak_bytes: int | None
+
+
+def measure(func, setup=None, repeat: int = 3, memory: bool = True):
+    """
+    Times func over repeat runs, then runs it once more under tracemalloc for
+    its peak allocation so the tracing overhead stays out of the timings.
+
+    :param setup: Builds func's arguments before each run, outside the timing
+    :return: The first run's result, the timings and the peak bytes
+    """
+    timings, result = [], None
+    for run in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        value = func(*args)
+        timings.append(time.perf_counter() - start)
+        if run == 0:
+            result = value
+
+    peak = None
+    if memory:
+        args = setup() if setup else ()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, timings, peak
+
+
+class StageBenchmark:
+    """
+    Runs every ETL stage on one synthetic dataset, each stage timed on the
+    previous stage's output.
+    """
+
+    def __init__(self, scale: float, work_dir: Path, config: SyntheticConfig,
+                 repeat: int = 3, memory: bool = True) -> None:
+        self.scale = scale
+        self.work_dir = work_dir
+        self.config = config.scaled(scale)
+        self.repeat = repeat
+        self.memory = memory
+        self.results: list[StageResult] = []
+
+    def _run(self, stage: str, func, setup=None, rows=len):
+        result, timings, peak = measure(func, setup, self.repeat, self.memory)
+        self.results.append(StageResult(
+            stage=stage, scale=self.scale, rows=rows(result),
+            seconds=statistics.median(timings), min_seconds=min(timings), peak_bytes=peak))
+        print(f"  {stage:<40} {statistics.median(timings) * 1000:10.1f} ms"
+              f"{'' if peak is None else f'  peak {peak / 2**20:8.1f} MB'}")
+        return result
+
+    def _new_db(self, name: str) -> DbConnection:
+        db_path = self.work_dir / f"{name}.db"
+        db_path.unlink(missing_ok=True)
+        db = DbConnection(db_path)
+        create_tables(db)
+        create_views(db)
+        return db
+
+    def run(self) -> list[StageResult]:
+        backup_path, sleep_path = write_dataset(self.work_dir, self.config)
+        sleep_entries = json.loads(sleep_path.read_text())
+        selected_tables = Extractor.get_selected_tables()
+
+        def extract():
+            with closing(Extractor.extract_backup(backup_path)) as chunks:
+                return list(chunks)
+
+        chunks = self._run("extract_backup", extract, rows=lambda chunks: sum(map(len, chunks)))
+        daylio_data, _ = self._run(
+            "decode_backup_to_json",
+            lambda: Extractor.decode_backup_to_json(iter(chunks), selected_tables),
+            rows=lambda decoded: sum(map(len, decoded[0].values())))
+        frames = self._run("build_frames", lambda: Extractor.build_frames(daylio_data),
+                           rows=lambda tables: sum(map(len, tables.values())))
+
+        # the cleaner writes date columns into the frame it is given
+        cleaners = {}
+        for name, frame in frames.items():
+            if name == "prefs":
+                continue
+            cleaners[name] = self._run(
+                f"DaylioCleaner[{name}]", DaylioCleaner,
+                setup=lambda name=name, frame=frame: (name, frame.copy()),
+                rows=lambda cleaner: len(cleaner.table))
+        cleaners["entry_tags"] = self._run(
+            "create_entry_tags", lambda: create_entry_tags(cleaners["dayEntries"]),
+            rows=lambda cleaner: len(cleaner.table))
+        cleaners["mood_groups"] = create_mood_groups()
+        sleep_table = self._run("clean_sleep_data", lambda: clean_sleep_data(sleep_entries))
+        segments = self._run("sleep_segments", lambda: sleep_segments(sleep_entries), rows=len)
+
+        def load(db):
+            with db.bulk_load() as conn:
+                for cleaner in cleaners.values():
+                    cleaner.to_sql(conn)
+                write_frame(conn, "fitbit_sleep", sleep_table, if_exists="replace")
+                load_sleep_levels(conn, segments)
+            return db
+
+        # every run loads into a new database, the last one is kept for the views
+        runs = count()
+        db = self._run("to_sql", load,
+                       setup=lambda: (self._new_db(f"load_{next(runs)}"),),
+                       rows=lambda _: sum(len(cleaner.table) for cleaner in cleaners.values())
+                       + len(sleep_table) + len(segments))
+
+        rebuild = [table.name for table in MATERIALIZED_TABLES]
+
+        def refresh():
+            with db as conn:
+                return refresh_materialized(conn, {}, rebuild)
+
+        self._run("refresh_materialized", refresh, rows=lambda refreshed: sum(refreshed.values()))
+
+        def features():
+            with db as conn:
+                conn.execute(f'DROP TABLE IF EXISTS "{FEATURES_TABLE}"')
+                return refresh_daily_features(conn, {})
+
+        self._run("refresh_daily_features", features, rows=lambda days: days)
+
+        with db as conn:
+            self._run("search_notes", lambda: search_notes(conn, "note entry", limit=100))
+            for view in view_names(conn):
+                self._run(f"view[{view}]",
+                          lambda view=view: conn.execute(f'SELECT * FROM "{view}"').fetchall())
+        db.close()
+        return self.results
+
+
+def compare(results: list[dict], baseline: list[dict], ratio: float = REGRESSION_RATIO) -> list[str]:
+    """
+    :return: One line per stage and scale that got slower than ratio times the baseline
+    """
+    before = {(row["stage"], row["scale"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = before.get((row["stage"], row["scale"]))
+        if old and old["seconds"] > 0 and row["seconds"] > ratio * old["seconds"]:
+            regressions.append(
+                f"{row['stage']} at {row['scale']}x: {old['seconds'] * 1000:.1f} ms -> "
+                f"{row['seconds'] * 1000:.1f} ms ({row['seconds'] / old['seconds']:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Times and memory-profiles each ETL stage on synthetic data.")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES,
+                        help="multiples of the base dataset's history to run at")
+    parser.add_argument("--years", type=float, default=SyntheticConfig.years,
+                        help="years of history at 1x")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc run of each stage")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="results json, benchmarks/results/stages_<time>.json by default")
+    parser.add_argument("--baseline", type=Path, default=None,
+                        help="earlier results json to check for regressions")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args(argv)
+
+    # per stage log lines would swamp the timings
+    logging.getLogger("daylio_etl_logger").setLevel(logging.WARNING)
+
+    config = SyntheticConfig(years=args.years)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="daylio_bench_") as tmp:
+        for scale in args.scales:
+            print(f"Scale {scale:g}x ({config.scaled(scale).years:g} years of history)")
+            work_dir = Path(tmp) / f"scale_{scale:g}"
+            work_dir.mkdir()
+            benchmark = StageBenchmark(scale, work_dir, config,
+                                       repeat=args.repeat, memory=not args.no_memory)
+            results.extend(asdict(result) for result in benchmark.run())
+
+    output = args.output or RESULTS_DIR / f"stages_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "config": asdict(config),
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text())["results"], args.ratio)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
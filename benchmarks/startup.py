@@ -0,0 +1,45 @@
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+# cold start commands the scheduler pays for before any ETL work happens
+STARTUP_COMMANDS = {
+    "import main": [sys.executable, "-c", "import main"],
+    "main --help": [sys.executable, "main.py", "--help"],
+}
+
+
+def time_command(command: list[str], runs: int) -> list[float]:
+    """
+    Runs the command in a fresh interpreter each time.
+
+    :return: Wall clock seconds per run
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=PROJECT_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times ETL cold start.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for name, command in STARTUP_COMMANDS.items():
+        timings = time_command(command, args.runs)
+        print(f"{name:<12} median {statistics.median(timings) * 1000:7.1f} ms  "
+              f"min {min(timings) * 1000:7.1f} ms  ({args.runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+import json
+import base64
+import zipfile
+import argparse
+import numpy as np
+
+from pathlib import Path
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+
+# member the app writes the base64 encoded json into, see extractor.data_extractor
+BACKUP_MEMBER = "backup.daylio"
+
+# predefined moods, one per mood group, whose names the app leaves blank
+PREDEFINED_MOODS = 5
+
+# stages logs are split into segments of these levels, classic logs into the others
+STAGE_LEVELS = ["wake", "light", "deep", "rem"]
+STAGE_WEIGHTS = [0.1, 0.55, 0.15, 0.2]
+CLASSIC_LEVELS = ["asleep", "restless", "awake"]
+CLASSIC_WEIGHTS = [0.85, 0.1, 0.05]
+
+FITBIT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000"
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    """
+    Shape of a generated Daylio history ending at end_date, and of the Fitbit
+    sleep logs for the same days.
+    """
+    years: float = 3
+    entries_per_day: float = 1.5
+    tags_per_entry: float = 4
+    tags: int = 60
+    tag_groups: int = 8
+    custom_moods: int = 10
+    goals: int = 12
+    goal_completion: float = 0.6
+    nap_probability: float = 0.15
+    classic_probability: float = 0.1
+    seed: int = 0
+    end_date: date | None = None
+
+    @property
+    def days(self) -> int:
+        return max(1, round(self.years * 365))
+
+    def scaled(self, factor: float) -> "SyntheticConfig":
+        """
+        Same user with factor times the history, which is how a real
+        database grows.
+        """
+        return replace(self, years=self.years * factor)
+
+
+def _epoch_ms(moment: datetime) -> int:
+    return int(moment.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _day_range(config: SyntheticConfig) -> list[date]:
+    end = config.end_date or date.today()
+    return [end - timedelta(days=offset) for offset in range(config.days - 1, -1, -1)]
+
+
+def _custom_moods(config: SyntheticConfig, rng: np.random.Generator, created: datetime) -> list[dict]:
+    moods = []
+    for mood_id in range(1, PREDEFINED_MOODS + config.custom_moods + 1):
+        predefined = mood_id <= PREDEFINED_MOODS
+        group = mood_id if predefined else int(rng.integers(1, 6))
+        moods.append({
+            "id": mood_id,
+            "custom_name": "" if predefined else f"mood {mood_id}",
+            "mood_group_id": group,
+            "mood_group_order": 0 if predefined else mood_id,
+            "icon_id": mood_id,
+            "predefined_name_id": group if predefined else -1,
+            "state": 0,
+            "createdAt": _epoch_ms(created),
+        })
+    return moods
+
+
+def _tags(config: SyntheticConfig, rng: np.random.Generator, created: datetime) -> tuple[list[dict], list[dict]]:
+    tag_groups = [{"id": group_id, "name": f"group {group_id}", "is_expanded": True,
+                   "order": group_id} for group_id in range(1, config.tag_groups + 1)]
+    tags = [{
+        "id": tag_id,
+        "name": f"activity {tag_id}",
+        "createdAt": _epoch_ms(created),
+        "icon": tag_id,
+        "order": tag_id,
+        "state": 0,
+        "id_tag_group": int(rng.integers(1, config.tag_groups + 1)),
+    } for tag_id in range(1, config.tags + 1)]
+    return tags, tag_groups
+
+
+def _day_entries(config: SyntheticConfig, rng: np.random.Generator, days: list[date]) -> list[dict]:
+    entries_per_day = rng.poisson(config.entries_per_day, len(days))
+    mood_ids = np.arange(1, PREDEFINED_MOODS + config.custom_moods + 1)
+    # popular activities are logged far more often than the rest, like real use
+    tag_weights = 1 / np.arange(1, config.tags + 1)
+    tag_weights /= tag_weights.sum()
+
+    entries = []
+    entry_id = 1
+    for day, count in zip(days, entries_per_day):
+        minutes = np.sort(rng.integers(7 * 60, 24 * 60, count))
+        for minute_of_day in minutes:
+            moment = datetime(day.year, day.month, day.day) + timedelta(minutes=int(minute_of_day))
+            tag_count = min(config.tags, int(rng.poisson(config.tags_per_entry)))
+            tags = rng.choice(config.tags, size=tag_count, replace=False, p=tag_weights) + 1
+            entries.append({
+                "id": entry_id,
+                "minute": moment.minute,
+                "hour": moment.hour,
+                "day": moment.day,
+                # the app counts months from 0
+                "month": moment.month - 1,
+                "year": moment.year,
+                "datetime": _epoch_ms(moment),
+                "timeZoneOffset": 0,
+                "mood": int(rng.choice(mood_ids)),
+                "note": f"note for entry {entry_id}" if rng.random() < 0.3 else "",
+                "note_title": "",
+                "tags": sorted(int(tag) for tag in tags),
+                "assets": [],
+            })
+            entry_id += 1
+    return entries
+
+
+def _goals(config: SyntheticConfig, rng: np.random.Generator, days: list[date]) -> tuple[list[dict], list[dict]]:
+    goals, goal_entries = [], []
+    entry_id = 1
+    for goal_id in range(1, config.goals + 1):
+        start = int(rng.integers(0, len(days)))
+        # a third of the goals are finished, the rest are still running
+        end = int(rng.integers(start, len(days))) if rng.random() < 1 / 3 else None
+        created = datetime(days[start].year, days[start].month, days[start].day, 9)
+        goals.append({
+            "id": goal_id,
+            "goal_id": goal_id,
+            "created_at": _epoch_ms(created),
+            "id_tag": int(rng.integers(1, config.tags + 1)),
+            "end_date": -1 if end is None else _epoch_ms(
+                datetime(days[end].year, days[end].month, days[end].day, 21)),
+            "name": f"goal {goal_id}",
+            "note": "",
+            "repeat_type": 1,
+            "repeat_value": 7,
+            "state": 0 if end is None else 2,
+        })
+        last = len(days) if end is None else end + 1
+        done = np.flatnonzero(rng.random(last - start) < config.goal_completion) + start
+        for day_index in done:
+            day = days[day_index]
+            moment = datetime(day.year, day.month, day.day, 20)
+            goal_entries.append({
+                "id": entry_id,
+                "goalId": goal_id,
+                "year": day.year,
+                "month": day.month - 1,
+                "day": day.day,
+                "hour": 20,
+                "minute": 0,
+                "second": 0,
+                "createdAt": _epoch_ms(moment),
+            })
+            entry_id += 1
+    return goals, goal_entries
+
+
+def _prefs(entries: list[dict]) -> list[dict]:
+    last_entry = entries[-1]["datetime"] if entries else 0
+    return [
+        {"key": "AUTO_BACKUP_IS_ON", "pref_name": "default", "value": True},
+        {"key": "LAST_DAYS_IN_ROWS_NUMBER", "pref_name": "default", "value": 12},
+        {"key": "DAYS_IN_ROW_LONGEST_CHAIN", "pref_name": "default", "value": 140},
+        {"key": "LAST_ENTRY_CREATION_TIME", "pref_name": "default", "value": last_entry},
+    ]
+
+
+def generate_daylio_backup(config: SyntheticConfig) -> dict:
+    """
+    Builds the json object held in a Daylio backup, with the selected tables
+    plus a few of the members the extractor has to skip.
+    """
+    rng = np.random.default_rng(config.seed)
+    days = _day_range(config)
+    created = datetime(days[0].year, days[0].month, days[0].day, 8)
+
+    tags, tag_groups = _tags(config, rng, created)
+    entries = _day_entries(config, rng, days)
+    goals, goal_entries = _goals(config, rng, days)
+    return {
+        "version": 15,
+        "isReminderOn": False,
+        "customMoods": _custom_moods(config, rng, created),
+        "tags": tags,
+        "dayEntries": entries,
+        "achievements": [{"name": f"achievement {i}", "AC_FIRST_ENTRY_SEEN": True} for i in range(20)],
+        "daysInRowLongestChain": 140,
+        "goals": goals,
+        "prefs": _prefs(entries),
+        "tag_groups": tag_groups,
+        "metadata": {"number_of_entries": len(entries), "created_at": _epoch_ms(datetime.now()),
+                     "is_auto_backup": True, "platform": "android", "android_version": 34},
+        "moodIconsPackId": 1,
+        "goalEntries": goal_entries,
+        "goalSuccessWeeks": [],
+        "reminders": [],
+        "writingTemplates": [],
+        "assets": [],
+    }
+
+
+def write_backup(path: Path, backup: dict) -> Path:
+    """
+    Writes a backup the way the app does, base64 encoded json zipped as backup.daylio.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    encoded = base64.b64encode(json.dumps(backup).encode("utf-8"))
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zw:
+        zw.writestr(BACKUP_MEMBER, encoded)
+    return path
+
+
+def _segments(rng: np.random.Generator, start: datetime, seconds: int,
+              levels: list[str], weights: list[float], mean_seconds: int) -> list[dict]:
+    # fitbit segments are whole multiples of 30 seconds, drawn in one go with
+    # enough headroom to cover the log and then cut at its end
+    drawn = seconds // mean_seconds * 3 + 8
+    lengths = 30 * np.maximum(1, rng.exponential(mean_seconds / 30, drawn).astype(np.int64))
+    ends = np.cumsum(lengths)
+    if ends[-1] < seconds:
+        lengths[-1] += seconds - ends[-1]
+        ends[-1] = seconds
+    used = int(np.searchsorted(ends, seconds)) + 1
+    lengths[used - 1] -= ends[used - 1] - seconds
+    offsets = ends[:used] - lengths[:used]
+    names = rng.choice(levels, size=used, p=weights)
+    return [{
+        "dateTime": (start + timedelta(seconds=int(offset))).strftime(FITBIT_TIME_FORMAT),
+        "level": str(level),
+        "seconds": int(length),
+    } for offset, level, length in zip(offsets, names, lengths[:used])]
+
+
+def _summary(segments: list[dict], levels: list[str], stages: bool) -> dict:
+    summary = {}
+    for level in levels:
+        matching = [segment["seconds"] for segment in segments if segment["level"] == level]
+        summary[level] = {"count": len(matching), "minutes": sum(matching) // 60}
+        if stages:
+            summary[level]["thirtyDayAvgMinutes"] = summary[level]["minutes"]
+    return summary
+
+
+def _sleep_log(rng: np.random.Generator, log_id: int, day: date, start: datetime,
+               minutes: int, main_sleep: bool, classic: bool) -> dict:
+    seconds = minutes * 60
+    if classic:
+        segments = _segments(rng, start, seconds, CLASSIC_LEVELS, CLASSIC_WEIGHTS, 900)
+        levels = {"data": segments, "summary": _summary(segments, CLASSIC_LEVELS, False)}
+        asleep = levels["summary"]["asleep"]["minutes"]
+    else:
+        segments = _segments(rng, start, seconds, STAGE_LEVELS, STAGE_WEIGHTS, 600)
+        levels = {
+            "data": segments,
+            "shortData": [segment for segment in segments[::7]
+                          if segment["level"] == "wake"],
+            "summary": _summary(segments, STAGE_LEVELS, True),
+        }
+        asleep = minutes - levels["summary"]["wake"]["minutes"]
+    return {
+        "dateOfSleep": day.isoformat(),
+        "duration": seconds * 1000,
+        "efficiency": int(round(100 * asleep / max(minutes, 1))),
+        "endTime": (start + timedelta(seconds=seconds)).strftime(FITBIT_TIME_FORMAT),
+        "infoCode": 0,
+        "isMainSleep": main_sleep,
+        "levels": levels,
+        "logId": log_id,
+        "logType": "auto_detected",
+        "minutesAfterWakeup": 0,
+        "minutesAsleep": asleep,
+        "minutesAwake": minutes - asleep,
+        "minutesToFallAsleep": 0,
+        "startTime": start.strftime(FITBIT_TIME_FORMAT),
+        "timeInBed": minutes,
+        "type": "classic" if classic else "stages",
+    }
+
+
+def generate_sleep_entries(config: SyntheticConfig) -> list[dict]:
+    """
+    Builds the sleep entries get_fitbit_sleep_data returns for the config's
+    days: a main sleep every night, stages or classic, and the odd nap.
+    """
+    rng = np.random.default_rng(config.seed + 1)
+    entries = []
+    for day in _day_range(config):
+        night = datetime(day.year, day.month, day.day) - timedelta(minutes=int(rng.integers(0, 180)))
+        minutes = int(rng.normal(430, 60))
+        entries.append(_sleep_log(rng, len(entries) + 1, day, night, max(minutes, 60),
+                                  True, rng.random() < config.classic_probability))
+        if rng.random() < config.nap_probability:
+            nap = datetime(day.year, day.month, day.day, int(rng.integers(12, 17)))
+            entries.append(_sleep_log(rng, len(entries) + 1, day, nap,
+                                      int(rng.integers(20, 90)), False, True))
+    return entries
+
+
+def write_dataset(out_dir: Path, config: SyntheticConfig) -> tuple[Path, Path]:
+    """
+    Writes a backup named like the app's and the matching Fitbit sleep payload.
+
+    :return: Paths of the backup and of the sleep entries json
+    """
+    end = config.end_date or date.today()
+    backup_path = write_backup(out_dir / end.strftime("backup_%Y_%m_%d.daylio"),
+                               generate_daylio_backup(config))
+    sleep_path = out_dir / "fitbit_sleep.json"
+    sleep_path.write_text(json.dumps(generate_sleep_entries(config)))
+    return backup_path, sleep_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Writes a synthetic Daylio backup and matching Fitbit sleep logs.")
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--years", type=float, default=SyntheticConfig.years)
+    parser.add_argument("--scale", type=float, default=1,
+                        help="multiplies the years of history")
+    parser.add_argument("--entries-per-day", type=float, default=SyntheticConfig.entries_per_day)
+    parser.add_argument("--tags-per-entry", type=float, default=SyntheticConfig.tags_per_entry)
+    parser.add_argument("--goals", type=int, default=SyntheticConfig.goals)
+    parser.add_argument("--custom-moods", type=int, default=SyntheticConfig.custom_moods)
+    parser.add_argument("--seed", type=int, default=SyntheticConfig.seed)
+    args = parser.parse_args(argv)
+
+    config = SyntheticConfig(
+        years=args.years, entries_per_day=args.entries_per_day,
+        tags_per_entry=args.tags_per_entry, goals=args.goals,
+        custom_moods=args.custom_moods, seed=args.seed).scaled(args.scale)
+    backup_path, sleep_path = write_dataset(args.out_dir, config)
+    print(f"Wrote {backup_path} and {sleep_path}")
+
+
+if __name__ == "__main__":
+    main()
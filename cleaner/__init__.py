@@ -1 +1,2 @@
-from .cleaner import DaylioCleaner, ColumnInfo, create_entry_tags, create_mood_groups
+from .cleaner import DaylioCleaner, ColumnInfo, create_entry_tags, create_mood_groups, memory_report
+from .schema import load_schema, table_columns
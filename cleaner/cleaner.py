@@ -1,49 +1,65 @@
-import json
+import numpy as np
 import pandas as pd
 
 from typing import List
-from pathlib import Path
-from dotenv import load_dotenv
-from dataclasses import dataclass
+from itertools import chain
+from config import get_settings
 from log_setup import setup_logger
+from log_setup.metrics import span
+from sql_cmds.sql_cmds import add_missing_columns, table_exists, write_frame
+from sql_cmds.incremental import LoadStats, incremental_load
+from sql_cmds.materialize import PARTITION_KEYS
 
-from pandas.api.types import is_datetime64_any_dtype
+from .schema import ColumnInfo, memory_usage, table_columns, target_dtypes
 
-load_dotenv()
+from pandas.api.types import is_datetime64_any_dtype
 
 logger = setup_logger()
 
 
-@dataclass
-class ColumnInfo:
-    name: str
-    type_name: str
-    kind: str
+# source columns kept beside the registered ones, create_entry_tags reads dayEntries.tags
+KEPT_COLUMNS = {
+    "dayEntries": ["tags"],
+}
+
+
+# with keep_deleted, rows missing from the backup are only deleted within the
+# entries the backup still has, other tables keep every row by id
+DELETE_SCOPES = {
+    "entry_tags": "entry_id",
+}
 
 
 class DaylioCleaner:
     def __init__(self, name: str, table: pd.DataFrame) -> None:
         self.name = name
         self.table = table
-        self.col_info_path = Path("data/static/table_info.json")
-        self.columns = self._load_columns()
-        self.column_names = [col.name for col in self.columns]
-        self._normalize_dates()
-        if self.name == "customMoods":
-            self._modify_custom_moods()
+        with span(f"clean.{name}", rows_in=len(table)) as clean_span:
+            self.columns = self._load_columns()
+            self.column_names = [col.name for col in self.columns]
+            self.memory_before = memory_usage(self.table)
+            self._normalize_dates()
+            if self.name == "customMoods":
+                self._modify_custom_moods()
+            if self.name == "dayEntries":
+                self._count_tags()
+            self._coerce_dtypes()
+            clean_span.rows_out = len(self.table)
 
     def _load_columns(self) -> List[ColumnInfo]:
-        if not self.col_info_path.exists():
-            raise FileNotFoundError(
-                f"Column info file {self.col_info_path} does not exist.")
-
-        with open(self.col_info_path, 'r') as file:
-            data = json.load(file)
-
-        if self.name not in data:
-            raise ValueError(f"No column information found for '{self.name}'.")
-
-        return [ColumnInfo(**col) for col in data[self.name]]
+        return table_columns(self.name)
+
+    def _coerce_dtypes(self):
+        # columns the database never sees are dropped before coercing the rest
+        kept = self.column_names + KEPT_COLUMNS.get(self.name, [])
+        self.table = self.table[[col for col in self.table.columns if col in kept]]
+        dtypes = target_dtypes(self.columns, self.table)
+        if dtypes:
+            self.table = self.table.astype(dtypes)
+        self.memory_after = memory_usage(self.table)
+        logger.info(
+            f"Table {self.name} uses {self.memory_after / 2**20:.2f} MB, "
+            f"{self.memory_before / 2**20:.2f} MB before dtype coercion")
 
     def _normalize_dates(self):
         name_map = {
@@ -80,17 +96,84 @@ class DaylioCleaner:
         self.table.loc[mask, "custom_name"] = self.table.loc[mask,
                                                              "mood_group_id"].map(mapping)
 
-    def to_sql(self, engine) -> None:
-        if not self.table.empty:
-            self.table[self.column_names].to_sql(
-                self.name,
-                con=engine,
-                if_exists='replace',
-                index=False,
-                # dtype={col.name: col.type_name for col in self.columns}
-            )
-        else:
+    def _count_tags(self):
+        if 'tags' not in self.table:
+            self.table['tags'] = [[] for _ in range(len(self.table))]
+        _, _, self.table['tag_count'] = flatten_tags(
+            self.table['id'], self.table['tags'])
+
+    def to_sql(self, engine, mode: str = 'incremental', keep_deleted: bool = False) -> LoadStats | None:
+        """
+        Writes the cleaned table to the database.
+
+        :param engine: sqlite3 connection to the target database, writes join
+            any transaction already open on it
+        :param mode: 'incremental' to apply only changed rows to the existing
+            table, 'replace' to drop and rewrite it
+        :param keep_deleted: Keep rows that are no longer in the backup, so
+            history merged by a backfill survives later loads
+        :return: Counts of inserted, updated and deleted rows
+        """
+        if mode not in ('incremental', 'replace'):
+            raise ValueError(f"Unknown load mode '{mode}'.")
+
+        if self.table.empty:
             logger.warning(f"Table {self.name} is empty, skipping SQL upload.")
+            return None
+
+        table = self.table[self.column_names]
+        with span(f"to_sql.{self.name}", rows_in=len(table)) as load_span:
+            stats = self._write(engine, table, mode, keep_deleted)
+            load_span.rows_out = stats.inserted + stats.updated + stats.deleted
+        return stats
+
+    def _write(self, engine, table: pd.DataFrame, mode: str, keep_deleted: bool) -> LoadStats:
+        dtype = {col.name: col.sql_type for col in self.columns}
+        if table_exists(engine, self.name):
+            add_missing_columns(engine, self.name, dtype)
+            if mode == 'incremental':
+                # report the partitions touched so materialized tables refresh only those
+                track = PARTITION_KEYS.get(self.name)
+                scope = DELETE_SCOPES.get(self.name, 'id') if keep_deleted else None
+                return incremental_load(engine, self.name, table,
+                                        track=track if track in table else None,
+                                        delete_scope=scope if scope in table else None)
+
+        inserted = write_frame(engine, self.name, table,
+                               if_exists='replace', dtype=dtype)
+        return LoadStats(table=self.name, inserted=inserted)
+
+
+def memory_report(cleaners: List[DaylioCleaner]) -> pd.DataFrame:
+    """
+    :return: Bytes used per table before and after dtype coercion
+    """
+    report = pd.DataFrame({
+        "table": [cleaner.name for cleaner in cleaners],
+        "before_bytes": [cleaner.memory_before for cleaner in cleaners],
+        "after_bytes": [cleaner.memory_after for cleaner in cleaners],
+    })
+    report["ratio"] = (report["after_bytes"] /
+                       report["before_bytes"].where(report["before_bytes"] > 0)).round(3)
+    return report
+
+
+def flatten_tags(entry_ids, tag_lists) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flattens per-entry tag lists into parallel int32 arrays. Entries without
+    tags (an empty or missing list) contribute no rows and a count of 0.
+
+    :param entry_ids: Entry id per entry
+    :param tag_lists: List or array of tag ids per entry
+    :return: Entry id per tag, tag ids, and number of tags per entry
+    """
+    # tag lists read back from the feather cache are numpy arrays
+    lists = [tags if isinstance(tags, (list, np.ndarray)) else [] for tags in tag_lists]
+    counts = np.fromiter(map(len, lists), dtype=np.int32, count=len(lists))
+    tags = np.fromiter(chain.from_iterable(lists),
+                       dtype=np.int32, count=int(counts.sum()))
+    ids = np.repeat(np.asarray(entry_ids, dtype=np.int32), counts)
+    return ids, tags, counts
 
 
 def create_entry_tags(cleaner: DaylioCleaner) -> DaylioCleaner:
@@ -98,11 +181,10 @@ def create_entry_tags(cleaner: DaylioCleaner) -> DaylioCleaner:
         raise ValueError(
             "Cleaner must be for 'dayEntries' to create entry tags.")
 
-    tags_df = cleaner.table[['id', 'tags']].explode('tags')
-    tags_df = tags_df.rename(columns={'id': 'entry_id', 'tags': 'tag'})
-
-    with pd.option_context('future.no_silent_downcasting', True):
-        tags_df['tag'] = tags_df['tag'].fillna(0).astype(int)
+    entry_ids, tags, _ = flatten_tags(
+        cleaner.table['id'], cleaner.table['tags'])
+    # an entry holds each tag once, as the (entry_id, tag) key requires
+    tags_df = pd.DataFrame({'entry_id': entry_ids, 'tag': tags}).drop_duplicates()
 
     return DaylioCleaner(
         name='entry_tags',
@@ -111,8 +193,7 @@ def create_entry_tags(cleaner: DaylioCleaner) -> DaylioCleaner:
 
 
 def create_mood_groups() -> DaylioCleaner:
-    mood_groups_path = Path("data/static/mood_groups.json")
-    df = pd.read_json(mood_groups_path)
+    df = pd.read_json(get_settings().mood_groups_path)
     return DaylioCleaner(
         name='mood_groups',
         table=df
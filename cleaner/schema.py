@@ -0,0 +1,133 @@
+import json
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from functools import lru_cache
+from dataclasses import dataclass
+from config import get_settings
+from log_setup import setup_logger
+
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+logger = setup_logger()
+
+# SQL column types for the table_info.json type names, timestamps are split by kind
+SQL_TYPES = {
+    "Int64.Type": "INTEGER",
+    "Text.Type": "TEXT",
+}
+TYPE_NAMES = {*SQL_TYPES, "timestamp"}
+
+# text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# smallest first, the first one holding a column's range is used
+NULLABLE_INTS = ["Int8", "Int16", "Int32", "Int64"]
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    type_name: str
+    kind: str
+
+    @property
+    def sql_type(self) -> str:
+        if self.type_name == "timestamp":
+            return "DATE" if self.kind == "date" else "DATETIME"
+        return SQL_TYPES.get(self.type_name, "TEXT")
+
+
+def _parse_table(table_name: str, columns) -> tuple[ColumnInfo, ...]:
+    if not isinstance(columns, list) or not columns:
+        raise ValueError(f"Table '{table_name}' must list its columns.")
+
+    parsed = []
+    for col in columns:
+        try:
+            info = ColumnInfo(**col)
+        except TypeError as e:
+            raise ValueError(f"Invalid column in table '{table_name}': {col}") from e
+        if info.type_name not in TYPE_NAMES:
+            raise ValueError(
+                f"Unknown type '{info.type_name}' for {table_name}.{info.name}.")
+        parsed.append(info)
+
+    names = [col.name for col in parsed]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate columns {duplicates} in table '{table_name}'.")
+    return tuple(parsed)
+
+
+@lru_cache(maxsize=None)
+def load_schema(path: Path) -> dict[str, tuple[ColumnInfo, ...]]:
+    """
+    Reads and validates the column registry once per process.
+
+    :param path: Path to table_info.json
+    :return: Dict of table name to its columns
+    """
+    if not path.exists():
+        logger.error(f"Column info file {path} does not exist.")
+        raise FileNotFoundError(f"Column info file {path} does not exist.")
+
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    try:
+        return {table_name: _parse_table(table_name, columns)
+                for table_name, columns in data.items()}
+    except ValueError as e:
+        logger.error(f"Invalid column info file {path}: {e}")
+        raise
+
+
+def table_columns(table_name: str, path: Path | None = None) -> list[ColumnInfo]:
+    schema = load_schema(path or get_settings().table_info_path)
+    if table_name not in schema:
+        raise ValueError(f"No column information found for '{table_name}'.")
+    return list(schema[table_name])
+
+
+def _int_dtype(col: pd.Series) -> str | None:
+    if not is_numeric_dtype(col):
+        return None
+    values = col.dropna()
+    if len(values) and not (values == np.floor(values)).all():
+        return None
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    return next(dtype for dtype in NULLABLE_INTS
+                if np.iinfo(dtype.lower()).min <= low and high <= np.iinfo(dtype.lower()).max)
+
+
+def target_dtypes(columns: list[ColumnInfo], df: pd.DataFrame) -> dict:
+    """
+    Compact pandas dtype for each registered column in the frame: the narrowest
+    nullable int holding its values, a categorical for repetitive text, and
+    datetime64 for timestamps. Columns whose values don't fit keep their dtype.
+    """
+    dtypes = {}
+    for info in columns:
+        if info.name not in df:
+            continue
+        col = df[info.name]
+        if info.type_name == "Int64.Type":
+            dtype = _int_dtype(col)
+        elif info.type_name == "timestamp":
+            dtype = None if is_datetime64_any_dtype(col) else "datetime64[ns]"
+        elif len(col) and col.nunique() <= CATEGORY_MAX_RATIO * len(col):
+            dtype = "category"
+        else:
+            dtype = None
+        if dtype is not None and dtype != col.dtype:
+            dtypes[info.name] = dtype
+    return dtypes
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """
+    :return: Bytes used by the frame including the python objects it holds
+    """
+    return int(df.memory_usage(deep=True).sum())
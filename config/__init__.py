@@ -0,0 +1 @@
+from .settings import Settings, get_settings
@@ -0,0 +1,115 @@
+import os
+
+from pathlib import Path
+from functools import lru_cache
+from dataclasses import dataclass
+
+# the project directory holding data/ and sql/, located from the source tree
+# instead of searching the home directory for it
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+
+@dataclass(frozen=True)
+class Settings:
+    base_dir: Path
+    db_path: str | None
+    pickup_dir: Path
+    fitbit_client_id: str
+    fitbit_client_secret: str
+    fitbit_max_workers: int = 4
+    fitbit_settle_days: int = 3
+    calendar_start: str = '2018-01-01'
+    calendar_horizon_days: int = 0
+    calendar_week_start: str = 'monday'
+    keep_deleted_rows: bool = False
+    # snapshots kept by the archive, see extractor.archive.RetentionPolicy
+    archive_retention: str = 'daily=30,weekly=12,monthly=24'
+    # per tenant state (cache, archive, fingerprints, Fitbit tokens) lives
+    # here when set, the shared data/static config is read from base_dir
+    tenant_dir: Path | None = None
+
+    @property
+    def data_dir(self) -> Path:
+        return self.base_dir / "data"
+
+    @property
+    def state_dir(self) -> Path:
+        return self.tenant_dir or self.data_dir
+
+    @property
+    def archive_dir(self) -> Path:
+        return self.state_dir / "archive"
+
+    @property
+    def static_dir(self) -> Path:
+        return self.data_dir / "static"
+
+    @property
+    def sql_dir(self) -> Path:
+        return self.base_dir / "sql"
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.state_dir / "cache"
+
+    @property
+    def selected_tables_path(self) -> Path:
+        return self.static_dir / "tables_needed.txt"
+
+    @property
+    def fingerprints_path(self) -> Path:
+        return (self.tenant_dir or self.static_dir) / "fingerprints.json"
+
+    @property
+    def table_info_path(self) -> Path:
+        return self.static_dir / "table_info.json"
+
+    @property
+    def mood_groups_path(self) -> Path:
+        return self.static_dir / "mood_groups.json"
+
+    @property
+    def fitbit_tokens_path(self) -> Path:
+        return self.state_dir / "fitbit_tokens.json"
+
+    @property
+    def fitbit_cache_dir(self) -> Path:
+        return self.state_dir / "fitbit_cache"
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Resolves the ETL configuration from the environment and .env once per process.
+    """
+    # imported here so importing the package stays free of side effects
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    base_dir = Path(os.getenv('DAYLIO_ETL_DIR', str(PROJECT_DIR)))
+    db_path = os.getenv('DB_PATH')
+    # relative database paths are relative to the project directory, as they
+    # were when the working directory was switched to it on import
+    if db_path and not Path(db_path).is_absolute():
+        db_path = str(base_dir / db_path)
+
+    return Settings(
+        base_dir=base_dir,
+        db_path=db_path,
+        pickup_dir=Path(os.getenv('DAYLIO_PICKUP_DIR',
+                                  'C:/Users/YourUsername/Downloads')),
+        fitbit_client_id=os.getenv('FITBIT_CLIENT_ID', 'your_client_id'),
+        fitbit_client_secret=os.getenv(
+            'FITBIT_CLIENT_SECRET', 'your_client_secret'),
+        fitbit_max_workers=int(os.getenv('FITBIT_MAX_WORKERS', '4')),
+        fitbit_settle_days=int(os.getenv('FITBIT_SETTLE_DAYS', '3')),
+        calendar_start=os.getenv('CALENDAR_START', '2018-01-01'),
+        calendar_horizon_days=int(os.getenv('CALENDAR_HORIZON_DAYS', '0')),
+        calendar_week_start=os.getenv('CALENDAR_WEEK_START', 'monday').lower(),
+        keep_deleted_rows=os.getenv(
+            'KEEP_DELETED_ROWS', '').lower() in ('1', 'true', 'yes'),
+        archive_retention=os.getenv(
+            'ARCHIVE_RETENTION', 'daily=30,weekly=12,monthly=24'),
+        tenant_dir=Path(os.environ['DAYLIO_TENANT_DIR']) if os.getenv(
+            'DAYLIO_TENANT_DIR') else None,
+    )
@@ -0,0 +1,282 @@
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import tempfile
+import pandas as pd
+
+from pathlib import Path
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+from log_setup import setup_logger
+from .table_cache import MANIFEST_NAME, TableCache
+from .fingerprints import digest_file, digest_records
+
+logger = setup_logger()
+
+SNAPSHOT_NAME = re.compile(r"^daylio_\d{8}_\d{4}$")
+SNAPSHOT_TIME_FORMAT = "%Y%m%d_%H%M"
+
+# bytes copied at a time when compressing into or streaming out of a blob
+COPY_CHUNK = 1 << 20
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    Keeps the newest snapshot of each of the last daily days, of each of the
+    last weekly ISO weeks and of each of the last monthly months. The newest
+    snapshot is always kept.
+    """
+    daily: int = 30
+    weekly: int = 12
+    monthly: int = 24
+
+    @classmethod
+    def parse(cls, text: str) -> "RetentionPolicy":
+        """
+        :param text: e.g. 'daily=30,weekly=12,monthly=24', missing keys keep their default
+        """
+        values = {}
+        for part in filter(None, (part.strip() for part in text.split(","))):
+            key, _, value = part.partition("=")
+            if key.strip() not in ("daily", "weekly", "monthly") or not value.strip().isdigit():
+                logger.error(f"Invalid archive retention '{text}'")
+                raise ValueError(f"Invalid archive retention '{text}', expected e.g. daily=30,weekly=12")
+            values[key.strip()] = int(value)
+        return cls(**values)
+
+    def kept(self, taken: dict[str, datetime], now: datetime | None = None) -> set[str]:
+        """
+        :param taken: Time each snapshot was taken, keyed by snapshot name
+        :return: Names of the snapshots to keep
+        """
+        if not taken:
+            return set()
+        now = now or datetime.now()
+        newest_first = sorted(taken, key=taken.get, reverse=True)
+        keep = {newest_first[0]}
+        buckets = [
+            (self.daily, lambda t: t.date(), lambda: now.date() - timedelta(days=self.daily)),
+            (self.weekly, lambda t: t.isocalendar()[:2],
+             lambda: (now - timedelta(weeks=self.weekly)).isocalendar()[:2]),
+            (self.monthly, lambda t: (t.year, t.month),
+             lambda: _months_back(now, self.monthly)),
+        ]
+        for count, bucket, oldest in buckets:
+            if count <= 0:
+                continue
+            cutoff = oldest()
+            seen = set()
+            for name in newest_first:
+                key = bucket(taken[name])
+                if key <= cutoff:
+                    break
+                if key not in seen:
+                    seen.add(key)
+                    keep.add(name)
+        return keep
+
+
+def _months_back(now: datetime, months: int) -> tuple[int, int]:
+    index = now.year * 12 + now.month - 1 - months
+    return index // 12, index % 12 + 1
+
+
+class ArchiveStore:
+    """
+    Snapshots of the table cache kept as gzip compressed, content addressed
+    blobs. Each snapshot is a small manifest under snapshots/ naming the blob
+    of every file in the cache, so a table that did not change between runs
+    is stored once however many snapshots hold it.
+
+        archive/
+            snapshots/daylio_20250101_0700.json
+            blobs/3f/3f9a...gz
+    """
+
+    def __init__(self, archive_dir: Path) -> None:
+        self.archive_dir = Path(archive_dir)
+        self.snapshots_dir = self.archive_dir / "snapshots"
+        self.blobs_dir = self.archive_dir / "blobs"
+
+    def _blob_path(self, digest: str) -> Path:
+        # fanned out on the first byte so no directory holds every blob
+        return self.blobs_dir / digest[:2] / f"{digest}.gz"
+
+    def _manifest_path(self, name: str) -> Path:
+        return self.snapshots_dir / f"{name}.json"
+
+    def _put_blob(self, path: Path) -> tuple[str, bool]:
+        """
+        :return: Digest of the file and whether a new blob was written for it
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(COPY_CHUNK), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        blob_path = self._blob_path(digest)
+        if blob_path.exists():
+            return digest, False
+
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        # written beside the blob and renamed so a half written blob is never shared
+        with tempfile.NamedTemporaryFile(dir=blob_path.parent, suffix=".tmp", delete=False) as tmp:
+            with open(path, "rb") as file, gzip.GzipFile(fileobj=tmp, mode="wb", mtime=0) as gz:
+                shutil.copyfileobj(file, gz, COPY_CHUNK)
+        Path(tmp.name).replace(blob_path)
+        return digest, True
+
+    def add(self, cache_dir: Path, taken: datetime | None = None) -> str | None:
+        """
+        Archives the table cache in cache_dir as a snapshot.
+
+        :return: Name of the snapshot, or None if there is no cache to archive
+        """
+        cache_dir = Path(cache_dir)
+        if not (cache_dir / MANIFEST_NAME).exists():
+            logger.info("No table cache written, nothing to archive")
+            return None
+
+        taken = taken or datetime.now()
+        name = f"daylio_{taken.strftime(SNAPSHOT_TIME_FORMAT)}"
+        files, new_blobs = {}, 0
+        for path in sorted(cache_dir.iterdir()):
+            if path.name == MANIFEST_NAME or not path.is_file():
+                continue
+            digest, written = self._put_blob(path)
+            files[path.name] = {"blob": digest, "size": path.stat().st_size}
+            new_blobs += written
+
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        # the manifest is written last, a snapshot only exists once its blobs do
+        self._manifest_path(name).write_text(json.dumps({
+            "taken": taken.isoformat(timespec="seconds"),
+            "cache_manifest": json.loads((cache_dir / MANIFEST_NAME).read_text()),
+            "files": files,
+        }))
+        logger.info(f"Archived snapshot {name}, {new_blobs} of {len(files)} files were new")
+        return name
+
+    def snapshots(self) -> dict[str, datetime]:
+        """
+        :return: Time each snapshot was taken, keyed by snapshot name
+        """
+        if not self.snapshots_dir.exists():
+            return {}
+        return {path.stem: datetime.strptime(path.stem[len("daylio_"):], SNAPSHOT_TIME_FORMAT)
+                for path in self.snapshots_dir.glob("daylio_*.json")
+                if SNAPSHOT_NAME.match(path.stem)}
+
+    def manifest(self, name: str) -> dict:
+        path = self._manifest_path(name)
+        if not path.exists():
+            logger.error(f"Archive snapshot {name} does not exist in {self.archive_dir}")
+            raise FileNotFoundError(f"Snapshot {name} does not exist")
+        return json.loads(path.read_text())
+
+    def open_file(self, name: str, file_name: str):
+        """
+        :return: Binary stream of one file of a snapshot, decompressed as it is read
+        """
+        files = self.manifest(name)["files"]
+        if file_name not in files:
+            raise FileNotFoundError(f"{file_name} is not in snapshot {name}")
+        return gzip.open(self._blob_path(files[file_name]["blob"]), "rb")
+
+    def restore(self, name: str, target_dir: Path, tables: list[str] | None = None) -> Path:
+        """
+        Writes a snapshot back out as a table cache, readable with TableCache.
+        Each blob is streamed to its file, only the snapshot's own blobs are read.
+
+        :param tables: Restore only these tables, all of them by default
+        :return: The target directory
+        """
+        manifest = self.manifest(name)
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        cache_manifest = dict(manifest["cache_manifest"])
+        if tables is not None:
+            cache_manifest["tables"] = {table: fmt for table, fmt in cache_manifest["tables"].items()
+                                        if table in tables}
+
+        for file_name in manifest["files"]:
+            if Path(file_name).stem not in cache_manifest["tables"]:
+                continue
+            with self.open_file(name, file_name) as blob, open(target_dir / file_name, "wb") as out:
+                shutil.copyfileobj(blob, out, COPY_CHUNK)
+        (target_dir / MANIFEST_NAME).write_text(json.dumps(cache_manifest))
+        return target_dir
+
+    def prune(self, policy: RetentionPolicy, now: datetime | None = None) -> tuple[list[str], int]:
+        """
+        Drops the snapshots the policy doesn't keep, then garbage collects the
+        blobs no remaining snapshot refers to.
+
+        :return: Names of the dropped snapshots and the number of blobs deleted
+        """
+        taken = self.snapshots()
+        kept = policy.kept(taken, now)
+        dropped = sorted(name for name in taken if name not in kept)
+        for name in dropped:
+            self._manifest_path(name).unlink()
+        deleted = self.collect_garbage()
+        if dropped or deleted:
+            logger.info(f"Pruned {len(dropped)} archive snapshots and {deleted} unused blobs")
+        return dropped, deleted
+
+    def collect_garbage(self) -> int:
+        """
+        :return: Number of blobs deleted because no snapshot refers to them
+        """
+        if not self.blobs_dir.exists():
+            return 0
+        referenced = {entry["blob"] for name in self.snapshots()
+                      for entry in self.manifest(name)["files"].values()}
+        deleted = 0
+        for blob_path in self.blobs_dir.glob("*/*"):
+            # leftovers of interrupted writes go too
+            if blob_path.suffix == ".tmp" or blob_path.name[:-len(".gz")] not in referenced:
+                blob_path.unlink()
+                deleted += 1
+        return deleted
+
+    def import_legacy(self) -> list[str]:
+        """
+        Moves snapshots archived as full copies of the table cache
+        (archive/daylio_YYYYMMDD_HHMM/), or before the cache existed as
+        copies of the decoded json (archive/daylio_YYYYMMDD_HHMM.json), into
+        the store.
+
+        :return: Names of the imported snapshots
+        """
+        imported = []
+        if not self.archive_dir.exists():
+            return imported
+        for path in sorted(self.archive_dir.iterdir()):
+            if path.is_dir() and SNAPSHOT_NAME.match(path.name) and (path / MANIFEST_NAME).exists():
+                taken = datetime.strptime(path.name[len("daylio_"):], SNAPSHOT_TIME_FORMAT)
+                imported.append(self.add(path, taken))
+                shutil.rmtree(path)
+            elif path.is_file() and path.suffix == ".json" and SNAPSHOT_NAME.match(path.stem):
+                taken = datetime.strptime(path.stem[len("daylio_"):], SNAPSHOT_TIME_FORMAT)
+                imported.append(self._import_json(path, taken))
+                path.unlink()
+        if imported:
+            logger.info(f"Moved {len(imported)} archived cache copies into the archive store")
+        return imported
+
+    def _import_json(self, path: Path, taken: datetime) -> str:
+        """
+        Archives a json copy of the decoded tables as a snapshot of the table
+        cache it would have been, so it restores like any other snapshot.
+        """
+        daylio_data = json.loads(path.read_text(encoding="utf-8"))
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TableCache(Path(tmp) / "cache")
+            cache.write(digest_file(path),
+                        {name: pd.DataFrame(records) for name, records in daylio_data.items()},
+                        {name: digest_records(records) for name, records in daylio_data.items()})
+            return self.add(cache.cache_dir, taken)
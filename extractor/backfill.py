@@ -0,0 +1,256 @@
+import os
+import re
+import json
+import tempfile
+import pandas as pd
+
+from pathlib import Path
+from datetime import datetime
+from collections import deque
+from contextlib import closing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from log_setup import setup_logger
+from .data_extractor import Extractor
+from .table_cache import TableCache, MANIFEST_NAME
+from .archive import ArchiveStore
+from .fingerprints import FingerprintStore, digest_file, digest_records
+
+logger = setup_logger()
+
+# backups are named by the app, archive snapshots by Extractor.archive_snapshot
+BACKUP_NAME = re.compile(r"backup_(\d{4})_(\d{2})_(\d{2})")
+ARCHIVE_NAME = re.compile(r"daylio_(\d{8})_(\d{4})")
+# archives from before the table cache were full copies of the decoded json
+LEGACY_JSON_NAME = re.compile(r"^daylio_\d{8}_\d{4}\.json$")
+
+# rows are deduplicated on these columns, every other Daylio table uses id
+BACKFILL_KEYS = {
+    "prefs": ["key"],
+}
+
+# merged frames record the backup each row came from in this column
+SOURCE_COLUMN = "_backup"
+
+
+@dataclass
+class BackupSource:
+    path: Path
+    taken: datetime
+
+    @property
+    def is_archive(self) -> bool:
+        # a cache copy from before the archive store, a store snapshot's
+        # manifest, or a json copy from before the table cache
+        return self.path.is_dir() or self.path.suffix == ".json"
+
+
+def _is_store_snapshot(path: Path) -> bool:
+    # ArchiveStore keeps its snapshot manifests under snapshots/
+    return path.suffix == ".json" and path.parent.name == "snapshots"
+
+
+@dataclass
+class BackfillReport:
+    sources: list[BackupSource]
+    merged_rows: dict[str, int] = field(default_factory=dict)
+    # rows whose newest copy is in an older backup than the latest one
+    older_only: dict[str, pd.DataFrame] = field(default_factory=dict)
+
+    def to_json(self) -> dict:
+        return {
+            "sources": [str(source.path) for source in self.sources],
+            "merged_rows": self.merged_rows,
+            "older_only": {
+                table: rows.assign(last_seen=rows["last_seen"].astype(str)).to_dict("records")
+                for table, rows in self.older_only.items()
+            },
+        }
+
+
+def backup_taken(path: Path) -> datetime:
+    """
+    Date a backup or archive snapshot was taken, read from its name and
+    falling back to the file's modification time.
+    """
+    match = BACKUP_NAME.search(path.name)
+    if match:
+        return datetime(*map(int, match.groups()))
+    match = ARCHIVE_NAME.search(path.name)
+    if match:
+        return datetime.strptime("".join(match.groups()), "%Y%m%d%H%M")
+    return datetime.fromtimestamp(path.stat().st_mtime)
+
+
+def find_sources(backup_dir: Path) -> list[BackupSource]:
+    """
+    :param backup_dir: Directory of backup_*.daylio files and/or archive
+        snapshots, an archive store's directory included
+    :return: Backups, archived table caches and archived json copies, oldest first
+    """
+    if not backup_dir.exists():
+        logger.error(f"Backfill directory {backup_dir} does not exist.")
+        raise FileNotFoundError(f"{backup_dir} does not exist")
+
+    paths = [path for path in backup_dir.iterdir()
+             if (path.is_file() and path.suffix == ".daylio")
+             or (path.is_file() and LEGACY_JSON_NAME.match(path.name))
+             or (path.is_dir() and (path / MANIFEST_NAME).exists())]
+    store = ArchiveStore(backup_dir)
+    paths.extend(store.snapshots_dir / f"{name}.json" for name in store.snapshots())
+    return sorted((BackupSource(path, backup_taken(path)) for path in paths),
+                  key=lambda source: (source.taken, source.path.name))
+
+
+def _read_source(path: Path, selected_tables: list[str]) -> tuple[dict[str, pd.DataFrame], dict[str, str], str]:
+    """
+    Decodes one backup, or reads one archived table cache, in a worker process.
+
+    :return: Tables, per table digests, and the source fingerprint
+    """
+    if path.is_dir():
+        return _read_cache(path, selected_tables)
+    if path.suffix == ".json" and not _is_store_snapshot(path):
+        return _read_legacy_json(path, selected_tables)
+    if path.suffix == ".json":
+        # snapshots are restored one at a time, the rest of the store stays compressed
+        with tempfile.TemporaryDirectory() as tmp:
+            ArchiveStore(path.parent.parent).restore(path.stem, Path(tmp), selected_tables)
+            tables, digests, source = _read_cache(Path(tmp), selected_tables)
+            # copied off the memory mapped files before they are removed
+            return {name: df.copy() for name, df in tables.items()}, digests, source
+
+    with closing(Extractor.extract_backup(path)) as backup_chunks:
+        daylio_data, digests = Extractor.decode_backup_to_json(
+            backup_chunks, selected_tables)
+    return Extractor.build_frames(daylio_data), digests, Extractor.backup_fingerprint(path)
+
+
+def _read_cache(path: Path, selected_tables: list[str]) -> tuple[dict[str, pd.DataFrame], dict[str, str], str]:
+    cache = TableCache(path)
+    manifest = json.loads((path / MANIFEST_NAME).read_text())
+    tables = cache.read()
+    if tables is None:
+        raise ValueError(f"Archive {path} could not be read, is pyarrow installed?")
+    return ({name: tables[name] for name in selected_tables if name in tables},
+            cache.digests, manifest["source"])
+
+
+def _read_legacy_json(path: Path, selected_tables: list[str]) -> tuple[dict[str, pd.DataFrame], dict[str, str], str]:
+    daylio_data = json.loads(path.read_text(encoding="utf-8"))
+    daylio_data = {name: records for name, records in daylio_data.items() if name in selected_tables}
+    # digested from the records, a later backup of the same tables reloads them once
+    digests = {name: digest_records(records) for name, records in daylio_data.items()}
+    return Extractor.build_frames(daylio_data), digests, digest_file(path)
+
+
+def merge_source(merged: dict[str, pd.DataFrame], position: int, tables: dict[str, pd.DataFrame]) -> None:
+    """
+    Folds one backup's tables into the running merge, its rows replacing the
+    copies older backups had. Sources must be folded in oldest first.
+
+    :param merged: Running merge per table, updated in place
+    :param position: Position of the backup among the sources
+    :param tables: Tables decoded from the backup
+    """
+    for name, table in tables.items():
+        frame = table.assign(**{SOURCE_COLUMN: position})
+        if name in merged:
+            frame = pd.concat([merged[name], frame], ignore_index=True)
+        # the newer backup's rows come last, so the last copy is the newest
+        merged[name] = frame.drop_duplicates(subset=BACKFILL_KEYS.get(name, ["id"]), keep="last")
+
+
+def finish_merge(sources: list[BackupSource],
+                 merged: dict[str, pd.DataFrame]) -> tuple[dict[str, pd.DataFrame], BackfillReport]:
+    """
+    :param sources: Backups oldest first
+    :param merged: Running merge every source was folded into
+    :return: Merged tables and a report of rows missing from the latest backup
+    """
+    report = BackfillReport(sources=sources)
+    latest = len(sources) - 1
+    for name, table in merged.items():
+        keys = BACKFILL_KEYS.get(name, ["id"])
+        older = table[table[SOURCE_COLUMN] != latest]
+        if len(older):
+            report.older_only[name] = pd.DataFrame({
+                **{key: older[key].to_numpy() for key in keys},
+                "last_seen": [sources[position].taken for position in older[SOURCE_COLUMN]],
+            })
+        merged[name] = table.drop(columns=SOURCE_COLUMN).reset_index(drop=True)
+        report.merged_rows[name] = len(merged[name])
+    return merged, report
+
+
+def merge_tables(sources: list[BackupSource],
+                 tables_by_source: list[dict[str, pd.DataFrame]]) -> tuple[dict[str, pd.DataFrame], BackfillReport]:
+    """
+    Merges the same table from every backup, keeping the copy of each row from
+    the newest backup that has it.
+
+    :param sources: Backups oldest first
+    :param tables_by_source: Tables decoded from each backup, in the same order
+    :return: Merged tables and a report of rows missing from the latest backup
+    """
+    merged = {}
+    for position, tables in enumerate(tables_by_source):
+        merge_source(merged, position, tables)
+    return finish_merge(sources, merged)
+
+
+def _read_in_order(pool: ProcessPoolExecutor, paths: list[Path], selected_tables: list[str],
+                   in_flight: int):
+    """
+    Yields each source's decoded tables in source order, with at most
+    in_flight sources decoded or decoding ahead of the one being merged.
+    """
+    pending = deque()
+    for path in paths:
+        pending.append(pool.submit(_read_source, path, selected_tables))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def backfill_daylio_data(fingerprints: FingerprintStore, backup_dir: Path,
+                         max_workers: int | None = None) -> tuple[dict[str, pd.DataFrame], BackfillReport]:
+    """
+    Decodes every backup in the directory in a process pool and merges them
+    into one set of tables, newest backup winning for rows found in several.
+    Each backup is merged as soon as it and the older ones are decoded, so
+    only the running merge and the backups in flight are held in memory.
+    The fingerprints are moved to the latest backup so the next regular run
+    only reloads what a newer backup changes.
+
+    :param fingerprints: Store of table hashes from the last successful load
+    :param backup_dir: Directory of backups and/or archive snapshots
+    :param max_workers: Decoding processes, defaults to the number of CPUs
+    :return: Merged tables and the backfill report
+    """
+    sources = find_sources(Path(backup_dir))
+    if not sources:
+        logger.error(f"No backups or archives found in {backup_dir}.")
+        raise FileNotFoundError(f"No backups found in {backup_dir}")
+
+    selected_tables = Extractor.get_selected_tables()
+    logger.info(f"Backfilling from {len(sources)} backups in {backup_dir}")
+    workers = max_workers or os.cpu_count() or 1
+    merged = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        decoded = _read_in_order(pool, [source.path for source in sources], selected_tables, workers)
+        for position, (tables, digests, source_fingerprint) in enumerate(decoded):
+            merge_source(merged, position, tables)
+            # sources come oldest first, the last one kept is the latest backup's
+            latest = (digests, source_fingerprint)
+
+    merged, report = finish_merge(sources, merged)
+    latest_digests, latest_fingerprint = latest
+    fingerprints.changed('backup', latest_fingerprint)
+    for name, digest in latest_digests.items():
+        fingerprints.changed(name, digest)
+
+    for name, rows in report.older_only.items():
+        logger.info(f"{len(rows)} rows of {name} exist only in backups older than the latest")
+    return merged, report
@@ -0,0 +1,193 @@
+import re
+import json
+import base64
+import codecs
+import hashlib
+
+from typing import IO, Iterable, Iterator
+
+# size of each raw read from the zipped backup member, a multiple of 4 so
+# base64 quanta line up without carrying bytes between reads in the common case
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r'\s*')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURAL = re.compile(r'["{}\[\],]')
+
+
+def iter_base64_text(raw: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Decodes a base64 encoded utf-8 stream in fixed size chunks.
+
+    :param raw: Binary file-like object holding base64 text
+    :param chunk_size: Number of raw bytes to read per chunk
+    :return: Iterator of decoded text chunks
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    carry = b""
+    while True:
+        chunk = raw.read(chunk_size)
+        if not chunk:
+            break
+        # drop any line breaks so the 4 byte quanta stay aligned
+        chunk = carry + b"".join(chunk.split())
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        if usable:
+            text = utf8.decode(base64.b64decode(chunk[:usable]))
+            if text:
+                yield text
+
+    if carry:
+        raise ValueError("Backup ended with an incomplete base64 block.")
+    tail = utf8.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class JsonObjectStream:
+    """
+    Walks the top level of a JSON object fed in text chunks, parsing only the
+    members that are asked for and skipping over the rest without building them.
+    """
+
+    def __init__(self, chunks: Iterable[str]) -> None:
+        self._chunks = iter(chunks)
+        self._buf = ""
+        self._pos = 0
+        # sha256 of the raw json text of every member returned by select()
+        self.digests = {}
+
+    def _fill(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _next_char(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                char = self._buf[self._pos]
+                self._pos += 1
+                return char
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream.")
+
+    def _scan_value(self, keep: bool) -> str | None:
+        """
+        Scans one JSON value starting at the current position. Kept values are
+        returned as raw JSON text, skipped values are discarded as they stream past.
+        """
+        parts = []
+        depth = 0
+        in_string = False
+        i = self._pos
+        while True:
+            buf = self._buf
+            end = None
+            if in_string:
+                match = _STRING_SPECIAL.search(buf, i)
+                if match and match.group() == "\\" and match.end() < len(buf):
+                    i = match.end() + 1
+                    continue
+                if match and match.group() == '"':
+                    in_string = False
+                    i = match.end()
+                    if depth == 0:
+                        end = i
+                    else:
+                        continue
+                else:
+                    # no closing quote yet, or an escape split across chunks
+                    i = match.start() if match else len(buf)
+            else:
+                match = _STRUCTURAL.search(buf, i)
+                if match:
+                    char = match.group()
+                    if char == '"':
+                        in_string = True
+                        i = match.end()
+                        continue
+                    if char in "{[":
+                        depth += 1
+                        i = match.end()
+                        continue
+                    if depth == 0:
+                        # a scalar ended by the parent's ',' or '}'
+                        end = match.start()
+                    elif char == ",":
+                        i = match.end()
+                        continue
+                    else:
+                        depth -= 1
+                        i = match.end()
+                        if depth == 0:
+                            end = i
+                        else:
+                            continue
+                else:
+                    i = len(buf)
+
+            if end is not None:
+                text = buf[self._pos:end]
+                self._pos = end
+                if keep:
+                    parts.append(text)
+                    return "".join(parts)
+                return None
+
+            # everything up to i has been scanned, pull the next chunk
+            if keep:
+                parts.append(buf[self._pos:i])
+            self._pos = i
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream.")
+            i = 0
+
+    def select(self, names: Iterable[str]) -> dict:
+        """
+        Parses the requested top level members, stopping as soon as all of them
+        have been read.
+
+        :param names: Member names to keep
+        :return: Dict of member name to parsed value
+        """
+        wanted = set(names)
+        selected = {}
+        if self._next_char() != "{":
+            raise ValueError("Backup JSON does not start with an object.")
+        if not wanted:
+            return selected
+
+        char = self._next_char()
+        if char == "}":
+            return selected
+        self._pos -= 1
+
+        while True:
+            if self._next_char() != '"':
+                raise ValueError("Expected a member name in backup JSON.")
+            self._pos -= 1
+            key = json.loads(self._scan_value(keep=True))
+            if self._next_char() != ":":
+                raise ValueError(f"Expected ':' after member '{key}'.")
+            self._next_char()
+            self._pos -= 1
+
+            keep = key in wanted
+            text = self._scan_value(keep=keep)
+            if keep:
+                selected[key] = json.loads(text)
+                self.digests[key] = hashlib.sha256(
+                    text.encode("utf-8")).hexdigest()
+                if len(selected) == len(wanted):
+                    return selected
+
+            char = self._next_char()
+            if char == "}":
+                return selected
+            if char != ",":
+                raise ValueError(f"Unexpected '{char}' after member '{key}'.")
@@ -1,50 +1,28 @@
 from pathlib import Path
 from datetime import datetime
 import os
-import base64
-import json
 import zipfile as zf
-import shutil
+import pandas as pd
+from contextlib import closing
+from typing import Iterator
+from config import get_settings
 from log_setup import setup_logger
-from dotenv import load_dotenv
-load_dotenv()
-
-# Module-level config
-EXPECTED_CWD = os.getenv('EXPECTED_WD', 'daylio-data-cleaner')
+from log_setup.metrics import span
+from .backup_stream import iter_base64_text, JsonObjectStream
+from .table_cache import TableCache
+from .archive import ArchiveStore, RetentionPolicy
+from .fingerprints import FingerprintStore
 
 logger = setup_logger()
 
-
-def set_cwd(expected_cwd=EXPECTED_CWD) -> None:
-    if Path.cwd().name != expected_cwd:
-        logger.info(
-            f"CWD not '{expected_cwd}' searching for correct directory...")
-        for folder in Path.home().rglob(expected_cwd):
-            if folder.is_dir() and folder.name == expected_cwd:
-                logger.info(
-                    f"'{expected_cwd}' directory found, changing working directory")
-                os.chdir(str(folder))
-                break
-        else:
-            logger.error(f"'{expected_cwd}' does not exist on this system")
-            raise FileNotFoundError(f'{expected_cwd} does not exist')
-
-
-# Ensure correct working directory
-set_cwd()
-
-PICKUP_DIR = Path(os.getenv('DAYLIO_PICKUP_DIR',
-                  'C:/Users/YourUsername/Downloads'))
-DATA_DIR = Path.cwd() / "data"
-JSON_PATH = DATA_DIR / "daylio.json"
-SELECTED_TABLES_PATH = DATA_DIR / "static" / "tables_needed.txt"
-LAST_UPDATED_PATH = DATA_DIR / "static" / "last_updated.txt"
+BACKUP_MEMBER = "backup.daylio"
 
 
 class Extractor:
 
     @staticmethod
-    def find_backup_file(pickup_dir: Path = PICKUP_DIR) -> Path | None:
+    def find_backup_file(pickup_dir: Path | None = None) -> Path | None:
+        pickup_dir = pickup_dir or get_settings().pickup_dir
         pickup_path = Path(pickup_dir, datetime.today().strftime(
             'backup_%Y_%m_%d.daylio'))
         logger.info(f"Searching for todays backup file: {pickup_path.name}")
@@ -60,7 +38,8 @@ class Extractor:
             raise FileNotFoundError(f"{pickup_path} does not exist")
 
     @staticmethod
-    def get_latest_backup(pickup_dir: Path = PICKUP_DIR) -> Path | None:
+    def get_latest_backup(pickup_dir: Path | None = None) -> Path | None:
+        pickup_dir = pickup_dir or get_settings().pickup_dir
         if not pickup_dir.exists():
             logger.error(f"Pickup directory {pickup_dir} does not exist.")
             raise FileNotFoundError(f"{pickup_dir} does not exist")
@@ -72,7 +51,8 @@ class Extractor:
         return max(files, key=os.path.getctime, default=None)
 
     @staticmethod
-    def get_selected_tables(selected_tables_path: Path = SELECTED_TABLES_PATH) -> list[str]:
+    def get_selected_tables(selected_tables_path: Path | None = None) -> list[str]:
+        selected_tables_path = selected_tables_path or get_settings().selected_tables_path
         if not selected_tables_path.exists():
             logger.error(
                 f"Selected tables file {selected_tables_path} does not exist.")
@@ -80,79 +60,102 @@ class Extractor:
         return [table.strip() for table in selected_tables_path.read_text().split('\n') if table.strip()]
 
     @staticmethod
-    def extract_backup(pickup_path: Path, data_dir: Path = DATA_DIR):
+    def extract_backup(pickup_path: Path) -> Iterator[str]:
         logger.info(
-            "Extracting zipped data from backup file into data directory")
+            "Streaming backup.daylio out of the zipped backup file")
         with zf.ZipFile(pickup_path, 'r') as zr:
-            zr.extractall(data_dir)
-            # remove assets folder from extraction, it is not needed
-            assets_path = data_dir / "assets"
-            if assets_path.exists():
-                shutil.rmtree(assets_path)
+            # only the backup member is read, assets are never extracted
+            if BACKUP_MEMBER not in zr.namelist():
+                logger.error(
+                    f"{BACKUP_MEMBER} not found in backup file {pickup_path.name}")
+                raise FileNotFoundError(
+                    f"{BACKUP_MEMBER} does not exist in {pickup_path}")
+            with zr.open(BACKUP_MEMBER) as backup:
+                yield from iter_base64_text(backup)
 
     @staticmethod
-    def decode_backup_to_json(data_dir: Path = DATA_DIR):
-        backup_path = data_dir / "backup.daylio"
-        logger.info('Decoding backup from base64 to utf-8')
-        with open(str(backup_path), 'r') as backup:
-            contents = base64.b64decode(backup.read()).decode("utf-8")
-        data = json.loads(contents)
-        return data
+    def decode_backup_to_json(backup_chunks: Iterator[str], selected_tables: list[str]) -> tuple[dict, dict[str, str]]:
+        logger.info('Decoding selected tables from base64 backup stream')
+        stream = JsonObjectStream(backup_chunks)
+        data = stream.select(selected_tables)
+        missing = [table for table in selected_tables if table not in data]
+        if missing:
+            logger.error(f"Tables missing from backup: {', '.join(missing)}")
+            raise ValueError(f"Backup is missing tables: {missing}")
+        return data, stream.digests
 
     @staticmethod
-    def save_to_json(daylio_data: dict, selected_tables: list[str], json_path: Path = JSON_PATH):
-        selected_tables_data = {
-            table: daylio_data[table] for table in selected_tables}
-        if json_path.exists():
-            os.remove(json_path)
-        logger.info(f'Saving decoded data as json: {json_path}')
-        with open(str(json_path), "w", encoding='utf-8') as j:
-            json.dump(selected_tables_data, j, indent=4)
+    def build_frames(daylio_data: dict) -> dict[str, pd.DataFrame]:
+        logger.info('Building DataFrames from decoded tables')
+        return {table: pd.DataFrame(records) for table, records in daylio_data.items()}
 
     @staticmethod
-    def archive_json(json_path: Path = JSON_PATH, data_dir: Path = DATA_DIR):
-        # create date string for archive name
-        date_str = datetime.today().strftime('%Y%m%d_%H%M')
-        # Create archive path
-        archive_path = data_dir / "archive" / f"daylio_{date_str}.json"
-        logger.info(
-            f"Creating archive copy of todays json file: {archive_path.name}")
-
-        # make directory if it does not exist
-        archive_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # erase existing archive if it exists
-        if archive_path.exists():
-            os.remove(archive_path)
-
-        # copy json to archive
-        shutil.copy(json_path, archive_path)
+    def archive_snapshot(cache_dir: Path | None = None, archive_dir: Path | None = None) -> str | None:
+        settings = get_settings()
+        store = ArchiveStore(archive_dir or settings.archive_dir)
+        # archives from before the store held a full copy of the cache per run
+        store.import_legacy()
+        name = store.add(cache_dir or settings.cache_dir)
+        store.prune(RetentionPolicy.parse(settings.archive_retention))
+        return name
 
     @staticmethod
-    def is_new_data(file_name: str) -> bool:
-        if LAST_UPDATED_PATH.exists():
-            last_updated = LAST_UPDATED_PATH.read_text().strip()
-            if last_updated == file_name:
-                logger.info("Data has already been processed.")
-                return False
-            else:
-                LAST_UPDATED_PATH.write_text(file_name)
-                return True
-        else:
-            LAST_UPDATED_PATH.write_text(file_name)
-            return True
-
-
-def extract_daylio_data():
-    backup_file = Extractor.find_backup_file()
-    if backup_file and Extractor.is_new_data(backup_file.name):
-        Extractor.extract_backup(backup_file)
-        daylio_data = Extractor.decode_backup_to_json()
-        selected_tables = Extractor.get_selected_tables()
-        Extractor.save_to_json(daylio_data, selected_tables)
-        Extractor.archive_json()
-    else:
+    def backup_fingerprint(pickup_path: Path) -> str:
+        # crc and size of the backup member come from the zip directory, so
+        # an unchanged backup is recognised without decompressing anything
+        with zf.ZipFile(pickup_path, 'r') as zr:
+            info = zr.getinfo(BACKUP_MEMBER)
+        return f"{info.CRC:08x}-{info.file_size}"
+
+
+def extract_daylio_data(fingerprints: FingerprintStore,
+                        cache: TableCache | None = None,
+                        force: bool = False,
+                        backup_file: Path | None = None) -> dict[str, pd.DataFrame] | None:
+    """
+    Extracts the Daylio tables whose contents changed since the last load.
+
+    :param fingerprints: Store of table hashes from the last successful load
+    :param cache: Table cache used to skip decoding on re-runs
+    :param force: Return every selected table even if it is unchanged
+    :param backup_file: Backup to load, the pickup directory is searched if not given
+    :return: Dict of table name to DataFrame, or None if there is no backup
+    """
+    cache = cache or TableCache(get_settings().cache_dir)
+    backup_file = backup_file or Extractor.find_backup_file()
+    if not backup_file:
         logger.warning("No data to extract.")
+        return None
+
+    backup_digest = Extractor.backup_fingerprint(backup_file)
+    if not fingerprints.changed('backup', backup_digest) and not force:
+        logger.info(f"{backup_file.name} has already been processed.")
+        return {}
+
+    with span("extract.cache_read") as read_span:
+        tables = cache.read(backup_digest)
+        read_span.rows_out = sum(map(len, tables.values())) if tables else 0
+    digests = cache.digests
+    if tables is None:
+        selected_tables = Extractor.get_selected_tables()
+        # closing releases the zip handle once the last selected table is read
+        with span("extract.decode_backup", bytes_read=backup_file.stat().st_size) as decode_span, \
+                closing(Extractor.extract_backup(backup_file)) as backup_chunks:
+            daylio_data, digests = Extractor.decode_backup_to_json(
+                backup_chunks, selected_tables)
+            decode_span.rows_out = sum(map(len, daylio_data.values()))
+        with span("extract.build_frames", rows_in=decode_span.rows_out) as frames_span:
+            tables = Extractor.build_frames(daylio_data)
+            frames_span.rows_out = sum(map(len, tables.values()))
+        with span("extract.cache_write", rows_in=frames_span.rows_out):
+            cache.write(backup_digest, tables, digests)
+        with span("extract.archive_snapshot"):
+            Extractor.archive_snapshot(cache.cache_dir)
+
+    return {
+        name: table for name, table in tables.items()
+        if fingerprints.changed(name, digests[name]) or force
+    }
 
 
 if __name__ == "__main__":
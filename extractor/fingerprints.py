@@ -0,0 +1,54 @@
+import json
+import hashlib
+
+from pathlib import Path
+from log_setup import setup_logger
+
+logger = setup_logger()
+
+
+def digest_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def digest_records(records) -> str:
+    """
+    Content hash of any json serialisable payload, independent of key order.
+    """
+    return digest_text(json.dumps(records, sort_keys=True, separators=(",", ":"), default=str))
+
+
+def digest_file(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+class FingerprintStore:
+    """
+    Content hashes of the last successfully loaded version of each table.
+    New hashes are only held in memory until save() is called, so a run that
+    fails part way through is picked up again on the next run.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.fingerprints = json.loads(
+            self.path.read_text()) if self.path.exists() else {}
+        self.pending = {}
+
+    def changed(self, name: str, digest: str) -> bool:
+        self.pending[name] = digest
+        if self.fingerprints.get(name) == digest:
+            logger.info(f"'{name}' unchanged since last load, skipping")
+            return False
+        return True
+
+    def reset(self) -> None:
+        self.fingerprints = {}
+
+    def save(self) -> None:
+        if not self.pending:
+            return
+        self.fingerprints.update(self.pending)
+        self.pending = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.fingerprints, indent=4))
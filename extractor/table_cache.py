@@ -0,0 +1,101 @@
+import json
+import shutil
+import pandas as pd
+
+from pathlib import Path
+from log_setup import setup_logger
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # pyarrow is optional, without it every table is cached as json
+    pa = None
+    feather = None
+
+logger = setup_logger()
+
+MANIFEST_NAME = "manifest.json"
+
+
+class TableCache:
+    """
+    Per-table columnar snapshot of the selected Daylio tables. Tables are stored
+    as uncompressed Feather files so re-runs can memory-map them instead of
+    decoding the backup and building DataFrames again. Tables arrow cannot
+    represent (e.g. prefs, whose values mix types) fall back to compact JSON,
+    as does every table when pyarrow is not installed, so the cache and the
+    archive built from it are kept either way.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = self.cache_dir / MANIFEST_NAME
+
+    def _read_manifest(self) -> dict | None:
+        if not self.manifest_path.exists():
+            return None
+        return json.loads(self.manifest_path.read_text())
+
+    def write(self, source: str, tables: dict[str, pd.DataFrame], digests: dict[str, str]) -> None:
+        if feather is None:
+            logger.info("pyarrow not installed, caching every table as json")
+        logger.info(f"Writing table cache to {self.cache_dir}")
+        if self.cache_dir.exists():
+            shutil.rmtree(self.cache_dir)
+        self.cache_dir.mkdir(parents=True)
+
+        formats = {}
+        for name, df in tables.items():
+            if feather is not None:
+                try:
+                    feather.write_feather(
+                        df, self.cache_dir / f"{name}.feather", compression="uncompressed")
+                    formats[name] = "feather"
+                    continue
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    logger.info(
+                        f"Table '{name}' is not arrow compatible, caching as json")
+                    (self.cache_dir / f"{name}.feather").unlink(missing_ok=True)
+            (self.cache_dir / f"{name}.json").write_text(
+                df.to_json(orient="records"), encoding="utf-8")
+            formats[name] = "json"
+
+        # manifest is written last so a partial cache is never picked up
+        self.manifest_path.write_text(json.dumps(
+            {"source": source, "tables": formats, "digests": digests}))
+
+    def read(self, source: str | None = None) -> dict[str, pd.DataFrame] | None:
+        """
+        Loads the cached tables.
+
+        :param source: Backup fingerprint the cache must have been built from
+        :return: Dict of table name to DataFrame, or None if there is no usable cache
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            return None
+        if source is not None and manifest["source"] != source:
+            logger.info(
+                f"Table cache was built from {manifest['source']}, not {source}")
+            return None
+
+        if feather is None and "feather" in manifest["tables"].values():
+            logger.info("Table cache holds feather tables, pyarrow is not installed to read them")
+            return None
+
+        logger.info(f"Reading tables from cache built from {manifest['source']}")
+        tables = {}
+        for name, fmt in manifest["tables"].items():
+            if fmt == "feather":
+                tables[name] = feather.read_table(
+                    self.cache_dir / f"{name}.feather", memory_map=True).to_pandas()
+            else:
+                records = json.loads(
+                    (self.cache_dir / f"{name}.json").read_text(encoding="utf-8"))
+                tables[name] = pd.DataFrame(records)
+        return tables
+
+    @property
+    def digests(self) -> dict[str, str]:
+        manifest = self._read_manifest()
+        return manifest.get("digests", {}) if manifest else {}
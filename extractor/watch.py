@@ -0,0 +1,163 @@
+import os
+import time
+import zipfile as zf
+
+from pathlib import Path
+from datetime import datetime
+from log_setup import setup_logger
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # inotify_simple is optional, without it the directory is polled
+    INotify = None
+    flags = None
+
+logger = setup_logger()
+
+BACKUP_PREFIX = "backup_"
+BACKUP_SUFFIX = ".daylio"
+
+
+def is_backup_name(name: str) -> bool:
+    return name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)
+
+
+def is_complete_backup(path: Path) -> bool:
+    # the zip directory sits at the end of the file, a partial copy has none
+    try:
+        with zf.ZipFile(path, 'r') as zr:
+            return "backup.daylio" in zr.namelist()
+    except (OSError, zf.BadZipFile):
+        return False
+
+
+class PickupWatcher:
+    """
+    Reports backups that land in the pickup directory once they are fully
+    written: a file is ready when its size and mtime have not changed for
+    settle_seconds and it opens as a zip with a backup in it.
+
+    Changes are picked up with inotify when inotify_simple is installed.
+    Otherwise the directory is polled, and only listed again when its own
+    mtime moves, so an idle directory costs one stat per poll however many
+    backups it holds. Today's backup is also stat'ed every poll, which
+    catches it being rewritten in place.
+    """
+
+    def __init__(self, pickup_dir: Path, poll_interval: float = 2.0,
+                 settle_seconds: float = 2.0, use_inotify: bool = True) -> None:
+        self.pickup_dir = Path(pickup_dir)
+        if not self.pickup_dir.exists():
+            logger.error(f"Pickup directory {self.pickup_dir} does not exist.")
+            raise FileNotFoundError(f"{self.pickup_dir} does not exist")
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        # (size, mtime) of every backup seen, files are reported again when these change
+        self._index: dict[str, tuple[int, float]] = {}
+        # files waiting to settle: name -> ((size, mtime), time that signature was first seen)
+        self._pending: dict[str, tuple[tuple[int, float], float]] = {}
+        self._dir_mtime = None
+        self._inotify = None
+        if use_inotify and INotify is not None:
+            self._inotify = INotify()
+            self._inotify.add_watch(
+                str(self.pickup_dir), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        logger.info(f"Watching {self.pickup_dir} for new backups "
+                    f"({'inotify' if self._inotify else 'polling'})")
+        # backups already in the directory are not new
+        self._scan(initial=True)
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self._inotify else "polling"
+
+    def _signature(self, name: str) -> tuple[int, float] | None:
+        try:
+            stat = os.stat(self.pickup_dir / name)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def _touched(self, name: str) -> None:
+        signature = self._signature(name)
+        if signature is None:
+            self._index.pop(name, None)
+            self._pending.pop(name, None)
+        elif self._index.get(name) != signature and name not in self._pending:
+            self._pending[name] = (signature, time.monotonic())
+
+    def _scan(self, initial: bool = False) -> None:
+        try:
+            dir_mtime = os.stat(self.pickup_dir).st_mtime
+        except FileNotFoundError:
+            logger.warning(f"Pickup directory {self.pickup_dir} disappeared")
+            return
+        if dir_mtime == self._dir_mtime:
+            return
+        self._dir_mtime = dir_mtime
+        with os.scandir(self.pickup_dir) as entries:
+            names = [entry.name for entry in entries
+                     if is_backup_name(entry.name) and entry.is_file()]
+        for name in self._index.keys() - set(names):
+            del self._index[name]
+        for name in names:
+            if initial:
+                self._index[name] = self._signature(name)
+            else:
+                self._touched(name)
+
+    def _poll_changes(self, timeout: float | None) -> None:
+        if self._inotify is not None:
+            timeout_ms = None if timeout is None else int(timeout * 1000)
+            for event in self._inotify.read(timeout=timeout_ms):
+                if is_backup_name(event.name):
+                    self._touched(event.name)
+            return
+        time.sleep(timeout)
+        self._scan()
+        self._touched(datetime.today().strftime(f'{BACKUP_PREFIX}%Y_%m_%d{BACKUP_SUFFIX}'))
+
+    def _settled(self) -> list[Path]:
+        ready = []
+        now = time.monotonic()
+        for name, (signature, since) in list(self._pending.items()):
+            current = self._signature(name)
+            if current is None:
+                del self._pending[name]
+            elif current != signature:
+                # still being written, wait for it to stop changing
+                self._pending[name] = (current, now)
+            elif now - since >= self.settle_seconds:
+                del self._pending[name]
+                self._index[name] = current
+                if is_complete_backup(self.pickup_dir / name):
+                    ready.append(self.pickup_dir / name)
+                else:
+                    logger.warning(f"{name} stopped changing but is not a complete backup")
+        return ready
+
+    def wait(self, timeout: float | None = None) -> list[Path]:
+        """
+        Blocks until at least one new backup is ready or timeout seconds pass.
+
+        :return: Ready backups, oldest first, empty on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return []
+            if self._inotify is not None and not self._pending:
+                # nothing is settling, sleep until inotify reports a change
+                step = remaining
+            else:
+                step = self.poll_interval if remaining is None else min(self.poll_interval, remaining)
+            self._poll_changes(step)
+            ready = self._settled()
+            if ready:
+                return sorted(ready, key=lambda path: self._index[path.name][1])
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
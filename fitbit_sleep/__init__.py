@@ -1 +1,2 @@
-from .get_fitbit_sleep import get_fitbit_sleep_data, clean_sleep_data
\ No newline at end of file
+from .get_fitbit_sleep import get_fitbit_sleep_data, clean_sleep_data, sleep_segments, sleep_stage_stats
+from .sleep_fetcher import SleepCache, SleepFetcher
\ No newline at end of file
@@ -1,18 +1,25 @@
-import os
 import json
 import fitbit
 import datetime
+import numpy as np
 import pandas as pd
 
-from pathlib import Path
-from dotenv import load_dotenv
+from config import get_settings
+from log_setup.metrics import span
+
+from .sleep_fetcher import SleepCache, SleepFetcher
+
+
+def save_fitbit_tokens(token: dict, fitbit_tokens_path) -> None:
+    with open(fitbit_tokens_path, "w") as f:
+        json.dump(token, f, indent=2)
 
 
 def get_fitbit_auth():
-    load_dotenv()
-    fitbit_tokens_path = Path("data/fitbit_tokens.json")
-    client_id = os.getenv('FITBIT_CLIENT_ID', 'your_client_id')
-    client_secret = os.getenv('FITBIT_CLIENT_SECRET', 'your_client_secret')
+    settings = get_settings()
+    fitbit_tokens_path = settings.fitbit_tokens_path
+    client_id = settings.fitbit_client_id
+    client_secret = settings.fitbit_client_secret
 
     if not fitbit_tokens_path.exists():
         raise FileNotFoundError(
@@ -27,152 +34,353 @@ def get_fitbit_auth():
         access_token=token_data['access_token'],
         refresh_token=token_data['refresh_token'],
         expires_at=token_data['expires_at'],
-        refresh_cb=lambda t: json.dump(
-            t, open(fitbit_tokens_path, "w"), indent=2)
+        refresh_cb=lambda t: save_fitbit_tokens(t, fitbit_tokens_path)
     )
 
     return authd_client
 
 
-def get_fitbit_sleep_data(authd_client=get_fitbit_auth(), days: int = 90):
+def get_fitbit_sleep_data(authd_client=None, days: int = 90,
+                          start: datetime.date | None = None,
+                          end: datetime.date | None = None,
+                          cache: SleepCache | None = None):
     """
-    Fetches Fitbit sleep data for the last 'days' days.
+    Fetches Fitbit sleep data for the last 'days' days, or for start to end.
+    Only days missing from the local cache, or recent enough to still change,
+    are requested from the API.
 
-    :param authd_client: Authenticated Fitbit client
+    :param authd_client: Authenticated Fitbit client, created from the stored tokens if not given
     :param days: Number of days to fetch sleep data for
+    :param start: First date of sleep, overrides days
+    :param end: Last date of sleep, defaults to today
+    :param cache: Per-day cache of sleep responses
     :return: List of sleep entries
     """
-    start = datetime.date.today() - datetime.timedelta(days=days)
-    end = datetime.date.today()
+    settings = get_settings()
+    end = end or datetime.date.today()
+    start = start or end - datetime.timedelta(days=days)
 
-    response = authd_client.make_request(
-        f"https://api.fitbit.com/1.2/user/-/sleep/date/{start}/{end}.json"
+    fetcher = SleepFetcher(
+        authd_client or get_fitbit_auth(),
+        cache or SleepCache(settings.fitbit_cache_dir),
+        max_workers=settings.fitbit_max_workers,
+        settle_days=settings.fitbit_settle_days,
     )
+    return fetcher.fetch(start, end)
+
+
+# levels counted from levels.data for classic logs, whose summary counts are not accurate
+CLASSIC_LEVELS = ["asleep", "awake", "restless"]
 
-    if isinstance(response, dict):
-        return response.get("sleep", [])
+# (output column, levels.summary level, summary field), in output order
+SUMMARY_COLUMNS = [
+    ("deep_sleep_count", "deep", "count"),
+    ("deep_sleep_minutes", "deep", "minutes"),
+    ("light_sleep_count", "light", "count"),
+    ("light_sleep_minutes", "light", "minutes"),
+    ("rem_sleep_count", "rem", "count"),
+    ("rem_sleep_minutes", "rem", "minutes"),
+    ("wake_count", "wake", "count"),
+    ("wake_minutes", "wake", "minutes"),
+    ("asleep_minutes", "asleep", "minutes"),
+    ("awake_minutes", "awake", "minutes"),
+    ("restless_minutes", "restless", "minutes"),
+]
 
-    return []
+# level codes of fitbit_sleep_levels.level, stages first then classic, in
+# code order so categorical codes map onto them directly, -1 for anything else
+SLEEP_LEVEL_CODES = {
+    "wake": 0, "light": 1, "deep": 2, "rem": 3,
+    "awake": 4, "restless": 5, "asleep": 6,
+}
 
+SEGMENT_COLUMNS = ["date", "log_id", "short", "offset_seconds", "seconds", "level"]
 
-def nap_or_full(duration_hours, start_time, end_time):
-    sleep_type = "full"
+FITBIT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+SLEEP_COLUMNS = [
+    "date", "duration_milliseconds", "duration_seconds", "duration_minutes",
+    "duration_hours", "duration_hhmmss", "sleep_type", "start_time",
+    "start_time_ymdhm", "end_time", "end_time_ymdhm", "efficiency",
+    "minutes_asleep", "minutes_awake", "main_sleep", "deep_sleep_count",
+    "deep_sleep_minutes", "light_sleep_count", "light_sleep_minutes",
+    "rem_sleep_count", "rem_sleep_minutes", "wake_count", "wake_minutes",
+    "asleep_count", "asleep_minutes", "awake_count", "awake_minutes",
+    "restless_count", "restless_minutes", "sleep_log_type",
+]
+
+
+def nap_or_full(duration_hours, start_time, end_time) -> np.ndarray:
+    """
+    Classifies sleep logs as naps or full sleeps.
+
+    :param duration_hours: Whole hour durations
+    :param start_time: Start times as a datetime Series
+    :param end_time: End times as a datetime Series
+    :return: Array of 'nap' or 'full'
+    """
     nap_hours = 3
-    if (start_time.hour in range(8, 19, 1) and duration_hours <= nap_hours):
-        sleep_type = "nap"
-    elif start_time.date() == end_time.date() and start_time.hour in range(7, 19, 1) and duration_hours <= 6:
-        sleep_type = "nap"
-    elif start_time.date() == end_time.date() and duration_hours > nap_hours:
-        sleep_type = "full"
-    elif start_time.date() != end_time.date():
-        sleep_type = "full"
-    else:
-        sleep_type = "nap"
-    return sleep_type
+    start_hour = start_time.dt.hour.to_numpy()
+    same_day = (start_time.dt.normalize() == end_time.dt.normalize()).to_numpy()
+    conditions = [
+        (start_hour >= 8) & (start_hour < 19) & (duration_hours <= nap_hours),
+        same_day & (start_hour >= 7) & (start_hour < 19) & (duration_hours <= 6),
+        same_day & (duration_hours > nap_hours),
+        ~same_day,
+    ]
+    return np.select(conditions, ["nap", "nap", "full", "full"], default="nap")
+
+
+def _flatten_sleep(sleep_entries: list[dict]) -> pd.DataFrame:
+    """
+    Flattens the sleep payload into one frame, with levels.data and the
+    levels.summary counts and minutes as dotted columns like json_normalize
+    would name them, without walking every nested segment.
+    """
+    flat = pd.DataFrame.from_records(sleep_entries)
+    if "levels" not in flat:
+        return flat
+    levels = flat.pop("levels")
+    levels = levels.where(levels.map(lambda lv: isinstance(lv, dict)), None)
+    flat["levels.data"] = levels.map(lambda lv: lv.get("data") if lv else None)
+
+    summaries = pd.DataFrame.from_records(
+        [lv.get("summary") or {} if lv else {} for lv in levels], index=flat.index)
+    for level in summaries.columns:
+        fields = pd.DataFrame.from_records(
+            [fields if isinstance(fields, dict) else {} for fields in summaries[level]],
+            index=flat.index)
+        for field in fields.columns:
+            flat[f"levels.summary.{level}.{field}"] = fields[field]
+    return flat
+
+
+def _optional_column(values, present) -> pd.Series:
+    """
+    Series with None where a value is not present, typed the way pandas infers
+    a column built from python values (int, float with NaN, or all None object).
+    """
+    present = np.asarray(present, dtype=bool)
+    if not present.any():
+        return pd.Series([None] * len(present), dtype=object)
+    values = pd.Series(values)
+    if present.all():
+        return values
+    return values.where(present).astype(float)
+
+
+def _summary_column(flat: pd.DataFrame, level: str, field: str) -> pd.Series:
+    col_name = f"levels.summary.{level}.{field}"
+    if col_name not in flat:
+        return _optional_column(np.zeros(len(flat)), np.zeros(len(flat), dtype=bool))
+    col = flat[col_name]
+    return _optional_column(col, col.notna())
+
+
+def _format_durations(duration: np.ndarray) -> pd.Series:
+    """
+    Vectorised str(timedelta(milliseconds=...)), e.g. '7:23:00' or '1 day, 2:00:00.500000'.
+    """
+    micros = duration.astype(np.int64) * 1000
+    days, rem = np.divmod(micros, 86_400_000_000)
+    hours, rem = np.divmod(rem, 3_600_000_000)
+    minutes, rem = np.divmod(rem, 60_000_000)
+    seconds, micros = np.divmod(rem, 1_000_000)
+
+    text = (pd.Series(hours).astype(str) + ":"
+            + pd.Series(minutes).astype(str).str.zfill(2) + ":"
+            + pd.Series(seconds).astype(str).str.zfill(2))
+    text = text.where(micros == 0, text + "." +
+                      pd.Series(micros).astype(str).str.zfill(6))
+    day_prefix = (pd.Series(days).astype(str)
+                  + np.where(days == 1, " day, ", " days, "))
+    return text.where(days == 0, day_prefix + text)
+
+
+def _ymdhm(timestamps: pd.Series) -> pd.Series:
+    # fitbit timestamps are fixed width '%Y-%m-%dT%H:%M:%S.%f', so slicing the
+    # source text gives '%Y-%m-%d %H:%M' without formatting each datetime
+    return timestamps.str.slice(0, 16).str.replace("T", " ", regex=False)
+
+
+def _round_half_decimal(values: np.ndarray, decimals: int) -> np.ndarray:
+    """
+    Matches python's round(x, n), which rounds the exact binary value, where
+    np.round's scaling can tip values sitting on a half the other way.
+    """
+    rounded = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    ties = np.isclose(scaled - np.floor(scaled), 0.5)
+    if ties.any():
+        rounded[ties] = [round(float(value), decimals)
+                         for value in values[ties]]
+    return rounded
+
 
+def _level_counts(flat: pd.DataFrame, classic: np.ndarray, levels: list[str]) -> pd.DataFrame:
+    """
+    Counts levels.data segments per log for the given levels in a single grouped
+    pass over the flattened segments of the selected logs.
+    """
+    rows = np.flatnonzero(classic)
+    counts = pd.DataFrame(0, index=rows, columns=levels)
+    if "levels.data" not in flat or not len(rows):
+        return counts
+
+    data = flat["levels.data"].iloc[rows]
+    data = data.where(data.map(lambda segments: isinstance(segments, list)), None)
+    lengths = data.map(lambda segments: len(segments) if segments else 0).to_numpy()
+    segments = pd.DataFrame({
+        "log": np.repeat(rows, lengths),
+        "level": [segment["level"] for segments in data if segments for segment in segments],
+    })
+    grouped = segments.groupby(["log", "level"]).size().unstack(fill_value=0)
+    return grouped.reindex(index=rows, columns=levels, fill_value=0)
 
-def clean_sleep_data(sleep_entries=get_fitbit_sleep_data()):
+
+def clean_sleep_data(sleep_entries=None):
     """
     Cleans and formats the sleep data entries.
 
-    :param sleep_entries: List of sleep entries
-    :return: List of cleaned sleep entries
-    """
-
-    cleaned_entries = []
-
-    for entry in sleep_entries:
-        # get duration and format it
-        duration = entry.get('duration', 0)
-        duration_td = datetime.timedelta(milliseconds=duration)
-        formatted_time = str(duration_td)
-
-        # Convert startTime and endTime to datetime objects
-        start_time_obj = datetime.datetime.strptime(
-            entry['startTime'], "%Y-%m-%dT%H:%M:%S.%f")
-        end_time_obj = datetime.datetime.strptime(
-            entry['endTime'], "%Y-%m-%dT%H:%M:%S.%f")
-
-        # Format start and end times to readable strings
-        start_time_readable = start_time_obj.strftime("%Y-%m-%d %H:%M")
-        end_time_readable = end_time_obj.strftime("%Y-%m-%d %H:%M")
-
-        # Calculate sleep type based on duration and start/end times
-        sleep_type = nap_or_full(
-            round(duration / 3600000), start_time_obj, end_time_obj)
-
-        # Convert dateOfSleep to a date object
-        sleep_date = datetime.datetime.strptime(
-            entry['dateOfSleep'], '%Y-%m-%d').date()
-
-        # Determine sleep log type
-        sleep_log_type = entry.get('type', 'unknown')
-
-        # Get summary data
-        summary = entry.get('levels', {}).get('summary', {})
-
-        # if log type is classic, get counts for asleep, awake, and restless manually because their count fields are not accurate
-        # otherwise, set them to None
-        if sleep_log_type == "classic":
-            asleep_count = sum(1 for entry in entry.get("levels", {}).get(
-                "data", []) if entry["level"] == "asleep")
-            awake_count = sum(1 for entry in entry.get("levels", {}).get(
-                "data", []) if entry["level"] == "awake")
-            restless_count = sum(1 for entry in entry.get("levels", {}).get(
-                "data", []) if entry["level"] == "restless")
-        else:
-            asleep_count = None
-            awake_count = None
-            restless_count = None
-
-        # Get counts and minutes for different sleep levels
-        asleep_minutes = summary.get('asleep', {}).get('minutes', None)
-        awake_minutes = summary.get('awake', {}).get('minutes', None)
-        restless_minutes = summary.get('restless', {}).get('minutes', None)
-        deep_sleep_count = summary.get('deep', {}).get('count', None)
-        light_sleep_count = summary.get('light', {}).get('count', None)
-        rem_sleep_count = summary.get('rem', {}).get('count', None)
-        wake_count = summary.get('wake', {}).get('count', None)
-        deep_sleep_minutes = summary.get('deep', {}).get('minutes', None)
-        light_sleep_minutes = summary.get('light', {}).get('minutes', None)
-        rem_sleep_minutes = summary.get('rem', {}).get('minutes', None)
-        wake_minutes = summary.get('wake', {}).get('minutes', None)
-
-        # Create a cleaned entry dictionary
-        cleaned_entries.append({
-            "date": sleep_date,
-            "duration_milliseconds": duration,
-            "duration_seconds": round(duration_td.total_seconds()),
-            # Convert ms to minutes
-            "duration_minutes": round(duration / 60000),
-            # Convert ms to hours
-            "duration_hours": round(duration / 3600000, 1),
-            "duration_hhmmss": formatted_time,
-            "sleep_type": sleep_type,
-            "start_time": start_time_obj,
-            "start_time_ymdhm": start_time_readable,
-            "end_time": end_time_obj,
-            "end_time_ymdhm": end_time_readable,
-            "efficiency": entry['efficiency'],
-            "minutes_asleep": entry['minutesAsleep'],
-            "minutes_awake": entry['minutesAwake'],
-            "main_sleep": entry['isMainSleep'],
-            "deep_sleep_count": deep_sleep_count,
-            "deep_sleep_minutes": deep_sleep_minutes,
-            "light_sleep_count": light_sleep_count,
-            "light_sleep_minutes": light_sleep_minutes,
-            "rem_sleep_count": rem_sleep_count,
-            "rem_sleep_minutes": rem_sleep_minutes,
-            "wake_count": wake_count,
-            "wake_minutes": wake_minutes,
-            "asleep_count": asleep_count,
-            "asleep_minutes": asleep_minutes,
-            "awake_count": awake_count,
-            "awake_minutes": awake_minutes,
-            "restless_count": restless_count,
-            "restless_minutes": restless_minutes,
-            "sleep_log_type": sleep_log_type,
-        })
-
-    # Convert the list of cleaned entries to a DataFrame and return it
-    return pd.DataFrame(cleaned_entries)
+    :param sleep_entries: List of sleep entries, fetched from the API if not given
+    :return: DataFrame of cleaned sleep entries
+    """
+    if sleep_entries is None:
+        sleep_entries = get_fitbit_sleep_data()
+    if not sleep_entries:
+        return pd.DataFrame()
+
+    with span("clean_sleep_data", rows_in=len(sleep_entries)) as clean_span:
+        cleaned = _clean_sleep_entries(sleep_entries)
+        clean_span.rows_out = len(cleaned)
+    return cleaned
+
+
+def _clean_sleep_entries(sleep_entries: list[dict]) -> pd.DataFrame:
+    # flatten the payload once, nested summaries become dotted columns
+    flat = _flatten_sleep(sleep_entries)
+    duration = flat["duration"].fillna(0).astype(np.int64).to_numpy() \
+        if "duration" in flat else np.zeros(len(flat), dtype=np.int64)
+
+    start_time = pd.to_datetime(flat["startTime"], format=FITBIT_TIME_FORMAT)
+    end_time = pd.to_datetime(flat["endTime"], format=FITBIT_TIME_FORMAT)
+    sleep_log_type = flat["type"].fillna("unknown") \
+        if "type" in flat else pd.Series("unknown", index=flat.index)
+    classic = (sleep_log_type == "classic").to_numpy()
+
+    cleaned = pd.DataFrame({
+        "date": pd.to_datetime(flat["dateOfSleep"], format="%Y-%m-%d").dt.date,
+        "duration_milliseconds": duration,
+        "duration_seconds": np.rint(duration / 1000).astype(np.int64),
+        "duration_minutes": np.rint(duration / 60000).astype(np.int64),
+        "duration_hours": _round_half_decimal(duration / 3600000, 1),
+        "duration_hhmmss": _format_durations(duration),
+        "sleep_type": nap_or_full(np.rint(duration / 3600000), start_time, end_time),
+        "start_time": start_time,
+        "start_time_ymdhm": _ymdhm(flat["startTime"]),
+        "end_time": end_time,
+        "end_time_ymdhm": _ymdhm(flat["endTime"]),
+        "efficiency": flat["efficiency"],
+        "minutes_asleep": flat["minutesAsleep"],
+        "minutes_awake": flat["minutesAwake"],
+        "main_sleep": flat["isMainSleep"],
+        "sleep_log_type": sleep_log_type,
+    })
+
+    for col_name, level, field in SUMMARY_COLUMNS:
+        cleaned[col_name] = _summary_column(flat, level, field)
+
+    # classic logs get their counts from levels.data, other log types get None
+    counts = _level_counts(flat, classic, CLASSIC_LEVELS)
+    for level in CLASSIC_LEVELS:
+        values = np.zeros(len(flat), dtype=np.int64)
+        values[counts.index] = counts[level].to_numpy()
+        cleaned[f"{level}_count"] = _optional_column(values, classic)
+
+    return cleaned[SLEEP_COLUMNS]
+
+
+def _segment_lists(levels: list, key: str) -> tuple[np.ndarray, list[dict]]:
+    """
+    :return: Number of segments under levels[key] per log, and every segment in log order
+    """
+    lists = [lv.get(key) if isinstance(lv, dict) and isinstance(lv.get(key), list) else []
+             for lv in levels]
+    lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    return lengths, [segment for segments in lists for segment in segments]
+
+
+def sleep_segments(sleep_entries: list[dict]) -> pd.DataFrame:
+    """
+    Flattens levels.data and levels.shortData of every sleep log into one row
+    per segment: its offset from the log's start and its length in seconds,
+    and the level as a SLEEP_LEVEL_CODES code. The segment fields are pulled
+    out in one pass, everything else is computed on whole arrays.
+
+    :param sleep_entries: List of sleep entries as returned by get_fitbit_sleep_data
+    :return: DataFrame with SEGMENT_COLUMNS, short is True for shortData segments
+    """
+    if not sleep_entries:
+        return pd.DataFrame({col: [] for col in SEGMENT_COLUMNS})
+
+    levels = [entry.get("levels") for entry in sleep_entries]
+    log_ids = np.array([entry["logId"] for entry in sleep_entries], dtype=np.int64)
+    dates = np.array([entry["dateOfSleep"] for entry in sleep_entries], dtype=object)
+    starts = pd.to_datetime([entry["startTime"] for entry in sleep_entries],
+                            format=FITBIT_TIME_FORMAT).to_numpy()
+
+    data_lengths, data = _segment_lists(levels, "data")
+    short_lengths, short = _segment_lists(levels, "shortData")
+    lengths = np.concatenate([data_lengths, short_lengths])
+    segments = data + short
+    # position of each segment's log in sleep_entries
+    logs = np.repeat(np.tile(np.arange(len(sleep_entries)), 2), lengths)
+
+    times = pd.to_datetime([segment["dateTime"] for segment in segments],
+                           format=FITBIT_TIME_FORMAT).to_numpy()
+    offsets = (times - starts[logs]) // np.timedelta64(1, "s")
+    level_names = pd.Categorical([segment["level"] for segment in segments],
+                                 categories=list(SLEEP_LEVEL_CODES))
+
+    return pd.DataFrame({
+        "date": dates[logs],
+        "log_id": log_ids[logs],
+        "short": np.repeat([False, True], [data_lengths.sum(), short_lengths.sum()]),
+        "offset_seconds": offsets.astype(np.int32),
+        "seconds": np.fromiter((segment["seconds"] for segment in segments),
+                               dtype=np.int32, count=len(segments)),
+        "level": level_names.codes.astype(np.int8),
+    }, columns=SEGMENT_COLUMNS)
+
+
+def sleep_stage_stats(segments: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per night share of time spent in each level and number of level changes,
+    from sleep_segments or rows read back from fitbit_sleep_levels. Naps count
+    towards the night of their dateOfSleep, shortData wakes are counted apart
+    and left out of the fractions, as in the levels.summary of stages logs.
+
+    :param segments: Segments with SEGMENT_COLUMNS
+    :return: DataFrame indexed by date with a <level>_fraction column per level
+        present, transitions and short_wakes
+    """
+    short = segments["short"].astype(bool).to_numpy()
+    main = segments[~short].sort_values(["log_id", "offset_seconds"], kind="stable")
+
+    seconds = main.groupby(["date", "level"])["seconds"].sum().unstack(fill_value=0)
+    fractions = seconds.div(seconds.sum(axis=1), axis=0)
+    names = {code: name for name, code in SLEEP_LEVEL_CODES.items()}
+    fractions.columns = [f"{names.get(code, 'unknown')}_fraction" for code in fractions.columns]
+
+    # a transition is a level change between consecutive segments of one log
+    log_ids = main["log_id"].to_numpy()
+    level = main["level"].to_numpy()
+    changed = np.zeros(len(main), dtype=np.int64)
+    changed[1:] = (level[1:] != level[:-1]) & (log_ids[1:] == log_ids[:-1])
+    fractions["transitions"] = pd.Series(changed, index=main.index).groupby(main["date"]).sum()
+
+    short_wakes = segments[short & (segments["level"] == SLEEP_LEVEL_CODES["wake"]).to_numpy()]
+    fractions["short_wakes"] = short_wakes.groupby("date").size().reindex(
+        fractions.index, fill_value=0)
+    fractions.columns.name = None
+    return fractions
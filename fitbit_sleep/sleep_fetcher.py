@@ -0,0 +1,182 @@
+import json
+import time
+import datetime
+import threading
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from fitbit.exceptions import HTTPServerError, HTTPTooManyRequests
+from log_setup import setup_logger
+
+logger = setup_logger()
+
+FITBIT_API = "https://api.fitbit.com"
+# the sleep date range endpoint accepts at most 100 days per request
+MAX_WINDOW_DAYS = 100
+# refresh tokens this close to expiring before the workers start
+TOKEN_REFRESH_MARGIN = 60
+
+
+def date_windows(days: list[datetime.date], window_days: int = MAX_WINDOW_DAYS) -> list[tuple[datetime.date, datetime.date]]:
+    """
+    Groups sorted days into runs of consecutive days no longer than window_days.
+
+    :return: List of (first day, last day) windows
+    """
+    windows = []
+    for day in days:
+        if windows:
+            first, last = windows[-1]
+            if day == last + datetime.timedelta(days=1) and (day - first).days < window_days:
+                windows[-1] = (first, day)
+                continue
+        windows.append((day, day))
+    return windows
+
+
+class SleepCache:
+    """
+    Sleep logs stored per date of sleep, one json file per day. A day with no
+    logs is stored as an empty list so it is not requested again.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, day: datetime.date) -> Path:
+        return self.cache_dir / f"{day.isoformat()}.json"
+
+    def has(self, day: datetime.date) -> bool:
+        return self._path(day).exists()
+
+    def read(self, day: datetime.date) -> list[dict]:
+        path = self._path(day)
+        return json.loads(path.read_text()) if path.exists() else []
+
+    def write(self, day: datetime.date, entries: list[dict]) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(day)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(entries))
+        tmp_path.replace(path)
+
+
+class SleepFetcher:
+    """
+    Fetches sleep logs for an arbitrary date range. Days already in the cache
+    are not requested again, except the last settle_days which Fitbit may still
+    be updating. Missing days are split into API sized windows and fetched
+    concurrently, pausing every worker when the rate limit is used up.
+    """
+
+    def __init__(self, authd_client, cache: SleepCache, max_workers: int = 4,
+                 settle_days: int = 3, window_days: int = MAX_WINDOW_DAYS,
+                 max_retries: int = 5, base_url: str = FITBIT_API) -> None:
+        self.authd_client = authd_client
+        self.cache = cache
+        self.max_workers = max_workers
+        self.settle_days = settle_days
+        self.window_days = window_days
+        self.max_retries = max_retries
+        self.base_url = base_url.rstrip("/")
+        self._resume_at = 0.0
+        self._rate_lock = threading.Lock()
+
+    def _wait_for_rate_limit(self) -> None:
+        with self._rate_lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _pause(self, seconds: float) -> None:
+        with self._rate_lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def _refresh_expired_token(self) -> None:
+        """
+        Refreshes an expired token on the calling thread. The workers share one
+        oauth session, and Fitbit refresh tokens are single use, so letting each
+        worker auto-refresh on its own would leave all but one with a revoked token.
+        """
+        client = self.authd_client.client
+        expires_at = client.session.token.get("expires_at")
+        if expires_at is not None and expires_at - TOKEN_REFRESH_MARGIN <= time.time():
+            logger.info("Fitbit access token expired, refreshing it before fetching")
+            client.refresh_token()
+
+    def _request(self, url: str) -> dict:
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            try:
+                # the oauth client returns the raw response so the rate limit headers are visible
+                response = self.authd_client.client.make_request(url)
+            except HTTPTooManyRequests as e:
+                retry_after = getattr(e, "retry_after_secs", None) or 2 ** attempt
+                logger.warning(
+                    f"Fitbit rate limit reached, retrying in {retry_after}s")
+                self._pause(retry_after)
+                continue
+            except HTTPServerError:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    f"Fitbit server error, retrying in {2 ** attempt}s")
+                time.sleep(2 ** attempt)
+                continue
+
+            remaining = response.headers.get("fitbit-rate-limit-remaining")
+            reset = response.headers.get("fitbit-rate-limit-reset")
+            if remaining is not None and reset is not None and int(remaining) <= 0:
+                self._pause(int(reset))
+            return json.loads(response.content.decode("utf8"))
+
+        logger.error(f"Fitbit request failed after {self.max_retries} retries: {url}")
+        raise RuntimeError(
+            f"Fitbit request failed after {self.max_retries} retries")
+
+    def _fetch_window(self, window: tuple[datetime.date, datetime.date]) -> int:
+        first, last = window
+        url = f"{self.base_url}/1.2/user/-/sleep/date/{first}/{last}.json"
+        payload = self._request(url)
+        entries = payload.get("sleep", []) if isinstance(payload, dict) else []
+
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(entry["dateOfSleep"], []).append(entry)
+        day = first
+        while day <= last:
+            self.cache.write(day, by_day.get(day.isoformat(), []))
+            day += datetime.timedelta(days=1)
+        return len(entries)
+
+    def missing_days(self, start: datetime.date, end: datetime.date) -> list[datetime.date]:
+        settled_before = datetime.date.today() - datetime.timedelta(days=self.settle_days)
+        days = []
+        day = start
+        while day <= end:
+            if day >= settled_before or not self.cache.has(day):
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    def fetch(self, start: datetime.date, end: datetime.date) -> list[dict]:
+        """
+        :param start: First date of sleep to return
+        :param end: Last date of sleep to return
+        :return: List of sleep entries ordered by date of sleep
+        """
+        windows = date_windows(self.missing_days(start, end), self.window_days)
+        logger.info(
+            f"Fetching Fitbit sleep for {len(windows)} window(s) between {start} and {end}")
+        if windows:
+            self._refresh_expired_token()
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                fetched = sum(pool.map(self._fetch_window, windows))
+            logger.info(f"Fetched {fetched} sleep logs from the Fitbit API")
+
+        entries = []
+        day = start
+        while day <= end:
+            entries.extend(self.cache.read(day))
+            day += datetime.timedelta(days=1)
+        return entries
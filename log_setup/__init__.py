@@ -1,2 +1,2 @@
 from .logger_instance import logger
-from .logging_setup import setup_logger
+from .logging_setup import setup_logger, get_run_id, set_run_id
@@ -1,17 +1,86 @@
+import os
+import time
+import uuid
+import queue
 import logging
 import sqlite3
+import threading
 from datetime import datetime
 from logging import Handler, LogRecord
 
+# identifies the records of one ETL run, override with set_run_id
+_run_id = uuid.uuid4().hex
+
+# one handler, and so one connection and writer thread, per log database
+_sqlite_handlers = {}
+_sqlite_handlers_lock = threading.Lock()
+
+
+def get_run_id() -> str:
+    return _run_id
+
+
+def set_run_id(run_id: str | None = None) -> str:
+    """
+    Starts a new run id for the records logged from now on.
+
+    :param run_id: Run id to use, a new random one if not given
+    :return: The run id now in use
+    """
+    global _run_id
+    _run_id = run_id or uuid.uuid4().hex
+    return _run_id
+
+
+class _Flush:
+    """Queue marker the writer answers once every record before it is committed."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+
+
+_STOP = object()
+
 
 class SQLiteHandler(Handler):
-    def __init__(self, db_path='etl_logs.db'):
+    """
+    Queues records for a background writer thread, which inserts them in one
+    transaction per batch once batch_size records are waiting or flush_interval
+    seconds have passed. The queue holds at most max_queue records, past that
+    new records are dropped and counted so a slow disk never blocks the ETL.
+    The database is opened by the writer on the first record, and a writer
+    that is no longer running, e.g. in a forked child, is started again.
+    """
+
+    def __init__(self, db_path='etl_logs.db', batch_size: int = 500,
+                 flush_interval: float = 1.0, max_queue: int = 10000):
         super().__init__()
-        self.conn = sqlite3.connect(db_path)
-        self._ensure_table()
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._reset_writer()
+
+    def _reset_writer(self) -> None:
+        # also run in a forked child, whose copies of the queue and locks may
+        # be held by the parent's writer thread that did not survive the fork
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._writer = None
+        self._start_lock = threading.Lock()
 
-    def _ensure_table(self):
-        self.conn.execute('''
+    def _ensure_writer(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._start_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._run, name="sqlite-log-writer", daemon=True)
+                self._writer.start()
+
+    def _ensure_table(self, conn: sqlite3.Connection):
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 created TEXT,
@@ -19,32 +88,151 @@ class SQLiteHandler(Handler):
                 message TEXT,
                 pathname TEXT,
                 lineno INTEGER,
-                funcname TEXT
+                funcname TEXT,
+                run_id TEXT
             )
         ''')
-        self.conn.commit()
+        # log databases created before run ids were recorded
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(logs)")}
+        if 'run_id' not in columns:
+            conn.execute("ALTER TABLE logs ADD COLUMN run_id TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_logs_run_id ON logs (run_id)")
+        conn.commit()
 
     def emit(self, record: LogRecord):
         try:
-            # only gets message, not full metadata unless included in formatter
-            msg = self.format(record)
-            self.conn.execute('''
-                INSERT INTO logs (created, level, message, pathname, lineno, funcname)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
+            # the row is built here so the message is formatted from the
+            # arguments as they were when the record was logged
+            row = (
                 datetime.fromtimestamp(record.created).isoformat(),
                 record.levelname,
                 record.getMessage(),
                 record.pathname,
                 record.lineno,
-                record.funcName
-            ))
-            self.conn.commit()
+                record.funcName,
+                _run_id,
+            )
+            self._ensure_writer()
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped += 1
         except Exception:
             self.handleError(record)
 
+    def _dropped_row(self) -> tuple | None:
+        # not the handler lock, logging.shutdown holds that while flush waits on this thread
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return None
+        return (datetime.now().isoformat(), 'WARNING',
+                f"{dropped} log records dropped, the log queue was full",
+                __file__, 0, '_run', _run_id)
+
+    def _write(self, conn: sqlite3.Connection, rows: list[tuple]) -> None:
+        dropped = self._dropped_row()
+        if dropped:
+            rows.append(dropped)
+        if not rows:
+            return
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO logs (created, level, message, pathname, lineno, funcname, run_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+        except Exception:
+            self.handleError(logging.makeLogRecord(
+                {"msg": f"Failed to write {len(rows)} log records to {self.db_path}"}))
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self._ensure_table(conn)
+        except Exception:
+            self.handleError(logging.makeLogRecord(
+                {"msg": f"Failed to open log database {self.db_path}"}))
+
+        rows = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                rows.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(rows) < self.batch_size:
+                    continue
+
+            # batch is full, the interval passed, or a flush or stop was asked for
+            self._write(conn, rows)
+            rows = []
+            deadline = None
+            if isinstance(item, _Flush):
+                item.done.set()
+            elif item is _STOP:
+                break
+        conn.close()
+
+    def flush(self):
+        """
+        Waits until every record queued so far has been committed.
+        """
+        if self._writer is None or not self._writer.is_alive():
+            return
+        marker = _Flush()
+        # markers may wait for space, only records are dropped when the queue is full
+        self._queue.put(marker)
+        marker.done.wait()
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        self._writer = None
+        super().close()
+
+
+def _reset_handlers_after_fork() -> None:
+    global _sqlite_handlers_lock
+    _sqlite_handlers_lock = threading.Lock()
+    for handler in _sqlite_handlers.values():
+        handler._reset_writer()
+
+
+os.register_at_fork(after_in_child=_reset_handlers_after_fork)
+
+
+def log_db_path() -> str:
+    # read here rather than from settings so logging never loads the .env
+    return os.getenv('DAYLIO_LOG_DB', 'daylio_etl_logs.db')
+
+
+def get_sqlite_handler(db_path: str | None = None) -> SQLiteHandler:
+    """
+    :param db_path: Log database, DAYLIO_LOG_DB or daylio_etl_logs.db by default
+    :return: The handler shared by every logger writing to db_path
+    """
+    db_path = db_path or log_db_path()
+    with _sqlite_handlers_lock:
+        handler = _sqlite_handlers.get(db_path)
+        if handler is None:
+            handler = SQLiteHandler(db_path=db_path)
+            handler.setFormatter(logging.Formatter(
+                '%(message)s'))  # Store only the message in DB
+            _sqlite_handlers[db_path] = handler
+        return handler
+
 
-def setup_logger(name="daylio_etl_logger", db_path='daylio_etl_logs.db'):
+def setup_logger(name="daylio_etl_logger", db_path=None):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     logger.handlers.clear()  # Avoid duplicates on reruns in Streamlit
@@ -54,10 +242,8 @@ def setup_logger(name="daylio_etl_logger", db_path='daylio_etl_logs.db'):
     console_handler.setFormatter(logging.Formatter(
         '%(asctime)s [%(levelname)s] %(filename)s: %(message)s'))
 
-    # SQLite Handler
-    sqlite_handler = SQLiteHandler(db_path=db_path)
-    sqlite_handler.setFormatter(logging.Formatter(
-        '%(message)s'))  # Store only the message in DB
+    # SQLite Handler, logging.shutdown flushes it at exit
+    sqlite_handler = get_sqlite_handler(db_path)
 
     logger.addHandler(console_handler)
     logger.addHandler(sqlite_handler)
@@ -0,0 +1,223 @@
+import sys
+import time
+import sqlite3
+import argparse
+import statistics
+import threading
+import tracemalloc
+
+from datetime import datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, astuple, fields
+
+from .logging_setup import get_run_id, log_db_path
+
+try:
+    import resource
+except ImportError:  # not available on Windows, RSS is then not recorded
+    resource = None
+
+# name of the innermost open span, worker threads inherit it through their context
+_current_span: ContextVar[str | None] = ContextVar("current_span", default=None)
+
+_finished = []
+_finished_lock = threading.Lock()
+
+
+@dataclass
+class Span:
+    """
+    Measurements of one stage of a run. The caller fills in the row and byte
+    counts it knows, the rest is recorded when the span closes.
+    """
+    name: str
+    run_id: str
+    parent: str | None
+    thread: str
+    started: str
+    wall_seconds: float | None = None
+    cpu_seconds: float | None = None
+    # process high water mark at the end of the span, and how much the span raised it
+    rss_peak_bytes: int | None = None
+    rss_growth_bytes: int | None = None
+    # change in traced allocations, only while tracemalloc is tracing
+    traced_bytes: int | None = None
+    rows_in: int | None = None
+    rows_out: int | None = None
+    bytes_read: int | None = None
+    bytes_written: int | None = None
+    status: str = "ok"
+
+
+COLUMNS = [f.name for f in fields(Span)]
+
+
+def _max_rss() -> int | None:
+    if resource is None:
+        return None
+    # kilobytes on linux, bytes on macos
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@contextmanager
+def span(name: str, rows_in: int | None = None, bytes_read: int | None = None):
+    """
+    Records wall and CPU time, memory and row counts of the block under name.
+
+        with span("clean.dayEntries", rows_in=len(df)) as s:
+            ...
+            s.rows_out = len(cleaned)
+
+    CPU time is the calling thread's, so stages running side by side in the
+    pipeline's workers don't count each other's work.
+    """
+    record = Span(name=name, run_id=get_run_id(), parent=_current_span.get(),
+                  thread=threading.current_thread().name,
+                  started=datetime.now().isoformat(timespec="milliseconds"),
+                  rows_in=rows_in, bytes_read=bytes_read)
+    token = _current_span.set(name)
+    rss_before = _max_rss()
+    traced_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.status = "error"
+        raise
+    finally:
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = time.thread_time() - cpu_start
+        record.rss_peak_bytes = _max_rss()
+        if rss_before is not None:
+            record.rss_growth_bytes = record.rss_peak_bytes - rss_before
+        if traced_before is not None and tracemalloc.is_tracing():
+            record.traced_bytes = tracemalloc.get_traced_memory()[0] - traced_before
+        _current_span.reset(token)
+        with _finished_lock:
+            _finished.append(record)
+
+
+def finished_spans() -> list[Span]:
+    with _finished_lock:
+        return list(_finished)
+
+
+def _ensure_table(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS run_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT, run_id TEXT, parent TEXT, thread TEXT, started TEXT,
+            wall_seconds REAL, cpu_seconds REAL,
+            rss_peak_bytes INTEGER, rss_growth_bytes INTEGER, traced_bytes INTEGER,
+            rows_in INTEGER, rows_out INTEGER, bytes_read INTEGER, bytes_written INTEGER,
+            status TEXT
+        )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_run_metrics_run_id ON run_metrics (run_id)")
+
+
+def save_metrics(db_path: str | None = None) -> int:
+    """
+    Writes the spans finished so far to run_metrics in the log database, in
+    one transaction, and forgets them.
+
+    :param db_path: Log database, the one setup_logger writes to by default
+    :return: Number of spans written
+    """
+    with _finished_lock:
+        spans = list(_finished)
+        _finished.clear()
+    if not spans:
+        return 0
+    conn = sqlite3.connect(db_path or log_db_path())
+    try:
+        _ensure_table(conn)
+        with conn:
+            conn.executemany(
+                f"INSERT INTO run_metrics ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [astuple(record) for record in spans])
+    finally:
+        conn.close()
+    return len(spans)
+
+
+def _recent_runs(conn: sqlite3.Connection, runs: int) -> list[tuple[str, str]]:
+    return conn.execute('''
+        SELECT run_id, MIN(started) AS started FROM run_metrics
+        GROUP BY run_id ORDER BY started DESC LIMIT ?''', (runs,)).fetchall()
+
+
+def slowest_spans(conn: sqlite3.Connection, run_id: str | None = None, top: int = 10) -> list[tuple]:
+    """
+    :param run_id: Run to report, the latest one by default
+    :return: (name, wall, cpu, rss growth, rows in, rows out) of the slowest spans
+    """
+    if run_id is None:
+        latest = _recent_runs(conn, 1)
+        if not latest:
+            return []
+        run_id = latest[0][0]
+    return conn.execute('''
+        SELECT name, wall_seconds, cpu_seconds, rss_growth_bytes, rows_in, rows_out
+        FROM run_metrics WHERE run_id = ?
+        ORDER BY wall_seconds DESC LIMIT ?''', (run_id, top)).fetchall()
+
+
+def span_trends(conn: sqlite3.Connection, runs: int = 10) -> list[tuple]:
+    """
+    :return: (name, runs seen, latest, median, min, max) wall seconds of every
+        span over the last runs, slowest latest first
+    """
+    run_ids = [run_id for run_id, _ in _recent_runs(conn, runs)]
+    if not run_ids:
+        return []
+    rows = conn.execute(f'''
+        SELECT name, run_id, SUM(wall_seconds), MIN(started) FROM run_metrics
+        WHERE run_id IN ({', '.join('?' * len(run_ids))})
+        GROUP BY name, run_id ORDER BY name, MIN(started)''', run_ids).fetchall()
+
+    by_name = {}
+    for name, _, seconds, _ in rows:
+        by_name.setdefault(name, []).append(seconds)
+    trends = [(name, len(timings), timings[-1], statistics.median(timings),
+               min(timings), max(timings)) for name, timings in by_name.items()]
+    return sorted(trends, key=lambda trend: trend[2], reverse=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reports the stage timings of ETL runs.")
+    parser.add_argument("--db", default=None, help="log database, DAYLIO_LOG_DB by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    slowest = commands.add_parser("slowest", help="slowest stages of one run")
+    slowest.add_argument("--run", default=None, help="run id, the latest run by default")
+    slowest.add_argument("--top", type=int, default=10)
+    trend = commands.add_parser("trend", help="stage timings across recent runs")
+    trend.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db or log_db_path())
+    try:
+        _ensure_table(conn)
+        if args.command == "slowest":
+            print(f"{'stage':<36} {'wall s':>9} {'cpu s':>9} {'rss +MB':>8} {'rows in':>9} {'rows out':>9}")
+            for name, wall, cpu, growth, rows_in, rows_out in slowest_spans(conn, args.run, args.top):
+                growth = "" if growth is None else f"{growth / 2**20:.1f}"
+                print(f"{name:<36} {wall:9.3f} {cpu:9.3f} {growth:>8} "
+                      f"{'' if rows_in is None else rows_in:>9} {'' if rows_out is None else rows_out:>9}")
+        else:
+            print(f"{'stage':<36} {'runs':>5} {'latest s':>9} {'median s':>9} {'min s':>9} {'max s':>9} {'vs median':>9}")
+            for name, seen, latest, median, low, high in span_trends(conn, args.runs):
+                change = f"{latest / median:.2f}x" if median else ""
+                print(f"{name:<36} {seen:5d} {latest:9.3f} {median:9.3f} {low:9.3f} {high:9.3f} {change:>9}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
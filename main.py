@@ -1,75 +1,282 @@
 import os
 import json
-import pandas as pd
+import time
+import argparse
 
 from pathlib import Path
-from log_setup import setup_logger
-from dotenv import load_dotenv
-from fitbit_sleep import clean_sleep_data
-from sql_cmds import create_db_conn, insert_prefs, create_tables, create_views, add_users, execute_sql_command
+from config import get_settings
+from log_setup import setup_logger, get_run_id, set_run_id
+from log_setup.metrics import save_metrics, span
 
-from extractor.data_extractor import extract_daylio_data, DATA_DIR, LAST_UPDATED_PATH
-from cleaner.cleaner import DaylioCleaner, create_entry_tags, create_mood_groups
+# the pipeline stages pull in pandas, fitbit and bcrypt, so they are imported
+# when a run starts rather than when this module is imported
+logger = setup_logger()
 
-load_dotenv()
 
-logger = setup_logger()
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Loads the latest Daylio backup and Fitbit sleep data into the Mood Dash database.")
+    parser.add_argument("--force", action="store_true",
+                        help="reload every Daylio table even if the backup is unchanged")
+    # resolved here, main switches to the project directory before it is read
+    parser.add_argument("--backfill", type=lambda path: Path(path).resolve(), metavar="DIR",
+                        help="merge every backup and archive snapshot in DIR and load the result")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to decode backups when backfilling")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record each stage's change in python allocations, slows the run down")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and load each new backup as it lands in the pickup directory")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="seconds a new backup must stop changing before it is loaded")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="seconds between checks of the pickup directory when watching")
+    parser.add_argument("--sleep-interval", type=float, default=60,
+                        help="minutes between Fitbit sleep fetches when watching")
+    return parser.parse_args(argv)
+
 
+def main(argv=None):
+    args = parse_args(argv)
+    settings = get_settings()
+    # data/ and sql/ paths and the log database are relative to the project directory
+    os.chdir(settings.base_dir)
 
-def main():
-    # set path to db, create if it doesn't exist
-    DB_PATH = os.getenv('DB_PATH')
-    if not DB_PATH:
+    # set path to db, created on the first run if it doesn't exist
+    if not settings.db_path:
         logger.error("DB_PATH not set in environment variables.")
         return
 
-    if not Path(DB_PATH).exists():
-        logger.info(f"Database not found at {DB_PATH}, creating new database")
-        create_tables()
-        add_users()
-        create_views()
+    from sql_cmds import DbConnection
+
+    if args.trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+
+    db = DbConnection(settings.db_path)
+    try:
+        if args.watch:
+            watch(db, args)
+        else:
+            run_once(db, force=args.force,
+                     backfill_dir=args.backfill, workers=args.workers)
+    finally:
+        db.close()
+
+
+def run_once(db, **kwargs):
+    # every log record of this run carries the same run id
+    run_id = set_run_id()
+    logger.info(f"Mood Dash ETL run {run_id}")
+    try:
+        with span("run_etl"):
+            run_etl(db, **kwargs)
+    finally:
+        # stage timings are kept next to the run's log records, failed runs included
+        logger.info(f"Recorded {save_metrics()} stage metrics for run {run_id}")
+
+
+def watch(db, args: argparse.Namespace):
+    """
+    Loads each backup as soon as it is fully written to the pickup directory,
+    and fetches Fitbit sleep every sleep_interval minutes. The database
+    connection, imports and parsed schema stay warm between runs, and each
+    run only does the stages its trigger affects.
+    """
+    from extractor.watch import PickupWatcher
+
+    watcher = PickupWatcher(get_settings().pickup_dir, poll_interval=args.poll_interval,
+                            settle_seconds=args.settle)
+    sleep_interval = args.sleep_interval * 60
+    # the first run loads the latest backup already there and fetches sleep
+    next_sleep_fetch = time.monotonic()
+    backups = [None]
+    try:
+        while True:
+            fetch_sleep = time.monotonic() >= next_sleep_fetch
+            if backups or fetch_sleep:
+                try:
+                    run_once(db, force=args.force, backup_file=backups[-1] if backups else None,
+                             load_daylio=bool(backups), fetch_sleep=fetch_sleep)
+                except Exception as e:
+                    logger.error(f"ETL run failed, waiting for the next backup: {e}")
+                if fetch_sleep:
+                    next_sleep_fetch = time.monotonic() + sleep_interval
+            # a burst of backups is loaded once, from the newest
+            backups = watcher.wait(timeout=max(0.0, next_sleep_fetch - time.monotonic()))
+    except KeyboardInterrupt:
+        logger.info("Stopped watching the pickup directory")
+    finally:
+        watcher.close()
+
+
+def run_etl(db, force: bool = False, backfill_dir: Path | None = None, workers: int | None = None,
+            backup_file: Path | None = None, load_daylio: bool = True, fetch_sleep: bool = True):
+    from pipeline import PipelineRunner, Task
+    from fitbit_sleep import clean_sleep_data, get_fitbit_sleep_data, sleep_segments
+    from sql_cmds import insert_prefs, create_tables, create_views, add_users, write_frame, extend_calendar
+    from sql_cmds import create_indexes, check_view_plans, ensure_materialized_tables, refresh_materialized
+    from sql_cmds import bump_generation, ensure_sleep_levels_table, load_sleep_levels, refresh_daily_features
+    from sql_cmds import ensure_note_index, migrate_entry_tags, migrate_calendar_weekends
+    from sql_cmds.sql_cmds import table_exists
+    from sql_cmds.incremental import LoadStats, incremental_load
+    from extractor.data_extractor import extract_daylio_data
+    from extractor.backfill import backfill_daylio_data
+    from extractor.fingerprints import FingerprintStore, digest_file, digest_records
+    from cleaner.cleaner import DaylioCleaner, create_entry_tags, create_mood_groups, memory_report
+
+    settings = get_settings()
+    fingerprints = FingerprintStore(settings.fingerprints_path)
+    if not Path(db.db_path).exists():
+        logger.info(f"Database not found at {db.db_path}, creating new database")
+        create_tables(db)
+        add_users(db)
+        create_views(db)
+        # a new database holds none of the previously loaded tables
+        fingerprints.reset()
 
     logger.info("Mood Dash ETL beginning")
-    extract_daylio_data()
-    daylio_data_path = DATA_DIR / "daylio.json"
-    logger.info(f"Reading extracted data from {daylio_data_path}")
-    daylio_data = json.loads(daylio_data_path.read_text())
+    # databases from before the summary tables existed get them built in full
+    with db as conn:
+        rebuild = ensure_materialized_tables(conn)
+        # databases from before the segments table get it filled by this run
+        levels_missing = not table_exists(conn, 'fitbit_sleep_levels')
+        ensure_sleep_levels_table(conn)
+        # triggers keep the note index current, they have to exist before any load
+        ensure_note_index(conn)
+    if rebuild:
+        create_views(db)
+    # the migration drops entry_tags' indexes, create_indexes puts them back
+    migrate_entry_tags(db)
+    migrate_calendar_weekends(db)
+    # indexes added since the database was created are built on existing ones
+    create_indexes(db)
+    with db as conn:
+        check_view_plans(conn)
 
-    daylio_tables = []
+    def extract_daylio():
+        if not load_daylio:
+            return {}
+        if backfill_dir is None:
+            return extract_daylio_data(fingerprints, force=force, backup_file=backup_file)
+        merged, report = backfill_daylio_data(
+            fingerprints, backfill_dir, max_workers=workers)
+        report_path = settings.state_dir / "backfill_report.json"
+        # a new tenant's state directory only exists once something is cached in it
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(report.to_json(), indent=2, default=str))
+        logger.info(f"Backfill report written to {report_path}")
+        return merged
 
-    logger.info("Cleaning and loading Daylio data into memory")
-    for table_name, table_data in daylio_data.items():
-        if table_name == 'prefs':
-            # prefs table is small and consists of one record, so just insert it directly
-            insert_prefs(table_data)
-            continue
+    # the Fitbit fetch waits on the network while the backup is decoded, and
+    # the calendar is extended on this thread meanwhile
+    with span("sources"):
+        sources = PipelineRunner([
+            Task('calendar', lambda: extend_calendar(db), writer=True),
+            Task('daylio', extract_daylio),
+            Task('sleep_entries', get_fitbit_sleep_data if fetch_sleep else lambda: None),
+        ]).run()
+
+    # load stats per table, the materialized tables refresh from these
+    loads = {}
+    if sources['calendar'].inserted:
+        loads['calendar'] = sources['calendar']
+
+    daylio_data = sources['daylio']
+    if daylio_data is None:
+        logger.info("No Daylio data to load")
+        daylio_data = {}
+
+    sleep_entries = sources['sleep_entries']
+    sleep_changed = sleep_entries is not None and (fingerprints.changed(
+        'fitbit_sleep', digest_records(sleep_entries)) or levels_missing)
+    mood_groups_changed = fingerprints.changed(
+        'mood_groups', digest_file(settings.mood_groups_path))
 
-        logger.info(f"Loading data for table '{table_name}'")
-        daylio_df = pd.DataFrame(table_data)
+    if not (daylio_data or sleep_changed or mood_groups_changed):
+        with db as conn:
+            if loads or rebuild:
+                refresh_materialized(conn, loads, rebuild)
+            # builds the feature table of databases from before it existed
+            if refresh_daily_features(conn, loads, bool(rebuild)) or loads or rebuild:
+                bump_generation(conn, get_run_id())
+        fingerprints.save()
+        logger.info("No changes since last run, Mood Dash ETL complete")
+        return
+
+    def load_table(cleaner: DaylioCleaner) -> None:
+        stats = cleaner.to_sql(conn, keep_deleted=settings.keep_deleted_rows)
+        if stats is not None:
+            loads[cleaner.name] = stats
 
-        logger.info(f"Cleaning data for table '{table_name}'")
-        daylio_table = DaylioCleaner(
-            name=table_name,
-            table=daylio_df
-        )
+    def load_sleep(sleep_table) -> None:
+        if sleep_table.empty:
+            return
+        if table_exists(conn, 'fitbit_sleep'):
+            loads['fitbit_sleep'] = incremental_load(
+                conn, 'fitbit_sleep', sleep_table, track='date')
+        else:
+            write_frame(conn, 'fitbit_sleep', sleep_table, if_exists='replace')
+            loads['fitbit_sleep'] = LoadStats(
+                table='fitbit_sleep', inserted=len(sleep_table))
 
-        daylio_tables.append(daylio_table)
+    def load_sleep_levels_table(segments) -> None:
+        loads['fitbit_sleep_levels'] = load_sleep_levels(conn, segments)
 
+    # each table is cleaned in the worker pool and written by this thread as
+    # soon as it is ready, entry_tags waits for the cleaned dayEntries
+    tasks = []
+    for table_name, daylio_df in daylio_data.items():
+        if table_name == 'prefs':
+            # prefs table is small and consists of one record, so it is inserted directly
+            prefs = daylio_df.to_dict('records')
+            tasks.append(Task('load_prefs', lambda prefs=prefs: insert_prefs(prefs, db), writer=True))
+            continue
+        tasks.append(Task(f'clean_{table_name}', lambda name=table_name, df=daylio_df: DaylioCleaner(name=name, table=df)))
+        tasks.append(Task(f'load_{table_name}', load_table, deps=(f'clean_{table_name}',), writer=True))
         if table_name == 'dayEntries':
-            logger.info("Creating entry_tags table from dayEntries")
-            entry_tags_table = create_entry_tags(daylio_table)
-            daylio_tables.append(entry_tags_table)
+            tasks.append(Task('clean_entry_tags', create_entry_tags, deps=('clean_dayEntries',)))
+            tasks.append(Task('load_entry_tags', load_table, deps=('clean_entry_tags',), writer=True))
+
+    if mood_groups_changed:
+        tasks.append(Task('clean_mood_groups', create_mood_groups))
+        tasks.append(Task('load_mood_groups', load_table, deps=('clean_mood_groups',), writer=True))
+
+    if sleep_changed:
+        tasks.append(Task('clean_fitbit_sleep', lambda: clean_sleep_data(sleep_entries)))
+        tasks.append(Task('load_fitbit_sleep', load_sleep, deps=('clean_fitbit_sleep',), writer=True))
+        tasks.append(Task('flatten_fitbit_sleep_levels', lambda: sleep_segments(sleep_entries)))
+        tasks.append(Task('load_fitbit_sleep_levels', load_sleep_levels_table,
+                          deps=('flatten_fitbit_sleep_levels',), writer=True))
 
-    logger.info("Creating mood_groups table")
-    daylio_tables.append(create_mood_groups())
+    logger.info(f"Cleaning and writing data to database at {db.db_path}")
+    # every write below shares one transaction
+    db_size = Path(db.db_path).stat().st_size
+    with span("clean_and_load") as load_span:
+        with db.bulk_load() as conn:
+            results = PipelineRunner(tasks).run()
+            with span("refresh_materialized") as refresh_span:
+                refresh_span.rows_out = sum(refresh_materialized(conn, loads, rebuild).values())
+            # the features read mv_sleep_main_per_day, so they refresh after it
+            with span("refresh_daily_features") as features_span:
+                features_span.rows_out = refresh_daily_features(conn, loads, bool(rebuild))
+            # dashboard readers drop their cached results once this commits
+            bump_generation(conn, get_run_id())
+        load_span.rows_out = sum(stats.inserted + stats.updated + stats.deleted
+                                 for stats in loads.values())
+        # bulk_load checkpoints the wal on exit, so the file growth covers every write
+        load_span.bytes_written = Path(db.db_path).stat().st_size - db_size
 
-    logger.info(f"Writing cleaned data to database at {DB_PATH}")
-    for table in daylio_tables:
-        table.to_sql(create_db_conn(DB_PATH))
-    fit_bit_sleep_table = clean_sleep_data()
-    fit_bit_sleep_table.to_sql(
-        'fitbit_sleep', create_db_conn(DB_PATH), if_exists='replace', index=False)
+    cleaned = [result for name, result in results.items()
+               if isinstance(result, DaylioCleaner)]
+    if cleaned:
+        report = memory_report(cleaned)
+        logger.info(
+            f"Cleaned tables use {report['after_bytes'].sum() / 2**20:.2f} MB, "
+            f"{report['before_bytes'].sum() / 2**20:.2f} MB before dtype coercion")
 
+    # only record the new fingerprints once everything has loaded
+    fingerprints.save()
     logger.info("Mood Dash ETL complete")
 
 
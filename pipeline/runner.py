@@ -0,0 +1,115 @@
+import time
+import contextvars
+
+from typing import Any, Callable
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from log_setup import setup_logger
+from log_setup.metrics import span
+
+logger = setup_logger()
+
+
+@dataclass
+class Task:
+    """
+    A pipeline step. func is called with the results of deps, in order, once
+    they have all finished. Writer tasks run one at a time on the thread that
+    called PipelineRunner.run, so only that thread ever writes to SQLite.
+    """
+    name: str
+    func: Callable[..., Any]
+    deps: tuple[str, ...] = ()
+    writer: bool = False
+
+
+class PipelineRunner:
+    """
+    Runs a graph of tasks, starting each as soon as its dependencies are done.
+    Other tasks run concurrently in a thread pool while the calling thread
+    acts as the single writer.
+
+        runner = PipelineRunner([
+            Task('extract', extract),
+            Task('clean', clean, deps=('extract',)),
+            Task('load', load, deps=('clean',), writer=True),
+        ])
+        results = runner.run()
+    """
+
+    def __init__(self, tasks: list[Task], max_workers: int = 4) -> None:
+        self.tasks = {}
+        for task in tasks:
+            if task.name in self.tasks:
+                raise ValueError(f"Duplicate task '{task.name}'.")
+            self.tasks[task.name] = task
+        for task in tasks:
+            unknown = [dep for dep in task.deps if dep not in self.tasks]
+            if unknown:
+                raise ValueError(
+                    f"Task '{task.name}' depends on unknown tasks {unknown}.")
+        self._check_acyclic()
+        self.max_workers = max_workers
+        self.timings = {}
+
+    def _check_acyclic(self) -> None:
+        done = set()
+        remaining = dict(self.tasks)
+        while remaining:
+            ready = [name for name, task in remaining.items()
+                     if all(dep in done for dep in task.deps)]
+            if not ready:
+                raise ValueError(
+                    f"Task dependencies form a cycle between {sorted(remaining)}.")
+            for name in ready:
+                done.add(name)
+                del remaining[name]
+
+    def _call(self, task: Task, results: dict[str, Any]) -> Any:
+        start = time.perf_counter()
+        with span(f"task.{task.name}"):
+            result = task.func(*(results[dep] for dep in task.deps))
+        self.timings[task.name] = time.perf_counter() - start
+        logger.debug(f"Task {task.name} finished in {self.timings[task.name]:.2f}s")
+        return result
+
+    def run(self) -> dict[str, Any]:
+        """
+        :return: Result of every task, keyed by task name
+        """
+        results = {}
+        waiting = dict(self.tasks)
+        running = {}
+
+        def ready(writer: bool) -> list[Task]:
+            return [task for task in waiting.values()
+                    if task.writer == writer and all(dep in results for dep in task.deps)]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                while waiting or running:
+                    for task in ready(writer=False):
+                        del waiting[task.name]
+                        # the copied context makes the task's spans children of the open one
+                        context = contextvars.copy_context()
+                        running[pool.submit(context.run, self._call, task, results)] = task
+
+                    writers = ready(writer=True)
+                    if writers:
+                        # writes run between polls so finished workers keep the pool busy
+                        task = writers[0]
+                        del waiting[task.name]
+                        results[task.name] = self._call(task, results)
+                    else:
+                        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            task = running.pop(future)
+                            results[task.name] = future.result()
+
+                    for future in [f for f in running if f.done()]:
+                        results[running.pop(future).name] = future.result()
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+        return results
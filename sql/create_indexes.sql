@@ -0,0 +1,12 @@
+-- secondary indexes on the join and filter columns the views use
+CREATE INDEX IF NOT EXISTS idx_entry_tags_entry_id ON entry_tags (entry_id);
+
+CREATE INDEX IF NOT EXISTS idx_entry_tags_tag ON entry_tags (tag);
+
+CREATE INDEX IF NOT EXISTS idx_dayEntries_date ON dayEntries (date);
+
+CREATE INDEX IF NOT EXISTS idx_goalEntries_goalId_date ON goalEntries (goalId, date);
+
+CREATE INDEX IF NOT EXISTS idx_goalEntries_date ON goalEntries (date);
+
+CREATE INDEX IF NOT EXISTS idx_fitbit_sleep_date ON fitbit_sleep (date);
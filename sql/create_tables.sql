@@ -29,6 +29,7 @@ CREATE TABLE IF NOT EXISTS dayEntries (
     note TEXT,
     note_title TEXT,
     date DATE,
+    tag_count INTEGER,
     FOREIGN KEY (mood) REFERENCES customMoods (id)
 );
 
@@ -86,8 +87,9 @@ CREATE TABLE IF NOT EXISTS calendar (
 CREATE TABLE IF NOT EXISTS mood_groups (id INTEGER PRIMARY KEY, name TEXT, value INTEGER);
 
 CREATE TABLE IF NOT EXISTS entry_tags (
-    entry_id INTEGER,
-    tag TEXT,
+    entry_id INTEGER NOT NULL,
+    tag INTEGER NOT NULL,
+    PRIMARY KEY (entry_id, tag),
     FOREIGN KEY (entry_id) REFERENCES dayEntries (id)
 );
 
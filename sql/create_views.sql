@@ -10,22 +10,23 @@ DROP VIEW IF EXISTS v_sleep_main_per_day ;
 DROP VIEW IF EXISTS v_topics_summary ;
 
 
+-- the 90 day views below keep their fixed window for ad hoc queries, the
+-- dashboard reads them through sql/view_queries.sql with a window of its own
+
+-- reads mv_activity_daily, refreshed by sql_cmds.materialize after each load
 CREATE VIEW v_activity_summary AS
 WITH ranked_activities AS (
     SELECT
-        tg.name AS [group],
-        t.name AS [activity],
-        COUNT(t.name) AS [count],
+        [group],
+        activity,
+        SUM([count]) AS [count],
         ROW_NUMBER() OVER (
-            PARTITION BY tg.name
-            ORDER BY COUNT(t.name) DESC
+            PARTITION BY [group]
+            ORDER BY SUM([count]) DESC
         ) AS rank
-    FROM dayEntries AS de
-    LEFT JOIN entry_tags AS et ON de.id = et.entry_id
-    LEFT JOIN tags AS t ON et.tag = t.id
-    LEFT JOIN tag_groups AS tg ON t.id_tag_group = tg.id
-    WHERE date(de.date) > date('now', '-90 days')
-    GROUP BY tg.name, t.name
+    FROM mv_activity_daily
+    WHERE day > date('now', '-90 days')
+    GROUP BY [group], activity
 )
 SELECT [group], activity, [count]
 FROM ranked_activities
@@ -47,7 +48,8 @@ SELECT
     FROM dayEntries as de
     join customMoods as cm on de.mood = cm.id
     join mood_groups as mg on cm.mood_group_id = mg.id
-    where date(de.date) > date('now', '-90 days')
+    -- same days as date(de.date) > date('now', '-90 days'), but can use idx_dayEntries_date
+    where de.date >= date('now', '-89 days')
     order by de.date, de.datetime;
 
 CREATE VIEW v_daily_avgs
@@ -67,15 +69,12 @@ order by day desc;
 CREATE VIEW v_sleep_summary
 AS
 SELECT
-    t.name as [sleep_status],
-    COUNT(t.name) AS [count]
-FROM dayEntries AS de
-LEFT JOIN entry_tags as et on de.id = et.entry_id
-LEFT JOIN tags AS t ON et.tag = t.id
-LEFT JOIN tag_groups AS tg ON t.id_tag_group = tg.id
-where date(de.date) > date('now', '-90 days')
-AND tg.name = 'Sleep'
-group by t.name;
+    activity as [sleep_status],
+    SUM([count]) AS [count]
+FROM mv_activity_daily
+where day > date('now', '-90 days')
+AND [group] = 'Sleep'
+group by activity;
 
 CREATE VIEW v_sleep_trend
 AS
@@ -92,7 +91,7 @@ FROM dayEntries AS de
 LEFT JOIN entry_tags as et on de.id = et.entry_id
 LEFT JOIN tags AS t ON et.tag = t.id
 where  t.id in (75, 76, 77, 152)
-and date(de.date) > date('now', '-90 days')
+and de.date >= date('now', '-89 days')
 group by de.date, t.name;
 
 CREATE VIEW v_goal_summary AS
@@ -117,14 +116,13 @@ ORDER BY times_completed DESC, goal_start;
 
 CREATE VIEW v_goal_calendar AS
 SELECT
-    g.goal_id,
-    g.name AS goal_name,
-    cal.Date AS calendar_day,
-    CASE WHEN ge.id IS NOT NULL THEN 1 ELSE 0 END AS goal_completed
-FROM goals g
-JOIN calendar cal ON cal.Date BETWEEN DATE(g.created_at) AND COALESCE(g.date_end, g.end_date, DATE('now'))
-LEFT JOIN goalEntries ge ON g.goal_id = ge.goalId AND ge.date = cal.Date
-ORDER BY g.goal_id, cal.Date;
+    goal_id,
+    goal_name,
+    calendar_day,
+    goal_completed
+FROM mv_goal_calendar
+WHERE goal_end IS NOT NULL OR calendar_day <= DATE('now')
+ORDER BY goal_id, calendar_day;
 
 
 CREATE VIEW v_goal_progress_by_month AS
@@ -140,32 +138,9 @@ GROUP BY g.goal_id, cal.MonthYear
 ORDER BY g.goal_id, cal.MonthYear;
 
 CREATE VIEW v_sleep_main_per_day AS
-SELECT 
+SELECT
     [date],
     duration_hours,
-    CASE
-        WHEN duration_hours <= 2 THEN 0
-        WHEN duration_hours <= 4 THEN 1
-        WHEN duration_hours <= 6 THEN 2
-        WHEN duration_hours <= 8 THEN 3
-        ELSE 4
-    END AS sleep_quality_score,
-    
-    CASE
-        WHEN duration_hours <= 2 THEN 'Very Poor'
-        WHEN duration_hours <= 4 THEN 'Poor'
-        WHEN duration_hours <= 6 THEN 'Fair'
-        WHEN duration_hours <= 8 THEN 'Good'
-        ELSE 'Too Much'
-    END AS sleep_quality_label
-FROM fitbit_sleep
-WHERE sleep_type != 'nap'
-  AND (
-      date, duration_minutes
-  ) IN (
-      SELECT date, MAX(duration_minutes)
-      FROM fitbit_sleep
-      WHERE sleep_type != 'nap'
-      GROUP BY date
-  );
-
+    sleep_quality_score,
+    sleep_quality_label
+FROM mv_sleep_main_per_day;
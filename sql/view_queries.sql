@@ -0,0 +1,83 @@
+-- Dashboard queries of the windowed views, read by sql_cmds.read_api.
+-- Each block follows a "-- name: <view>" line and takes the window as
+-- :start (first day, inclusive) and :stop (day after the last one), so
+-- the dashboard can ask for any range. Views not listed here are read
+-- with SELECT * from the view itself.
+
+-- name: v_activity_summary
+WITH ranked_activities AS (
+    SELECT
+        [group],
+        activity,
+        SUM([count]) AS [count],
+        ROW_NUMBER() OVER (
+            PARTITION BY [group]
+            ORDER BY SUM([count]) DESC
+        ) AS rank
+    FROM mv_activity_daily
+    WHERE day >= :start AND day < :stop
+    GROUP BY [group], activity
+)
+SELECT [group], activity, [count]
+FROM ranked_activities
+WHERE rank <= 10
+ORDER BY [group], [count] DESC;
+
+-- name: v_entry_details
+SELECT
+        de.date as day
+        ,de.datetime as entry_datetime
+        ,de.id as entry_id
+        ,de.mood as mood_id
+        ,cm.custom_name as mood_name
+        ,cm.mood_group_id as mood_group
+        ,cm.mood_value as mood_value
+        ,mg.name as mood_group_name
+    FROM dayEntries as de
+    join customMoods as cm on de.mood = cm.id
+    join mood_groups as mg on cm.mood_group_id = mg.id
+    where de.date >= :start and de.date < :stop
+    order by de.date, de.datetime;
+
+-- name: v_daily_avgs
+SELECT
+    de.date as day,
+    round(avg(cm.mood_value), 2) as avg_mood_value
+FROM dayEntries as de
+join customMoods as cm on de.mood = cm.id
+join mood_groups as mg on cm.mood_group_id = mg.id
+where de.date >= :start and de.date < :stop
+group by de.date
+order by de.date desc;
+
+-- name: v_sleep_summary
+SELECT
+    activity as [sleep_status],
+    SUM([count]) AS [count]
+FROM mv_activity_daily
+where day >= :start and day < :stop
+AND [group] = 'Sleep'
+group by activity;
+
+-- name: v_sleep_trend
+SELECT
+    de.date as [day],
+    t.name as [sleep_status],
+    CASE
+        WHEN t.name = 'good sleep' then 3
+        WHEN t.name = 'medium sleep' then 2
+        when t.name = 'bad sleep' then 1
+        else 0
+    END AS [value]
+FROM dayEntries AS de
+LEFT JOIN entry_tags as et on de.id = et.entry_id
+LEFT JOIN tags AS t ON et.tag = t.id
+where  t.id in (75, 76, 77, 152)
+and de.date >= :start and de.date < :stop
+group by de.date, t.name;
+
+-- name: daily_features
+SELECT *
+FROM daily_features
+WHERE day >= :start AND day < :stop
+ORDER BY day;
@@ -1,3 +1,10 @@
-from .db_init import create_tables, create_views, insert_prefs
-from .sql_cmds import create_db_conn, read_sql_view_to_df, execute_sql_command, execute_sql_script
+from .db_init import create_tables, create_indexes, create_views, insert_prefs, migrate_entry_tags, migrate_calendar_weekends
+from .sql_cmds import create_db_conn, DbConnection, transaction, write_frame, read_sql_view_to_df, execute_sql_command, execute_sql_script
+from .calendar_cmds import extend_calendar
+from .materialize import ensure_materialized_tables, refresh_materialized
+from .query_plans import check_view_plans
+from .features import refresh_daily_features
+from .note_search import ensure_note_index, search_notes
+from .sleep_levels import ensure_sleep_levels_table, load_sleep_levels, read_sleep_levels
+from .read_api import DashboardReader, get_reader, bump_generation
 from .add_users import add_users
@@ -2,15 +2,8 @@ import os
 import bcrypt
 
 from enum import Enum
-from dotenv import load_dotenv
-from sql_cmds import create_db_conn, execute_sql_command
-
-load_dotenv()
-
-DB_PATH = os.getenv('DB_PATH')
-
-if not DB_PATH:
-    raise ValueError("DB_PATH not set in environment variables.")
+from config import get_settings
+from sql_cmds import DbConnection, execute_sql_command
 
 
 class UserRole(Enum):
@@ -19,7 +12,7 @@ class UserRole(Enum):
     PROVIDER = 'provider'
 
 
-def add_user(username: str, name: str, password: str, role: UserRole, db_path: str = DB_PATH):
+def add_user(username: str, name: str, password: str, role: UserRole, db: DbConnection):
 
     hashed_password = bcrypt.hashpw(password.encode(
         'utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -27,12 +20,15 @@ def add_user(username: str, name: str, password: str, role: UserRole, db_path: s
     sql_cmd = "INSERT INTO users (username, name, password_hash, role) VALUES (?, ?, ?, ?)"
     user_data = (username, name, hashed_password, role.value)
 
-    execute_sql_command(create_db_conn(db_path), sql_cmd, True, user_data)
+    with db as conn:
+        execute_sql_command(conn, sql_cmd, True, user_data)
 
 # TODO: Run script to add users, create login page, and set up authentication
 
 
-def add_users():
+def add_users(db: DbConnection):
+    # passwords come from .env, which get_settings loads
+    get_settings()
     logins = [
         {
             "username": "admin",
@@ -56,9 +52,15 @@ def add_users():
             username=login["username"],
             name=login["name"],
             password=login["password"],
-            role=login["role"]
+            role=login["role"],
+            db=db
         )
 
 
 if __name__ == "__main__":
-    add_users()
+    db_path = get_settings().db_path
+    if not db_path:
+        raise ValueError("DB_PATH not set in environment variables.")
+    db = DbConnection(db_path)
+    add_users(db)
+    db.close()
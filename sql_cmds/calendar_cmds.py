@@ -1,33 +1,89 @@
+import sqlite3
 import pandas as pd
-from datetime import datetime
 
+from config import get_settings
+from log_setup import setup_logger
+
+from .sql_cmds import DbConnection, table_exists, to_sql_values, write_frame
+from .incremental import LoadStats
+
+logger = setup_logger()
+
+DEFAULT_CALENDAR_START = '2018-01-01'
+WEEK_STARTS = ('monday', 'sunday')
 
-def is_weekend(day: int):
-    if day == 6 or day == 0:
-        return True
-    else:
-        return False
 
+def create_rolling_calendar(start=DEFAULT_CALENDAR_START, end=None, week_start: str = 'monday') -> pd.DataFrame:
+    """
+    Builds one calendar row per day from start to end inclusive.
 
-def is_weekday(day: int):
-    if 0 < day < 6:
-        return True
+    :param start: First day of the calendar
+    :param end: Last day of the calendar, defaults to today
+    :param week_start: 'monday' numbers weeks by ISO week, 'sunday' numbers
+        them from the first Sunday of the year like strftime's %U
+    :return: Calendar DataFrame
+    """
+    if week_start not in WEEK_STARTS:
+        raise ValueError(f"week_start must be one of {WEEK_STARTS}.")
+    if end is None:
+        end = pd.Timestamp.today().normalize()
+
+    days = pd.date_range(start, end, freq='D')
+    # strftime('%w') numbering, Sunday is 0
+    day_of_week = (days.dayofweek + 1) % 7
+    if week_start == 'monday':
+        week = days.isocalendar().week.to_numpy()
     else:
-        return False
-
-
-def create_rolling_calendar(start='2018-01-01', end=datetime.today().strftime('%Y-%m-%d')):
-    df = pd.DataFrame({"TimeStamp": pd.date_range(start, end)})
-    df['Date'] = pd.to_datetime(df['TimeStamp'])
-    df["Day"] = df.TimeStamp.apply(lambda x: x.to_pydatetime().date().strftime('%w'))
-    df["DayName"] = df.TimeStamp.apply(lambda x: x.to_pydatetime().date().strftime('%A'))
-    df["Week"] = df.Date.apply(lambda x: x.isocalendar()[1])
-    df["Month"] = df.TimeStamp.apply(lambda x: x.to_pydatetime().date().month)
-    df["MonthName"] = df.TimeStamp.apply(lambda x: x.to_pydatetime().date().strftime('%B'))
-    df["Quarter"] = df.TimeStamp.apply(lambda x: x.quarter)
-    df["Year"] = df.TimeStamp.apply(lambda x: x.year)
+        week = (days.dayofyear - 1 + 7 - day_of_week) // 7
+
+    df = pd.DataFrame({
+        "TimeStamp": days,
+        "Date": days,
+        "Day": day_of_week,
+        "DayName": days.day_name(),
+        "Week": week,
+        "Month": days.month,
+        "MonthName": days.month_name(),
+        "Quarter": days.quarter,
+        "Year": days.year,
+    })
     df['MonthYear'] = df['MonthName'] + "-" + df['Year'].astype(str)
-    df['QuarterYear'] = df.TimeStamp.apply(lambda x: f"Q{x.quarter}-{x.year}")
-    df['IsWeekend'] = df.Date.apply(lambda x: is_weekend(x.weekday()))
-    df['IsWeekday'] = df.Date.apply(lambda x: is_weekday(x.weekday()))
+    df['QuarterYear'] = "Q" + df['Quarter'].astype(str) + "-" + df['Year'].astype(str)
+    df['IsWeekend'] = days.dayofweek >= 5
+    df['IsWeekday'] = ~df['IsWeekend']
     return df
+
+
+def last_calendar_day(conn: sqlite3.Connection) -> pd.Timestamp | None:
+    if not table_exists(conn, 'calendar'):
+        return None
+    last = conn.execute("SELECT MAX(TimeStamp) FROM calendar").fetchone()[0]
+    return pd.Timestamp(last) if last is not None else None
+
+
+def extend_calendar(db: DbConnection, end=None) -> LoadStats:
+    """
+    Appends the days missing from the calendar table up to today plus the
+    configured horizon, creating the table from the configured start if empty.
+
+    :param db: Database connection manager
+    :param end: Last day to extend to, overrides the configured horizon
+    :return: Stats of the days added, touched holds their dates as the calendar stores them
+    """
+    settings = get_settings()
+    if end is None:
+        end = pd.Timestamp.today().normalize() + pd.Timedelta(days=settings.calendar_horizon_days)
+
+    with db as conn:
+        last_day = last_calendar_day(conn)
+        start = settings.calendar_start if last_day is None else last_day + pd.Timedelta(days=1)
+        if pd.Timestamp(start) > pd.Timestamp(end):
+            logger.info("Calendar is already current")
+            return LoadStats(table='calendar')
+
+        logger.info(f"Extending calendar from {pd.Timestamp(start).date()} to {pd.Timestamp(end).date()}")
+        calendar = create_rolling_calendar(start, end, settings.calendar_week_start)
+        inserted = write_frame(conn, 'calendar', calendar, if_exists='append')
+    # materialized tables map the new days onto the partitions covering them
+    touched = {row[0] for row in to_sql_values(calendar[['Date']])}
+    return LoadStats(table='calendar', inserted=inserted, touched=touched)
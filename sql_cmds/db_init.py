@@ -1,47 +1,100 @@
-import os
-
+from config import get_settings
 from log_setup import setup_logger
 from datetime import datetime
-from dotenv import load_dotenv
 
-from .calendar_cmds import create_rolling_calendar
+from .calendar_cmds import extend_calendar
+from .materialize import ensure_materialized_tables
+from .sleep_levels import ensure_sleep_levels_table
+from .note_search import ensure_note_index
 
 
-from .sql_cmds import create_db_conn, execute_sql_script, Path, execute_sql_command
-load_dotenv()
+from .sql_cmds import DbConnection, execute_sql_script, execute_sql_command, table_exists
 
 logger = setup_logger()
 
-home_dir = Path().cwd()
-data_dir = home_dir / "data"
-db_path = os.getenv('DB_PATH')
-sql_dir = home_dir / "sql"
-create_tables_script = sql_dir / "create_tables.sql"
-create_views_script = sql_dir / "create_views.sql"
-
-
-def create_tables(db_conn=create_db_conn(str(db_path))):
-    logger.info("Executing script to create sql tables in db")
-    execute_sql_script(db_conn, str(create_tables_script))
-
-    logger.info("Creating rolling calendar to-date and loading into sql db")
-    rolling_calendar = create_rolling_calendar()
-
-    rolling_calendar.to_sql('calendar', db_conn,
-                            if_exists="replace", index=False)
-
-    db_conn.commit()
-    db_conn.close()
-
-
-def create_views(db_conn=create_db_conn(str(db_path))):
-    logger.info("Executing script to create requisite views for data charting")
-    execute_sql_script(db_conn, str(create_views_script))
-    db_conn.commit()
-    db_conn.close()
-
 
-def insert_prefs(prefs_dict, db_conn=create_db_conn(str(db_path))):
+def create_tables(db: DbConnection):
+    with db as db_conn:
+        logger.info("Executing script to create sql tables in db")
+        execute_sql_script(db_conn, str(get_settings().sql_dir / "create_tables.sql"))
+
+        logger.info("Creating rolling calendar to-date and loading into sql db")
+        extend_calendar(db)
+
+        create_indexes(db)
+
+        logger.info("Creating materialized summary tables")
+        ensure_materialized_tables(db_conn)
+        ensure_sleep_levels_table(db_conn)
+
+        logger.info("Creating full-text index over entry notes")
+        ensure_note_index(db_conn)
+
+
+def migrate_entry_tags(db: DbConnection) -> bool:
+    """
+    Rebuilds entry_tags tables from before tag was declared INTEGER, whose
+    tag ids were stored as text and could not be looked up by tags.id. The
+    tags are cast back to integers and the table gets its (entry_id, tag) key.
+
+    :return: True if the table was migrated
+    """
+    with db as db_conn:
+        if not table_exists(db_conn, 'entry_tags'):
+            return False
+        columns = {row[1]: (row[2].upper(), row[5])
+                   for row in db_conn.execute("PRAGMA table_info(entry_tags)")}
+        if columns.get('tag') == ('INTEGER', 2):
+            return False
+
+        logger.info("Migrating entry_tags to integer tag ids")
+        db_conn.execute("DROP TABLE IF EXISTS temp._entry_tags_old")
+        db_conn.execute("CREATE TEMP TABLE _entry_tags_old AS SELECT entry_id, tag FROM entry_tags")
+        db_conn.execute("DROP TABLE entry_tags")
+        # recreates entry_tags from its current DDL, the other tables already exist
+        execute_sql_script(db_conn, str(get_settings().sql_dir / "create_tables.sql"))
+        db_conn.execute('''
+            INSERT OR IGNORE INTO entry_tags (entry_id, tag)
+            SELECT entry_id, CAST(tag AS INTEGER) FROM temp._entry_tags_old
+            WHERE entry_id IS NOT NULL AND tag IS NOT NULL''')
+        db_conn.execute("DROP TABLE temp._entry_tags_old")
+    return True
+
+
+def migrate_calendar_weekends(db: DbConnection) -> bool:
+    """
+    Fixes calendar rows written before the weekend was taken from the day of
+    the week, which flagged Sunday and Monday instead of Saturday and Sunday.
+
+    :return: True if any rows were fixed
+    """
+    with db as db_conn:
+        if not table_exists(db_conn, 'calendar'):
+            return False
+        fixed = db_conn.execute('''
+            UPDATE calendar
+            SET IsWeekend = strftime('%w', Date) IN ('0', '6'),
+                IsWeekday = strftime('%w', Date) NOT IN ('0', '6')
+            WHERE IsWeekend IS NOT (strftime('%w', Date) IN ('0', '6'))
+               OR IsWeekday IS NOT (strftime('%w', Date) NOT IN ('0', '6'))''').rowcount
+    if fixed:
+        logger.info(f"Fixed the weekend flags of {fixed} calendar days")
+    return bool(fixed)
+
+
+def create_indexes(db: DbConnection):
+    with db as db_conn:
+        logger.info("Executing script to create indexes on view join and filter columns")
+        execute_sql_script(db_conn, str(get_settings().sql_dir / "create_indexes.sql"))
+
+
+def create_views(db: DbConnection):
+    with db as db_conn:
+        logger.info("Executing script to create requisite views for data charting")
+        execute_sql_script(db_conn, str(get_settings().sql_dir / "create_views.sql"))
+
+
+def insert_prefs(prefs_dict, db: DbConnection):
     insert_query = '''
     INSERT INTO prefs 
     (AUTO_BACKUP_IS_ON, LAST_DAYS_IN_ROWS_NUMBER, DAYS_IN_ROW_LONGEST_CHAIN, LAST_ENTRY_CREATION_TIME) 
@@ -61,6 +114,5 @@ def insert_prefs(prefs_dict, db_conn=create_db_conn(str(db_path))):
 
     logger.info("Creating and inserting 'prefs' table and values")
 
-    execute_sql_command(db_conn, insert_query, True, vals)
-    db_conn.commit()
-    db_conn.close()
+    with db as db_conn:
+        execute_sql_command(db_conn, insert_query, True, vals)
@@ -0,0 +1,195 @@
+import sqlite3
+import pandas as pd
+
+from datetime import date, timedelta
+from log_setup import setup_logger
+
+from .sql_cmds import quote, table_exists, transaction, write_frame
+from .incremental import LoadStats
+
+logger = setup_logger()
+
+FEATURES_TABLE = 'daily_features'
+
+# rolling mean windows in days, the longest decides how far back a refresh reads
+ROLLING_WINDOWS = (7, 30, 90)
+
+# daily values that get rolling means and day over day deltas
+ROLLED_COLUMNS = ('mood_mean', 'sleep_hours', 'sleep_quality')
+
+
+def _feature_columns() -> dict[str, str]:
+    columns = {
+        'day': 'TEXT NOT NULL PRIMARY KEY',
+        'mood_mean': 'REAL',
+        'mood_min': 'INTEGER',
+        'mood_max': 'INTEGER',
+        'entry_count': 'INTEGER NOT NULL',
+        'sleep_hours': 'REAL',
+        'sleep_quality': 'REAL',
+    }
+    for col in ROLLED_COLUMNS:
+        for window in ROLLING_WINDOWS:
+            columns[f'{col}_{window}d'] = 'REAL'
+        columns[f'{col}_delta'] = 'REAL'
+    return columns
+
+
+FEATURE_COLUMNS = _feature_columns()
+
+# query turning each source's touched values (temp._touched) into the first
+# day they change, or None if any change rebuilds every day
+FEATURE_SOURCES = {
+    'dayEntries': "SELECT MIN(date(value)) FROM temp._touched",
+    'entry_tags': '''
+        SELECT MIN(date(de.date)) FROM dayEntries AS de
+        JOIN temp._touched AS k ON de.id = k.value''',
+    'fitbit_sleep': "SELECT MIN(date(value)) FROM temp._touched",
+    'customMoods': None,
+    'mood_groups': None,
+    'tags': None,
+}
+
+# entries and moods joined as v_entry_details does
+MOOD_QUERY = '''
+    SELECT
+        date(de.date) AS day,
+        AVG(cm.mood_value) AS mood_mean,
+        MIN(cm.mood_value) AS mood_min,
+        MAX(cm.mood_value) AS mood_max,
+        COUNT(*) AS entry_count
+    FROM dayEntries AS de
+    JOIN customMoods AS cm ON de.mood = cm.id
+    JOIN mood_groups AS mg ON cm.mood_group_id = mg.id
+    WHERE de.date >= :start AND de.date < :stop
+    GROUP BY date(de.date)'''
+
+# tied longest sleeps of a night have the same length
+SLEEP_QUERY = '''
+    SELECT [date] AS day, MAX(duration_hours) AS sleep_hours
+    FROM mv_sleep_main_per_day
+    WHERE [date] >= :start AND [date] < :stop
+    GROUP BY [date]'''
+
+# sleep tags valued as v_sleep_trend does, a day tagged twice gets the mean
+SLEEP_QUALITY_QUERY = '''
+    SELECT
+        date(de.date) AS day,
+        AVG(CASE
+            WHEN t.name = 'good sleep' THEN 3
+            WHEN t.name = 'medium sleep' THEN 2
+            WHEN t.name = 'bad sleep' THEN 1
+            ELSE 0
+        END) AS sleep_quality
+    FROM dayEntries AS de
+    JOIN entry_tags AS et ON de.id = et.entry_id
+    JOIN tags AS t ON et.tag = t.id
+    WHERE t.id IN (75, 76, 77, 152)
+      AND de.date >= :start AND de.date < :stop
+    GROUP BY date(de.date)'''
+
+
+def build_daily_features(days: pd.DatetimeIndex, mood: pd.DataFrame, sleep: pd.DataFrame,
+                         sleep_quality: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lays the daily mood and sleep values on the days given and adds their
+    rolling means and day over day deltas. Windows are measured in days, so
+    a day without a value is skipped by the means rather than counted as 0.
+
+    :param days: Days of the calendar spine, in order
+    :param mood: mood_mean, mood_min, mood_max and entry_count indexed by day
+    :param sleep: sleep_hours indexed by day
+    :param sleep_quality: sleep_quality indexed by day
+    :return: DataFrame with FEATURE_COLUMNS except day, indexed by day
+    """
+    # the union of the days is left unsorted, reindexing lays it on the calendar order
+    features = pd.concat([mood, sleep, sleep_quality], axis=1, sort=False).reindex(days)
+    features['entry_count'] = features['entry_count'].fillna(0).astype('int64')
+    for col in ROLLED_COLUMNS:
+        values = features[col].astype(float)
+        for window in ROLLING_WINDOWS:
+            features[f'{col}_{window}d'] = values.rolling(f'{window}D', min_periods=1).mean()
+        previous = values.shift(1, freq='D').reindex(days)
+        features[f'{col}_delta'] = values - previous
+    return features[[col for col in FEATURE_COLUMNS if col != 'day']]
+
+
+def _read_daily(conn: sqlite3.Connection, query: str, params: dict) -> pd.DataFrame:
+    return pd.read_sql_query(query, conn, params=params, index_col='day', parse_dates=['day'])
+
+
+def _first_changed_day(conn: sqlite3.Connection, loads: dict[str, LoadStats]) -> tuple[str | None, bool]:
+    """
+    :return: First day whose inputs a load changed, and whether every day has to be rebuilt
+    """
+    first = None
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _touched (value)")
+    for name, source in FEATURE_SOURCES.items():
+        stats = loads.get(name)
+        if stats is None or not (stats.inserted or stats.updated or stats.deleted):
+            continue
+        if source is None or stats.touched is None:
+            return None, True
+        conn.execute("DELETE FROM temp._touched")
+        conn.executemany("INSERT INTO temp._touched (value) VALUES (?)",
+                         [(value,) for value in stats.touched])
+        day = conn.execute(source).fetchone()[0]
+        if day is not None and (first is None or day < first):
+            first = day
+    return first, False
+
+
+def refresh_daily_features(conn: sqlite3.Connection, loads: dict[str, LoadStats],
+                           rebuild: bool = False, today: date | None = None) -> int:
+    """
+    Brings the daily feature table up to date on the calendar spine, up to
+    today. Only the days from the first one a load changed onwards are
+    recomputed, reading back as far as the longest rolling window needs.
+
+    :param conn: Connection to the target database
+    :param loads: Load stats of this run keyed by table name
+    :param rebuild: Recompute every day
+    :param today: Last day to compute, defaults to today
+    :return: Number of days written
+    """
+    today = today or date.today()
+    with transaction(conn):
+        if not table_exists(conn, FEATURES_TABLE):
+            columns = ", ".join(f"{quote(col)} {sql_type}" for col, sql_type in FEATURE_COLUMNS.items())
+            conn.execute(f"CREATE TABLE {quote(FEATURES_TABLE)} ({columns}) WITHOUT ROWID")
+            rebuild = True
+
+        first_day, last_day = conn.execute(
+            "SELECT MIN(date(Date)), MAX(date(Date)) FROM calendar").fetchone()
+        if first_day is None:
+            return 0
+        last_day = min(last_day, today.isoformat())
+
+        changed, rebuild = (None, True) if rebuild else _first_changed_day(conn, loads)
+        # days the calendar gained since the last refresh
+        last_feature = conn.execute(f"SELECT MAX(day) FROM {quote(FEATURES_TABLE)}").fetchone()[0]
+        new_days = first_day if last_feature is None else (
+            date.fromisoformat(last_feature) + timedelta(days=1)).isoformat()
+        start = first_day if rebuild else new_days if changed is None else min(changed, new_days)
+        start = max(start, first_day)
+        if start > last_day:
+            return 0
+
+        read_from = max(first_day, (date.fromisoformat(start) - timedelta(
+            days=max(ROLLING_WINDOWS) - 1)).isoformat())
+        params = {'start': read_from,
+                  'stop': (date.fromisoformat(last_day) + timedelta(days=1)).isoformat()}
+        days = pd.DatetimeIndex(pd.read_sql_query(
+            "SELECT DISTINCT date(Date) AS day FROM calendar "
+            "WHERE Date >= :start AND Date < :stop ORDER BY day",
+            conn, params=params, parse_dates=['day'])['day'])
+        features = build_daily_features(
+            days, _read_daily(conn, MOOD_QUERY, params), _read_daily(conn, SLEEP_QUERY, params),
+            _read_daily(conn, SLEEP_QUALITY_QUERY, params))
+        features = features[features.index >= pd.Timestamp(start)]
+        features.insert(0, 'day', features.index.strftime('%Y-%m-%d'))
+
+        conn.execute(f"DELETE FROM {quote(FEATURES_TABLE)} WHERE day >= ?", (start,))
+        written = write_frame(conn, FEATURES_TABLE, features.reset_index(drop=True))
+    logger.info(f"Refreshed {FEATURES_TABLE} from {start}, {written} days written")
+    return written
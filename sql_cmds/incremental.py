@@ -0,0 +1,176 @@
+import sqlite3
+import pandas as pd
+
+from contextlib import nullcontext
+from dataclasses import dataclass
+from log_setup import setup_logger
+
+from .sql_cmds import BULK_INDEX_ROWS, quote, suspended_indexes, to_sql_values, transaction
+
+logger = setup_logger()
+
+STAGE_TABLE = "_incremental_stage"
+
+
+@dataclass
+class LoadStats:
+    table: str
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    # values of the tracked column on the changed rows, before and after the
+    # change, or None when no column was tracked or the whole table was rewritten
+    touched: set | None = None
+
+    def __str__(self) -> str:
+        return (f"{self.table}: {self.inserted} inserted, "
+                f"{self.updated} updated, {self.deleted} deleted")
+
+
+def table_columns(conn: sqlite3.Connection, table_name: str) -> list[tuple[str, int]]:
+    """
+    :return: List of (column name, primary key position) for the table
+    """
+    rows = conn.execute(f"PRAGMA table_info({quote(table_name)})").fetchall()
+    return [(row[1], row[5]) for row in rows]
+
+
+def unique_indexes(conn: sqlite3.Connection, table_name: str) -> list[list[str]]:
+    """
+    :return: Columns of each unique index on the table, partial and expression
+        indexes left out as they don't identify every row
+    """
+    indexes = []
+    for _, name, unique, _, partial in conn.execute(
+            f"PRAGMA index_list({quote(table_name)})").fetchall():
+        if not unique or partial:
+            continue
+        cols = [row[2] for row in conn.execute(
+            f"PRAGMA index_info({quote(name)})").fetchall()]
+        if cols and None not in cols:
+            indexes.append(cols)
+    return indexes
+
+
+def key_columns(conn: sqlite3.Connection, table_name: str, columns: list[str]) -> list[str]:
+    """
+    Primary key declared in the table's DDL. When the frame doesn't carry it,
+    e.g. a surrogate id assigned on insert, a unique index the frame covers is
+    used instead. Tables created without either (older pandas replaced tables,
+    entry_tags) fall back to 'id', then to every column.
+    """
+    declared = [name for name, pk in sorted(
+        table_columns(conn, table_name), key=lambda c: c[1]) if pk]
+    if declared and set(declared) <= set(columns):
+        return declared
+    for unique in unique_indexes(conn, table_name):
+        if set(unique) <= set(columns):
+            return unique
+    if "id" in columns:
+        return ["id"]
+    return list(columns)
+
+
+def _touched_values(columns: list[str], update_columns: list[str], track: str,
+                    inserts: list[tuple], updates: list[tuple], deletes: list[tuple]) -> set:
+    insert_pos = columns.index(track)
+    update_pos = update_columns.index(track)
+    touched = {row[insert_pos] for row in inserts}
+    touched.update(row[-1] for row in deletes)
+    for row in updates:
+        touched.update((row[update_pos], row[-1]))
+    return touched
+
+
+def incremental_load(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame,
+                     track: str | None = None, delete_scope: str | None = None) -> LoadStats:
+    """
+    Applies only the rows that differ between the frame and the existing table.
+    The frame is staged in a temp table with the target's column affinities,
+    rows are matched on the primary key and compared column by column, then
+    inserts, updates and deletes are applied with executemany in one transaction.
+
+    :param conn: Connection to the target database
+    :param table_name: Existing table to load into
+    :param df: Cleaned frame holding the full current contents of the table
+    :param track: Column whose values on the changed rows are collected in
+        LoadStats.touched, e.g. the date partitions a load changed
+    :param delete_scope: Only delete missing rows whose value in this column
+        appears in the frame, keeping rows of e.g. entries absent from it.
+        Passing the key column keeps every missing row
+    :return: Counts of inserted, updated and deleted rows
+    """
+    columns = list(df.columns)
+    existing = {name for name, _ in table_columns(conn, table_name)}
+    missing = [col for col in columns if col not in existing]
+    missing += [col for col in (track, delete_scope)
+                if col is not None and col not in columns]
+    if missing:
+        logger.error(f"Table {table_name} is missing columns {missing}")
+        raise ValueError(f"Table {table_name} is missing columns {missing}")
+
+    keys = key_columns(conn, table_name, columns)
+    values = [col for col in columns if col not in keys]
+    target = quote(table_name)
+    stage = f"temp.{quote(STAGE_TABLE)}"
+    col_list = ", ".join(quote(col) for col in columns)
+    key_match = " AND ".join(f"t.{quote(k)} IS s.{quote(k)}" for k in keys)
+    stats = LoadStats(table=table_name)
+    # the old value of the tracked column rides along as an extra last column
+    old_track = f", t.{quote(track)}" if track else ""
+    in_scope = (f" AND t.{quote(delete_scope)} IN (SELECT {quote(delete_scope)} FROM {stage})"
+                if delete_scope else "")
+
+    with transaction(conn):
+        conn.execute(f"DROP TABLE IF EXISTS {stage}")
+        conn.execute(
+            f"CREATE TEMP TABLE {quote(STAGE_TABLE)} AS SELECT {col_list} FROM {target} WHERE 0")
+        conn.executemany(
+            f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(columns))})",
+            to_sql_values(df))
+        # the anti-joins probe the stage by key once per target row
+        conn.execute(
+            f"CREATE INDEX temp.{quote(STAGE_TABLE + '_key')} ON {quote(STAGE_TABLE)} "
+            f"({', '.join(quote(k) for k in keys)})")
+
+        inserts = conn.execute(
+            f"SELECT {', '.join(f's.{quote(c)}' for c in columns)} FROM {stage} AS s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {target} AS t WHERE {key_match})").fetchall()
+        deletes = conn.execute(
+            f"SELECT {', '.join(f't.{quote(k)}' for k in keys)}{old_track} FROM {target} AS t "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {stage} AS s WHERE {key_match}){in_scope}").fetchall()
+        updates = []
+        if values:
+            changed = " OR ".join(
+                f"t.{quote(c)} IS NOT s.{quote(c)}" for c in values)
+            updates = conn.execute(
+                f"SELECT {', '.join(f's.{quote(c)}' for c in values + keys)}{old_track} "
+                f"FROM {stage} AS s JOIN {target} AS t ON {key_match} WHERE {changed}").fetchall()
+
+        if track:
+            stats.touched = _touched_values(
+                columns, values + keys, track, inserts, updates, deletes)
+            updates = [row[:-1] for row in updates]
+            deletes = [row[:-1] for row in deletes]
+
+        key_where = " AND ".join(f"{quote(k)} IS ?" for k in keys)
+        if deletes:
+            conn.executemany(
+                f"DELETE FROM {target} WHERE {key_where}", deletes)
+        if updates:
+            set_list = ", ".join(f"{quote(c)} = ?" for c in values)
+            conn.executemany(
+                f"UPDATE {target} SET {set_list} WHERE {key_where}", updates)
+        if inserts:
+            # a first load into an empty table inserts everything
+            bulk = len(inserts) >= BULK_INDEX_ROWS
+            with suspended_indexes(conn, table_name) if bulk else nullcontext():
+                conn.executemany(
+                    f"INSERT INTO {target} ({col_list}) VALUES ({', '.join('?' * len(columns))})",
+                    inserts)
+        conn.execute(f"DROP TABLE {stage}")
+
+    stats.inserted, stats.updated, stats.deleted = len(
+        inserts), len(updates), len(deletes)
+    logger.info(f"Incremental load {stats}")
+    return stats
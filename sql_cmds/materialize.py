@@ -0,0 +1,214 @@
+import sqlite3
+
+from dataclasses import dataclass, field
+from log_setup import setup_logger
+
+from .sql_cmds import quote, table_exists, transaction
+from .incremental import LoadStats
+
+logger = setup_logger()
+
+# column whose changed values incremental loads report for each partitioned source
+PARTITION_KEYS = {
+    'dayEntries': 'date',
+    'entry_tags': 'entry_id',
+    'fitbit_sleep': 'date',
+    'goalEntries': 'goalId',
+}
+
+
+@dataclass
+class MaterializedTable:
+    """
+    A dashboard aggregation stored as a table. select must filter on
+    partition_expr through a {partition_filter} placeholder, and sources maps
+    each table it reads to a query turning that table's touched values
+    (temp._touched) into partitions, or None if any change rebuilds the table.
+    """
+    name: str
+    columns: str
+    select: str
+    partition: str
+    partition_expr: str
+    sources: dict[str, str | None]
+    indexes: list[list[str]] = field(default_factory=list)
+
+
+MATERIALIZED_TABLES = [
+    # tag counts per day, v_activity_summary and v_sleep_summary sum the last 90 days
+    MaterializedTable(
+        name='mv_activity_daily',
+        columns='day DATE, [group] TEXT, activity TEXT, [count] INTEGER',
+        select='''
+            SELECT
+                date(de.date) AS day,
+                tg.name AS [group],
+                t.name AS activity,
+                COUNT(t.name) AS [count]
+            FROM dayEntries AS de
+            LEFT JOIN entry_tags AS et ON de.id = et.entry_id
+            LEFT JOIN tags AS t ON et.tag = t.id
+            LEFT JOIN tag_groups AS tg ON t.id_tag_group = tg.id
+            WHERE {partition_filter}
+            GROUP BY date(de.date), tg.name, t.name''',
+        partition='day',
+        partition_expr='date(de.date)',
+        sources={
+            'dayEntries': "SELECT date(value) FROM temp._touched",
+            'entry_tags': '''
+                SELECT date(de.date) FROM dayEntries AS de
+                JOIN temp._touched AS k ON de.id = k.value''',
+            'tags': None,
+            'tag_groups': None,
+        },
+        indexes=[['day', 'group', 'activity', 'count']],
+    ),
+    # longest non-nap sleep per night, ties keep every longest log
+    MaterializedTable(
+        name='mv_sleep_main_per_day',
+        columns='[date] TEXT, duration_hours FLOAT, sleep_quality_score INTEGER, sleep_quality_label TEXT',
+        select='''
+            SELECT
+                [date],
+                duration_hours,
+                CASE
+                    WHEN duration_hours <= 2 THEN 0
+                    WHEN duration_hours <= 4 THEN 1
+                    WHEN duration_hours <= 6 THEN 2
+                    WHEN duration_hours <= 8 THEN 3
+                    ELSE 4
+                END AS sleep_quality_score,
+                CASE
+                    WHEN duration_hours <= 2 THEN 'Very Poor'
+                    WHEN duration_hours <= 4 THEN 'Poor'
+                    WHEN duration_hours <= 6 THEN 'Fair'
+                    WHEN duration_hours <= 8 THEN 'Good'
+                    ELSE 'Too Much'
+                END AS sleep_quality_label
+            FROM (
+                SELECT
+                    [date],
+                    duration_hours,
+                    duration_minutes,
+                    MAX(duration_minutes) OVER (PARTITION BY [date]) AS longest_minutes
+                FROM fitbit_sleep
+                WHERE sleep_type != 'nap'
+                  AND {partition_filter}
+            )
+            WHERE duration_minutes = longest_minutes''',
+        partition='date',
+        partition_expr='[date]',
+        sources={'fitbit_sleep': "SELECT value FROM temp._touched"},
+        indexes=[['date', 'duration_hours',
+                  'sleep_quality_score', 'sleep_quality_label']],
+    ),
+    # open goals run to the end of the calendar, v_goal_calendar stops them at today
+    MaterializedTable(
+        name='mv_goal_calendar',
+        columns='goal_id INTEGER, goal_name TEXT, calendar_day DATE, goal_end DATE, goal_completed INTEGER',
+        select='''
+            SELECT
+                g.goal_id,
+                g.name AS goal_name,
+                cal.Date AS calendar_day,
+                COALESCE(g.date_end, g.end_date) AS goal_end,
+                CASE WHEN ge.id IS NOT NULL THEN 1 ELSE 0 END AS goal_completed
+            FROM goals g
+            JOIN calendar cal ON cal.Date BETWEEN DATE(g.created_at) AND COALESCE(g.date_end, g.end_date, '9999-12-31')
+            LEFT JOIN goalEntries ge ON g.goal_id = ge.goalId AND ge.date = cal.Date
+            WHERE {partition_filter}''',
+        partition='goal_id',
+        partition_expr='g.goal_id',
+        sources={
+            'goalEntries': "SELECT value FROM temp._touched",
+            'goals': None,
+            # goals whose range covers a day added to the calendar, open goals included
+            'calendar': '''
+                SELECT g.goal_id FROM goals AS g
+                JOIN temp._touched AS k
+                  ON k.value BETWEEN DATE(g.created_at) AND COALESCE(g.date_end, g.end_date, '9999-12-31')''',
+        },
+        indexes=[['goal_id', 'calendar_day', 'goal_name',
+                  'goal_end', 'goal_completed']],
+    ),
+]
+
+
+def ensure_materialized_tables(conn: sqlite3.Connection) -> list[str]:
+    """
+    Creates the materialized tables and their covering indexes if missing.
+
+    :return: Names of the tables created, which need a full refresh
+    """
+    created = []
+    with transaction(conn):
+        for table in MATERIALIZED_TABLES:
+            if not table_exists(conn, table.name):
+                conn.execute(
+                    f"CREATE TABLE {quote(table.name)} ({table.columns})")
+                created.append(table.name)
+            for columns in table.indexes:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {quote(f'idx_{table.name}_' + '_'.join(columns))} "
+                    f"ON {quote(table.name)} ({', '.join(quote(c) for c in columns)})")
+    return created
+
+
+def _loaded(stats: LoadStats) -> bool:
+    return bool(stats.inserted or stats.updated or stats.deleted)
+
+
+def _refresh_table(conn: sqlite3.Connection, table: MaterializedTable,
+                   loads: dict[str, LoadStats], rebuild: bool) -> int | None:
+    changed = {name: loads[name] for name in table.sources
+               if name in loads and _loaded(loads[name])}
+    if not changed and not rebuild:
+        return None
+
+    target = quote(table.name)
+    rebuild = rebuild or any(
+        table.sources[name] is None or stats.touched is None for name, stats in changed.items())
+    if rebuild:
+        conn.execute(f"DELETE FROM {target}")
+        conn.execute(f"INSERT INTO {target} " +
+                     table.select.format(partition_filter="1"))
+        return conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _partitions (value PRIMARY KEY)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _touched (value)")
+    conn.execute("DELETE FROM temp._partitions")
+    for name, stats in changed.items():
+        conn.execute("DELETE FROM temp._touched")
+        conn.executemany("INSERT INTO temp._touched (value) VALUES (?)",
+                         [(value,) for value in stats.touched])
+        conn.execute(
+            f"INSERT OR IGNORE INTO temp._partitions (value) {table.sources[name]}")
+
+    partitions = "(SELECT value FROM temp._partitions)"
+    conn.execute(
+        f"DELETE FROM {target} WHERE {quote(table.partition)} IN {partitions}")
+    cursor = conn.execute(f"INSERT INTO {target} " + table.select.format(
+        partition_filter=f"{table.partition_expr} IN {partitions}"))
+    return cursor.rowcount
+
+
+def refresh_materialized(conn: sqlite3.Connection, loads: dict[str, LoadStats],
+                         rebuild=()) -> dict[str, int]:
+    """
+    Refreshes the materialized tables that read from the loaded tables. Only
+    the partitions holding rows a load touched are recomputed, unless a source
+    was rewritten or has no partition mapping, which rebuilds the whole table.
+
+    :param conn: Connection to the target database
+    :param loads: Load stats of this run keyed by table name
+    :param rebuild: Names of materialized tables to rebuild in full
+    :return: Rows written per refreshed table
+    """
+    refreshed = {}
+    with transaction(conn):
+        for table in MATERIALIZED_TABLES:
+            rows = _refresh_table(conn, table, loads, table.name in rebuild)
+            if rows is not None:
+                refreshed[table.name] = rows
+                logger.info(f"Refreshed {table.name}, {rows} rows written")
+    return refreshed
@@ -0,0 +1,135 @@
+import sqlite3
+import pandas as pd
+
+from log_setup import setup_logger
+
+from .sql_cmds import quote, table_exists, transaction
+
+logger = setup_logger()
+
+NOTES_FTS_TABLE = 'entry_notes_fts'
+
+# bm25 weights of note_title and note, a hit in the title ranks higher
+TITLE_WEIGHT = 2.0
+NOTE_WEIGHT = 1.0
+
+# the index reads note text from dayEntries by id instead of keeping a copy,
+# remove_diacritics 2 folds accents so 'cafe' finds 'café'
+NOTES_FTS_DDL = f'''
+    CREATE VIRTUAL TABLE {quote(NOTES_FTS_TABLE)} USING fts5(
+        note_title, note,
+        content='dayEntries', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+'''
+
+# keep the index in step with every write to dayEntries, updates only touch
+# it when the note or title changed, so an incremental load re-indexes just those
+NOTES_FTS_TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {quote(NOTES_FTS_TABLE + '_insert')} AFTER INSERT ON dayEntries
+    BEGIN
+        INSERT INTO {quote(NOTES_FTS_TABLE)} (rowid, note_title, note)
+        VALUES (new.id, new.note_title, new.note);
+    END''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {quote(NOTES_FTS_TABLE + '_delete')} AFTER DELETE ON dayEntries
+    BEGIN
+        INSERT INTO {quote(NOTES_FTS_TABLE)} ({quote(NOTES_FTS_TABLE)}, rowid, note_title, note)
+        VALUES ('delete', old.id, old.note_title, old.note);
+    END''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {quote(NOTES_FTS_TABLE + '_update')}
+    AFTER UPDATE OF id, note, note_title ON dayEntries
+    WHEN old.id IS NOT new.id OR old.note IS NOT new.note OR old.note_title IS NOT new.note_title
+    BEGIN
+        INSERT INTO {quote(NOTES_FTS_TABLE)} ({quote(NOTES_FTS_TABLE)}, rowid, note_title, note)
+        VALUES ('delete', old.id, old.note_title, old.note);
+        INSERT INTO {quote(NOTES_FTS_TABLE)} (rowid, note_title, note)
+        VALUES (new.id, new.note_title, new.note);
+    END''',
+]
+
+
+def ensure_note_index(conn: sqlite3.Connection) -> bool:
+    """
+    Creates the note index and the triggers maintaining it if missing. A new
+    index is filled from the entries already loaded.
+
+    :return: True if the index was created
+    """
+    with transaction(conn):
+        created = not table_exists(conn, NOTES_FTS_TABLE)
+        if created:
+            conn.execute(NOTES_FTS_DDL)
+            conn.execute(
+                f"INSERT INTO {quote(NOTES_FTS_TABLE)} ({quote(NOTES_FTS_TABLE)}) VALUES ('rebuild')")
+            logger.info(f"Created full-text index {NOTES_FTS_TABLE} over dayEntries notes")
+        for trigger in NOTES_FTS_TRIGGERS:
+            conn.execute(trigger)
+    return created
+
+
+def match_terms(text: str, prefix: bool = True) -> str:
+    """
+    Turns typed text into an FTS5 query matching entries holding every word,
+    with the last word matched as a prefix so results follow the typing.
+
+    :param text: Words to search for, FTS5 operators in it are matched as words
+    :param prefix: Match the last word as a prefix
+    :return: FTS5 MATCH expression, empty if text has no words
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms and prefix:
+        terms[-1] += '*'
+    return " ".join(terms)
+
+
+def search_notes(conn: sqlite3.Connection, text: str, limit: int = 50,
+                 details: bool = False, raw: bool = False) -> pd.DataFrame:
+    """
+    Searches note titles and notes, best matches first.
+
+        hits = search_notes(conn, "long walk", details=True)
+
+    :param conn: Connection to the database
+    :param text: Words to search for, or an FTS5 query when raw
+    :param limit: Maximum number of entries returned
+    :param details: Join the hits to v_entry_details, which keeps only
+        entries of its window, and add the entry's day and mood
+    :param raw: Pass text to MATCH as is, for FTS5 operators like OR and NEAR
+    :return: DataFrame of entry_id, rank (lower is better) and snippet, the
+        matched words of the snippet wrapped in [ ]
+    """
+    query = text if raw else match_terms(text)
+    if not query.strip():
+        return pd.DataFrame(columns=['entry_id', 'rank', 'snippet'])
+
+    fts = quote(NOTES_FTS_TABLE)
+    detail_columns = join = ""
+    if details:
+        detail_columns = (", d.day, d.entry_datetime, d.mood_id, d.mood_name, "
+                          "d.mood_value, d.mood_group_name")
+        join = "JOIN v_entry_details AS d ON d.entry_id = hits.entry_id"
+    # ranked in a subquery of its own, auxiliary functions only run on the fts table
+    sql = f'''
+        SELECT hits.entry_id, hits.rank, hits.snippet{detail_columns}
+        FROM (
+            SELECT
+                rowid AS entry_id,
+                bm25({fts}, {TITLE_WEIGHT}, {NOTE_WEIGHT}) AS rank,
+                snippet({fts}, -1, '[', ']', '...', 12) AS snippet
+            FROM {fts}
+            WHERE {fts} MATCH :query
+            ORDER BY rank
+        ) AS hits
+        {join}
+        ORDER BY hits.rank
+        LIMIT :limit'''
+    try:
+        return pd.read_sql_query(sql, conn, params={'query': query, 'limit': limit})
+    except (sqlite3.OperationalError, pd.errors.DatabaseError) as e:
+        # pandas wraps the sqlite error in a message repeating the whole query
+        cause = e.__cause__ or e
+        logger.error(f"Note search for '{text}' failed: {cause}")
+        raise ValueError(f"Invalid note search '{text}': {cause}") from e
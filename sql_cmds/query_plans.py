@@ -0,0 +1,69 @@
+import re
+import sqlite3
+
+from log_setup import setup_logger
+
+logger = setup_logger()
+
+# tables that grow with the user's history, a view scanning one of them
+# without an index is reported
+PLAN_CHECKED_TABLES = ('dayEntries', 'entry_tags', 'goalEntries', 'fitbit_sleep')
+
+_SQL_KEYWORDS = {'on', 'where', 'left', 'right', 'inner', 'outer', 'cross', 'join',
+                 'group', 'order', 'limit', 'using', 'natural', 'union', 'as'}
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+# a scan in index order still reads every row of the table
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING (?:COVERING )?INDEX \w+)?$")
+
+
+def view_names(conn: sqlite3.Connection) -> list[str]:
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'view' ORDER BY name")]
+
+
+def _table_aliases(sql: str) -> dict[str, str]:
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def view_query_plans(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    """
+    :return: EXPLAIN QUERY PLAN details of every view, keyed by view name
+    """
+    return {view: [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN SELECT * FROM "{view}"')]
+            for view in view_names(conn)}
+
+
+def unindexed_scans(conn: sqlite3.Connection, tables=PLAN_CHECKED_TABLES) -> dict[str, list[str]]:
+    """
+    Finds full table scans of the given tables in the views' query plans.
+
+    :return: Scanned table names per view, only views with scans are included
+    """
+    scans = {}
+    for view, plan in view_query_plans(conn).items():
+        view_sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", (view,)).fetchone()[0]
+        aliases = _table_aliases(view_sql)
+        for detail in plan:
+            match = _SCAN.match(detail)
+            if not match:
+                continue
+            table = aliases.get(match.group(2) or match.group(1), match.group(1))
+            if table in tables:
+                scans.setdefault(view, []).append(table)
+    return scans
+
+
+def check_view_plans(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    """
+    Logs a warning for every view that scans a growing table without an index.
+    """
+    scans = unindexed_scans(conn)
+    for view, tables in scans.items():
+        logger.warning(f"View {view} scans {', '.join(tables)} without an index")
+    return scans
@@ -0,0 +1,238 @@
+import re
+import queue
+import sqlite3
+import threading
+import pandas as pd
+
+from pathlib import Path
+from functools import lru_cache
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from config import get_settings
+from log_setup import setup_logger
+
+from .sql_cmds import quote, transaction
+
+logger = setup_logger()
+
+# days the windowed views cover, as create_views.sql's '-90 days'
+DEFAULT_WINDOW_DAYS = 90
+
+_QUERY_NAME = re.compile(r"^--\s*name:\s*(\w+)\s*$", re.MULTILINE)
+
+
+def ensure_generation_table(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS etl_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            run_id TEXT,
+            committed_at TEXT
+        )
+    ''')
+
+
+def bump_generation(conn: sqlite3.Connection, run_id: str | None = None) -> int:
+    """
+    Marks the data as changed, so readers drop the results they cached.
+    Called inside the load transaction, readers see the new generation
+    together with the data it stands for.
+
+    :return: The new generation
+    """
+    with transaction(conn):
+        ensure_generation_table(conn)
+        conn.execute('''
+            INSERT INTO etl_generation (id, generation, run_id, committed_at)
+            VALUES (1, 1, ?, datetime('now'))
+            ON CONFLICT (id) DO UPDATE SET
+                generation = generation + 1,
+                run_id = excluded.run_id,
+                committed_at = excluded.committed_at
+        ''', (run_id,))
+        return conn.execute("SELECT generation FROM etl_generation WHERE id = 1").fetchone()[0]
+
+
+def read_generation(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT generation FROM etl_generation WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        # databases no ETL run has committed to since generations were added
+        return 0
+    return row[0] if row else 0
+
+
+@lru_cache(maxsize=None)
+def load_view_queries(path: Path) -> dict[str, str]:
+    """
+    :param path: Path to view_queries.sql
+    :return: Parameterized query of each windowed view, keyed by view name
+    """
+    if not path.exists():
+        logger.error(f"View query file {path} does not exist.")
+        raise FileNotFoundError(f"View query file {path} does not exist.")
+    parts = _QUERY_NAME.split(path.read_text())
+    return {name: sql.strip().rstrip(";") for name, sql in zip(parts[1::2], parts[2::2])}
+
+
+def window_params(days: int = DEFAULT_WINDOW_DAYS, end: date | None = None) -> dict[str, str]:
+    """
+    :param days: Number of days the window covers, end included
+    :param end: Last day of the window, today by default
+    :return: The :start and :stop parameters of the view queries
+    """
+    if days < 1:
+        raise ValueError(f"A window must cover at least one day, not {days}.")
+    end = end or date.today()
+    return {"start": (end - timedelta(days=days - 1)).isoformat(),
+            "stop": (end + timedelta(days=1)).isoformat()}
+
+
+class ReadPool:
+    """
+    A few read-only connections shared by the dashboard's threads. Each
+    connection is used by one thread at a time.
+    """
+
+    def __init__(self, db_path, size: int = 4) -> None:
+        self.db_path = str(db_path)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                conn = self._open() if self._opened < self.size else None
+                if conn is not None:
+                    self._opened += 1
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._opened = 0
+
+
+class ResultCache:
+    """
+    LRU of query results bounded by the bytes of the frames it holds. Every
+    entry belongs to one generation, a newer generation empties the cache.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, max_entries: int = 256) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.generation = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, generation: int) -> pd.DataFrame | None:
+        with self._lock:
+            if self.generation is None or generation > self.generation:
+                self._entries.clear()
+                self.bytes = 0
+                self.generation = generation
+            entry = self._entries.get(key) if generation == self.generation else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, generation: int, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            # results of a query that raced a load are not kept
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+
+class DashboardReader:
+    """
+    Reads views for the dashboard through a pool of read-only connections,
+    keeping results until the ETL commits a new generation.
+
+        reader = get_reader(db_path)
+        moods = reader.read("v_daily_avgs", days=30)
+    """
+
+    def __init__(self, db_path, pool_size: int = 4, max_bytes: int = 64 * 2**20,
+                 max_entries: int = 256, queries_path: Path | None = None) -> None:
+        self.pool = ReadPool(db_path, pool_size)
+        self.cache = ResultCache(max_bytes, max_entries)
+        self.queries = load_view_queries(
+            queries_path or get_settings().sql_dir / "view_queries.sql")
+
+    def read(self, view_name: str, days: int = DEFAULT_WINDOW_DAYS,
+             end: date | None = None) -> pd.DataFrame:
+        """
+        :param view_name: View to read
+        :param days: Days covered by a windowed view, ignored by the others
+        :param end: Last day of the window, today by default
+        :return: The view's rows, callers get their own copy
+        """
+        windowed = view_name in self.queries
+        params = window_params(days, end) if windowed else {}
+        key = (view_name, tuple(sorted(params.items())))
+        with self.pool.connection() as conn:
+            # one read transaction, so the rows match the generation they are cached under
+            conn.execute("BEGIN")
+            try:
+                generation = read_generation(conn)
+                df = self.cache.get(key, generation)
+                if df is None:
+                    logger.info(f"Retrieving data from view {view_name}...")
+                    query = self.queries[view_name] if windowed else f"SELECT * FROM {quote(view_name)}"
+                    df = pd.read_sql_query(query, conn, params=params or None)
+                    self.cache.put(key, generation, df)
+            finally:
+                conn.rollback()
+        return df.copy()
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(db_path=None) -> DashboardReader:
+    """
+    :param db_path: Database to read, DB_PATH by default
+    :return: The reader shared by every caller in this process for db_path
+    """
+    db_path = str(db_path or get_settings().db_path)
+    with _readers_lock:
+        if db_path not in _readers:
+            _readers[db_path] = DashboardReader(db_path)
+        return _readers[db_path]
@@ -0,0 +1,68 @@
+import sqlite3
+import pandas as pd
+
+from log_setup import setup_logger
+
+from .sql_cmds import quote, transaction, write_frame
+from .incremental import LoadStats
+
+logger = setup_logger()
+
+SLEEP_LEVELS_TABLE = 'fitbit_sleep_levels'
+
+# one row per levels.data / levels.shortData segment, clustered by night and
+# log so a hypnogram is one range read. level holds the codes of
+# fitbit_sleep.get_fitbit_sleep.SLEEP_LEVEL_CODES
+SLEEP_LEVELS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS {quote(SLEEP_LEVELS_TABLE)} (
+        date TEXT NOT NULL,
+        log_id INTEGER NOT NULL,
+        short INTEGER NOT NULL,
+        offset_seconds INTEGER NOT NULL,
+        seconds INTEGER NOT NULL,
+        level INTEGER NOT NULL,
+        PRIMARY KEY (date, log_id, short, offset_seconds)
+    ) WITHOUT ROWID
+'''
+
+
+def ensure_sleep_levels_table(conn: sqlite3.Connection) -> None:
+    conn.execute(SLEEP_LEVELS_DDL)
+
+
+def load_sleep_levels(conn: sqlite3.Connection, segments: pd.DataFrame) -> LoadStats:
+    """
+    Replaces the segments of the nights the frame covers. Nights before the
+    fetched window keep their segments, so older hypnograms stay readable
+    without going back to the API.
+
+    :param conn: Connection to the target database
+    :param segments: Frame of fitbit_sleep.sleep_segments
+    :return: Counts of inserted and deleted segments, touched holds the nights
+    """
+    stats = LoadStats(table=SLEEP_LEVELS_TABLE)
+    if segments.empty:
+        return stats
+    nights = segments["date"]
+    with transaction(conn):
+        ensure_sleep_levels_table(conn)
+        # the fetch covers a contiguous range of nights, logs deleted since
+        # the last fetch disappear with the rest of their night
+        stats.deleted = conn.execute(
+            f"DELETE FROM {quote(SLEEP_LEVELS_TABLE)} WHERE date BETWEEN ? AND ?",
+            (nights.min(), nights.max())).rowcount
+        stats.inserted = write_frame(conn, SLEEP_LEVELS_TABLE, segments)
+    stats.touched = set(nights.unique())
+    logger.info(f"Loaded sleep segments {stats}")
+    return stats
+
+
+def read_sleep_levels(conn: sqlite3.Connection, start: str, stop: str) -> pd.DataFrame:
+    """
+    :param start: First night to read, inclusive
+    :param stop: Night after the last one to read
+    :return: Segments of the nights in [start, stop), in log and offset order
+    """
+    return pd.read_sql_query(
+        f"SELECT * FROM {quote(SLEEP_LEVELS_TABLE)} WHERE date >= ? AND date < ? "
+        "ORDER BY date, log_id, short, offset_seconds", conn, params=(start, stop))
@@ -1,10 +1,33 @@
 import sqlite3
-from pathlib import Path
 import pandas as pd
+
+from pathlib import Path
+from datetime import date, datetime
+from contextlib import contextmanager, nullcontext
 from log_setup import setup_logger
 
+from pandas.api.types import infer_dtype, is_datetime64_any_dtype
+
 logger = setup_logger()
 
+# pragmas applied to every connection opened by DbConnection
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+}
+
+# pragmas held for the duration of DbConnection.bulk_load, durability is
+# restored with a checkpoint when the load window closes
+BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-65536",
+}
+
+# writes of at least this many rows drop the table's indexes and rebuild them
+# afterwards, which is cheaper than maintaining them row by row
+BULK_INDEX_ROWS = 10000
+
 
 def create_db_conn(db_path) -> sqlite3.Connection:
     """
@@ -14,8 +37,234 @@ def create_db_conn(db_path) -> sqlite3.Connection:
     return sqlite3.connect(db_path)
 
 
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """
+    Runs the block in a transaction, or in a savepoint when the connection is
+    already inside one, so helpers can be nested inside a single load transaction.
+    """
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT nested")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK TO nested")
+            conn.execute("RELEASE nested")
+            raise
+        conn.execute("RELEASE nested")
+    else:
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+class DbConnection:
+    """
+    Owns the single SQLite connection used for a run. The connection is opened
+    on first use with WAL journaling, and entering the manager starts a
+    transaction (or a savepoint if one is already open) that commits on exit.
+
+        db = DbConnection(db_path)
+        with db.bulk_load():
+            with db as conn:
+                ...
+        db.close()
+    """
+
+    def __init__(self, db_path) -> None:
+        self.db_path = str(db_path)
+        self._conn = None
+        self._transactions = []
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            logger.info(f"Opening database connection to {self.db_path}")
+            self._conn = create_db_conn(self.db_path)
+            for pragma, value in CONNECTION_PRAGMAS.items():
+                self._conn.execute(f"PRAGMA {pragma} = {value}")
+        return self._conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        context = transaction(self.conn)
+        self._transactions.append(context)
+        return context.__enter__()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return self._transactions.pop().__exit__(exc_type, exc, tb)
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Holds bulk load pragmas and one transaction for every write in the block.
+        """
+        conn = self.conn
+        previous = {pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                    for pragma in BULK_LOAD_PRAGMAS}
+        for pragma, value in BULK_LOAD_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        try:
+            with self as conn:
+                yield conn
+        finally:
+            for pragma, value in previous.items():
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            # flush the wal with the restored synchronous setting
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+
+def add_missing_columns(conn: sqlite3.Connection, table_name: str, dtype: dict[str, str]) -> list[str]:
+    """
+    Adds the columns a table created by an older release does not have yet.
+
+    :param dtype: SQL type per expected column
+    :return: Names of the columns added
+    """
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table_name)})")}
+    added = [col for col in dtype if col not in existing]
+    for col in added:
+        conn.execute(f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(col)} {dtype[col]}")
+        logger.info(f"Added column {col} to {table_name}")
+    return added
+
+
+@contextmanager
+def suspended_indexes(conn: sqlite3.Connection, table_name: str):
+    """
+    Drops the table's explicitly created indexes for the duration of the block
+    and recreates them from their saved DDL when it ends.
+    """
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {quote(name)}")
+    try:
+        yield conn
+    finally:
+        for _, sql in indexes:
+            conn.execute(sql)
+    if indexes:
+        logger.info(f"Rebuilt {len(indexes)} indexes on {table_name}")
+
+
+def to_sql_values(df: pd.DataFrame) -> list[tuple]:
+    """
+    Converts a frame to plain python rows, formatting timestamps the same way
+    pandas' sqlite writer does so existing rows compare equal.
+    """
+    values = df.astype(object).where(df.notna(), None)
+    for col_name in df.columns:
+        col = df[col_name]
+        if is_datetime64_any_dtype(col):
+            text = col.dt.strftime('%Y-%m-%d %H:%M:%S')
+            # pandas only writes fractional seconds when there are some
+            has_fraction = col.dt.microsecond.fillna(0) > 0
+            text = text.mask(has_fraction, col.dt.strftime(
+                '%Y-%m-%d %H:%M:%S.%f'))
+            values[col_name] = text.astype(object).where(col.notna(), None)
+        elif infer_dtype(col, skipna=True) in ('date', 'datetime'):
+            values[col_name] = values[col_name].map(
+                lambda v: v.isoformat(" ") if isinstance(v, datetime)
+                else v.isoformat() if isinstance(v, date) else v)
+    return list(values.itertuples(index=False, name=None))
+
+
+def write_frame(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame, if_exists: str = 'append',
+                dtype: dict[str, str] | None = None) -> int:
+    """
+    Writes a frame with chunked multi-row inserts inside the current transaction.
+    Unlike DataFrame.to_sql it never commits on its own, and 'replace' empties
+    the existing table instead of dropping it so its declared schema is kept.
+
+    :param conn: Connection to the target database
+    :param table_name: Table to write to, created from the frame if missing
+    :param df: Frame to write
+    :param if_exists: 'append' or 'replace'
+    :param dtype: SQL type per column, used when the table has to be created
+    :return: Number of rows written
+    """
+    if if_exists not in ('append', 'replace'):
+        raise ValueError(f"Unknown if_exists value '{if_exists}'.")
+
+    columns = list(df.columns)
+    target = quote(table_name)
+    rows = to_sql_values(df)
+
+    with transaction(conn):
+        if not table_exists(conn, table_name):
+            conn.execute(pd.io.sql.get_schema(
+                df, table_name, con=conn, dtype=dtype))
+        elif if_exists == 'replace':
+            conn.execute(f"DELETE FROM {target}")
+
+        with suspended_indexes(conn, table_name) if len(rows) >= BULK_INDEX_ROWS else nullcontext():
+            _insert_rows(conn, target, columns, rows)
+
+    logger.info(f"Wrote {len(rows)} rows to {table_name}")
+    return len(rows)
+
+
+def _insert_rows(conn: sqlite3.Connection, target: str, columns: list[str], rows: list[tuple]) -> None:
+    # one statement can bind at most this many values
+    max_rows = max(1, conn.getlimit(
+        sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) // max(1, len(columns)))
+    col_list = ", ".join(quote(col) for col in columns)
+    row_params = f"({', '.join('?' * len(columns))})"
+
+    full_chunks = len(rows) - len(rows) % max_rows
+    if full_chunks:
+        insert = (f"INSERT INTO {target} ({col_list}) VALUES "
+                  + ", ".join([row_params] * max_rows))
+        conn.executemany(insert, (
+            [value for row in rows[start:start + max_rows] for value in row]
+            for start in range(0, full_chunks, max_rows)))
+    if full_chunks < len(rows):
+        remainder = rows[full_chunks:]
+        insert = (f"INSERT INTO {target} ({col_list}) VALUES "
+                  + ", ".join([row_params] * len(remainder)))
+        conn.execute(insert, [value for row in remainder for value in row])
+
+
+def split_sql_script(script_text: str) -> list[str]:
+    """
+    Splits a script into complete statements so it can run inside a transaction,
+    which sqlite3's executescript would commit.
+    """
+    statements = []
+    current = ""
+    for line in script_text.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+
 def execute_sql_command(conn: sqlite3.Connection, command: str, commit: bool = True, *args):
-    with conn:
+    with transaction(conn):
         cursor = conn.cursor()
         if args:
             if len(*args) == 1:
@@ -25,29 +274,30 @@ def execute_sql_command(conn: sqlite3.Connection, command: str, commit: bool = T
         else:
             cursor.execute(command)
 
-        if commit:
-            conn.commit()
-        else:
+        if not commit:
             return cursor.fetchall()
 
 
 def execute_sql_script(conn: sqlite3.Connection, script_path: str, commit: bool = True):
-    with conn:
-        script = Path(script_path)
-        if not script.exists():
-            logger.error(f"SQL script {script_path} does not exist.")
-            return
-        logger.info(f"Executing script: {script.name}")
+    script = Path(script_path)
+    if not script.exists():
+        logger.error(f"SQL script {script_path} does not exist.")
+        return
+    logger.info(f"Executing script: {script.name}")
+    with transaction(conn):
         cursor = conn.cursor()
-        script_text = script.read_text()
-        cursor.executescript(script_text)
-        if commit:
-            conn.commit()
-        else:
+        for statement in split_sql_script(script.read_text()):
+            cursor.execute(statement)
+        if not commit:
             return cursor.fetchall()
 
 
 def read_sql_view_to_df(conn: sqlite3.Connection, view_name: str) -> pd.DataFrame:
+    """
+    Reads a whole view and closes the connection. The dashboard reads through
+    sql_cmds.read_api.get_reader instead, which pools connections and caches
+    results until the next load.
+    """
     logger.info(f"Retrieving data from view {view_name}...")
     query = f"SELECT * FROM {view_name}"
     df = pd.read_sql_query(query, conn)
@@ -0,0 +1,2 @@
+from .manifest import Tenant, load_manifest
+from .runner import TenantResult, run_tenants
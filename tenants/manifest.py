@@ -0,0 +1,105 @@
+import json
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from config import get_settings
+from log_setup import setup_logger
+
+logger = setup_logger()
+
+DEFAULT_TIME_BUDGET = 1800
+
+
+@dataclass
+class Tenant:
+    """
+    One client's ETL. Everything a run writes (database, logs, table cache,
+    archive, fingerprints, Fitbit tokens and cache) lives under tenant_dir
+    unless db_path points elsewhere.
+    """
+    name: str
+    pickup_dir: Path
+    tenant_dir: Path
+    db_path: Path
+    time_budget: float = DEFAULT_TIME_BUDGET
+    args: list[str] = field(default_factory=list)
+    env: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def log_db_path(self) -> Path:
+        return self.tenant_dir / "daylio_etl_logs.db"
+
+    def environ(self) -> dict[str, str]:
+        """
+        :return: Variables that point a main.py process at this tenant's paths
+        """
+        return {
+            **self.env,
+            "DB_PATH": str(self.db_path),
+            "DAYLIO_PICKUP_DIR": str(self.pickup_dir),
+            "DAYLIO_TENANT_DIR": str(self.tenant_dir),
+            "DAYLIO_LOG_DB": str(self.log_db_path),
+        }
+
+
+def _parse_tenant(entry: dict, defaults: dict, tenants_dir: Path) -> Tenant:
+    merged = {**defaults, **entry}
+    missing = [key for key in ("name", "pickup_dir") if key not in merged]
+    if missing:
+        raise ValueError(f"Tenant entry {entry} is missing {missing}.")
+
+    tenant_dir = Path(merged.get("tenant_dir", tenants_dir / merged["name"]))
+    return Tenant(
+        name=merged["name"],
+        pickup_dir=Path(merged["pickup_dir"]),
+        tenant_dir=tenant_dir,
+        db_path=Path(merged.get("db_path", tenant_dir / "mood_dash.db")),
+        time_budget=float(merged.get("time_budget", DEFAULT_TIME_BUDGET)),
+        args=[str(arg) for arg in merged.get("args", [])],
+        env={**defaults.get("env", {}), **entry.get("env", {})},
+    )
+
+
+def load_manifest(path: Path) -> list[Tenant]:
+    """
+    Reads a tenant manifest:
+
+        {
+            "defaults": {"time_budget": 900},
+            "tenants": [
+                {"name": "client-a", "pickup_dir": "/backups/client-a",
+                 "env": {"FITBIT_CLIENT_ID": "..."}}
+            ]
+        }
+
+    Relative paths are resolved against the manifest's directory, tenant_dir
+    defaults to data/tenants/<name> and db_path to tenant_dir/mood_dash.db.
+
+    :param path: Path to the manifest json
+    :return: Tenants in manifest order
+    """
+    path = Path(path)
+    if not path.exists():
+        logger.error(f"Tenant manifest {path} does not exist.")
+        raise FileNotFoundError(f"{path} does not exist")
+
+    manifest = json.loads(path.read_text())
+    defaults = manifest.get("defaults", {})
+    tenants_dir = get_settings().data_dir / "tenants"
+    tenants = [_parse_tenant(entry, defaults, tenants_dir)
+               for entry in manifest.get("tenants", [])]
+
+    for tenant in tenants:
+        for attr in ("pickup_dir", "tenant_dir", "db_path"):
+            value = getattr(tenant, attr)
+            if not value.is_absolute():
+                setattr(tenant, attr, (path.parent / value).resolve())
+
+    # tenants sharing a name, directory or database would overwrite each other
+    for attr in ("name", "tenant_dir", "db_path"):
+        values = [getattr(tenant, attr) for tenant in tenants]
+        duplicates = sorted({str(v) for v in values if values.count(v) > 1})
+        if duplicates:
+            logger.error(f"Tenants share {attr} {duplicates} in {path}")
+            raise ValueError(f"Tenants share {attr} {duplicates} in {path}")
+    return tenants
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from config import get_settings
+from log_setup import setup_logger
+
+from .manifest import Tenant, load_manifest
+
+logger = setup_logger()
+
+# lines of a failed run's output kept in the summary
+ERROR_TAIL_LINES = 20
+
+
+@dataclass
+class TenantResult:
+    name: str
+    status: str
+    seconds: float
+    returncode: int | None = None
+    log_path: str | None = None
+    error: str | None = None
+
+
+def run_tenant(tenant: Tenant) -> TenantResult:
+    """
+    Runs one tenant's ETL in its own main.py process, so a crash, hang or
+    leaked state stays with that tenant. The process is killed once it
+    exceeds the tenant's time budget.
+    """
+    tenant.tenant_dir.mkdir(parents=True, exist_ok=True)
+    log_path = tenant.tenant_dir / "last_run.log"
+    command = [sys.executable, str(get_settings().base_dir / "main.py"), *tenant.args]
+    start = time.monotonic()
+    logger.info(f"Starting ETL for tenant {tenant.name}")
+    try:
+        with open(log_path, "w") as log_file:
+            process = subprocess.run(
+                command, cwd=get_settings().base_dir, env={**_base_environ(), **tenant.environ()},
+                stdout=log_file, stderr=subprocess.STDOUT, timeout=tenant.time_budget)
+    except subprocess.TimeoutExpired:
+        logger.error(f"Tenant {tenant.name} exceeded its {tenant.time_budget:g}s budget")
+        return TenantResult(tenant.name, "timeout", time.monotonic() - start,
+                            log_path=str(log_path),
+                            error=f"Exceeded time budget of {tenant.time_budget:g}s")
+    except OSError as e:
+        logger.error(f"Tenant {tenant.name} could not be started: {e}")
+        return TenantResult(tenant.name, "failed", time.monotonic() - start, error=str(e))
+
+    seconds = time.monotonic() - start
+    if process.returncode != 0:
+        tail = log_path.read_text(errors="replace").splitlines()[-ERROR_TAIL_LINES:]
+        logger.error(f"Tenant {tenant.name} failed with exit code {process.returncode}")
+        return TenantResult(tenant.name, "failed", seconds, process.returncode,
+                            str(log_path), "\n".join(tail))
+    logger.info(f"Tenant {tenant.name} finished in {seconds:.1f}s")
+    return TenantResult(tenant.name, "ok", seconds, 0, str(log_path))
+
+
+def _base_environ() -> dict[str, str]:
+    # per tenant variables are set explicitly, never inherited from the batch's own
+    inherited = {"DB_PATH", "DAYLIO_PICKUP_DIR", "DAYLIO_TENANT_DIR", "DAYLIO_LOG_DB"}
+    return {key: value for key, value in os.environ.items() if key not in inherited}
+
+
+def run_tenants(tenants: list[Tenant], max_workers: int = 4) -> list[TenantResult]:
+    """
+    Runs every tenant with at most max_workers ETL processes at a time.
+
+    :return: One result per tenant, in the order given
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run_tenant, tenants))
+
+
+def write_summary(results: list[TenantResult], path: Path) -> dict:
+    summary = {
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "tenants": len(results),
+        "ok": sum(result.status == "ok" for result in results),
+        "failed": [result.name for result in results if result.status != "ok"],
+        "results": [asdict(result) for result in results],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(summary, indent=2))
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Runs the Mood Dash ETL for every tenant in a manifest.")
+    parser.add_argument("manifest", type=Path, help="tenant manifest json")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="tenants processed at the same time")
+    parser.add_argument("--summary", type=Path, default=None,
+                        help="where to write the run summary, data/tenants/run_summary.json by default")
+    parser.add_argument("--only", nargs="+", metavar="NAME",
+                        help="run only these tenants")
+    args = parser.parse_args(argv)
+
+    tenants = load_manifest(args.manifest)
+    if args.only:
+        tenants = [tenant for tenant in tenants if tenant.name in args.only]
+
+    results = run_tenants(tenants, max_workers=args.workers)
+    summary_path = args.summary or get_settings().data_dir / "tenants" / "run_summary.json"
+    summary = write_summary(results, summary_path)
+
+    for result in results:
+        print(f"{result.name:<24} {result.status:<8} {result.seconds:8.1f}s")
+    print(f"{summary['ok']}/{summary['tenants']} tenants succeeded, summary written to {summary_path}")
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
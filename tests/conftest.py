@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# set before log_setup is imported, so tests never write to the project's log database
+os.environ.setdefault("DAYLIO_LOG_DB", os.path.join(tempfile.mkdtemp(), "test_logs.db"))
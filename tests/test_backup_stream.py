@@ -0,0 +1,89 @@
+import io
+import json
+import base64
+import hashlib
+
+import pytest
+
+from extractor.backup_stream import JsonObjectStream, iter_base64_text
+from extractor.data_extractor import Extractor
+
+# members with strings holding the characters the scanner looks for, nested
+# containers and scalars ended by the parent's ',' or '}'
+BACKUP = {
+    "version": 15,
+    "notes": [{"id": 1, "note": 'a } b ] c , d \\" e { [ :'}, {"id": 2, "note": "\\\\"}],
+    "tags": [{"id": 3, "name": "café ☕ \U0001f600", "icon": None}],
+    "skipped": {"deep": [[{"x": "]}"}], [], {}], "flag": True},
+    "prefs": [{"key": "PIN", "value": ""}],
+    "empty": [],
+    "last": False,
+}
+TEXT = json.dumps(BACKUP, ensure_ascii=False, separators=(", ", ": "))
+CHUNK_SIZES = range(1, 78)
+
+
+def split(text: str, size: int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def member_text(name: str) -> str:
+    # raw json text of the member as it appears in TEXT
+    return json.dumps(BACKUP[name], ensure_ascii=False, separators=(", ", ": "))
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_select_across_chunk_boundaries(size):
+    stream = JsonObjectStream(split(TEXT, size))
+
+    selected = stream.select(["notes", "tags", "prefs", "last"])
+
+    assert selected == {name: BACKUP[name] for name in ("notes", "tags", "prefs", "last")}
+    assert stream.digests["notes"] == hashlib.sha256(member_text("notes").encode("utf-8")).hexdigest()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_skipped_members_before_and_after(size):
+    # 'skipped' holds brackets inside strings, 'empty' and 'last' follow 'prefs'
+    selected = JsonObjectStream(split(TEXT, size)).select(["version", "prefs"])
+    assert selected == {"version": 15, "prefs": BACKUP["prefs"]}
+
+
+def test_escape_split_across_chunks():
+    text = '{"a": "x\\\\", "b": "\\"}"}'
+    # every split point, so each backslash lands at the end of a chunk once
+    for cut in range(1, len(text)):
+        selected = JsonObjectStream([text[:cut], text[cut:]]).select(["a", "b"])
+        assert selected == {"a": "x\\", "b": '"}'}
+
+
+def test_missing_tables_are_left_out():
+    selected = JsonObjectStream(split(TEXT, 7)).select(["tags", "dayEntries"])
+    assert selected == {"tags": BACKUP["tags"]}
+
+    with pytest.raises(ValueError, match="dayEntries"):
+        Extractor.decode_backup_to_json(iter(split(TEXT, 7)), ["tags", "dayEntries"])
+
+
+def test_truncated_member_raises():
+    with pytest.raises(ValueError, match="Unexpected end"):
+        JsonObjectStream(split(TEXT[:TEXT.index('"prefs"') + 12], 5)).select(["prefs"])
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("wrapped", [False, True])
+def test_base64_text_split_inside_characters(size, wrapped):
+    raw = TEXT.encode("utf-8")
+    # encodebytes wraps lines at 76 characters like the app's backups
+    encoded = base64.encodebytes(raw) if wrapped else base64.b64encode(raw)
+
+    chunks = list(iter_base64_text(io.BytesIO(encoded), chunk_size=size))
+
+    assert "".join(chunks) == TEXT
+    assert JsonObjectStream(chunks).select(["tags"]) == {"tags": BACKUP["tags"]}
+
+
+def test_base64_incomplete_block_raises():
+    encoded = base64.b64encode(TEXT.encode("utf-8"))[:-1]
+    with pytest.raises(ValueError, match="incomplete base64"):
+        list(iter_base64_text(io.BytesIO(encoded), chunk_size=16))
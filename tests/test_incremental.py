@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from sql_cmds import DbConnection, create_tables
+from sql_cmds.incremental import incremental_load, key_columns
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DbConnection(tmp_path / "mood_dash.db")
+    create_tables(db)
+    yield db
+    db.close()
+
+
+def sleep_frame(minutes: list[int]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": [f"2025-01-0{day + 1}" for day in range(len(minutes))],
+        "start_time": [f"2025-01-0{day + 1} 23:00:00" for day in range(len(minutes))],
+        "minutes_asleep": minutes,
+    })
+
+
+def test_frame_without_surrogate_id_matches_on_unique_column(db):
+    with db as conn:
+        assert key_columns(conn, "fitbit_sleep", list(sleep_frame([1]).columns)) == ["start_time"]
+
+        assert incremental_load(conn, "fitbit_sleep", sleep_frame([400, 420]), track="date").inserted == 2
+        ids = conn.execute("SELECT id FROM fitbit_sleep ORDER BY id").fetchall()
+
+        # a log fitbit updated after the first sync is updated in place
+        stats = incremental_load(conn, "fitbit_sleep", sleep_frame([400, 430]), track="date")
+        assert (stats.inserted, stats.updated, stats.deleted) == (0, 1, 0)
+        assert stats.touched == {"2025-01-02"}
+        assert conn.execute("SELECT id FROM fitbit_sleep ORDER BY id").fetchall() == ids
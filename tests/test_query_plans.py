@@ -0,0 +1,25 @@
+import pytest
+
+from sql_cmds import DbConnection, create_tables, create_views
+from sql_cmds.query_plans import unindexed_scans
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DbConnection(tmp_path / "mood_dash.db")
+    create_tables(db)
+    create_views(db)
+    yield db
+    db.close()
+
+
+def test_views_use_indexes_on_growing_tables(db):
+    with db as conn:
+        assert unindexed_scans(conn) == {}
+
+
+def test_scan_through_covering_index_is_reported(db):
+    # reads every row of entry_tags in index order, still a full scan
+    with db as conn:
+        conn.execute("CREATE VIEW v_all_tags AS SELECT et.tag FROM entry_tags AS et")
+        assert unindexed_scans(conn) == {'v_all_tags': ['entry_tags']}
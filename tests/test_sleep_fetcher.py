@@ -0,0 +1,175 @@
+import json
+import time
+import datetime
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+fitbit = pytest.importorskip("fitbit")
+
+from fitbit_sleep.sleep_fetcher import SleepCache, SleepFetcher, date_windows  # noqa: E402
+
+
+class StubFitbit(ThreadingHTTPServer):
+    """
+    Serves the sleep date range endpoint from a dict of sleep logs keyed by
+    date of sleep, recording every window asked for. rate_limited requests
+    are answered with a 429 and Retry-After before any data is served. Token
+    refreshes are counted, each one hands out a new access token.
+    """
+
+    def __init__(self, logs: dict[str, list[dict]]) -> None:
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.logs = logs
+        self.requests = []
+        self.rate_limited = 0
+        self.retry_after = 1
+        self.refreshes = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # /1.2/user/-/sleep/date/<first>/<last>.json
+        first, last = self.path.rsplit("/", 2)[-2:]
+        first = datetime.date.fromisoformat(first)
+        last = datetime.date.fromisoformat(last.removesuffix(".json"))
+        self.server.requests.append((first, last))
+
+        if self.server.rate_limited:
+            self.server.rate_limited -= 1
+            self._send(429, {"errors": [{"errorType": "system"}]},
+                       {"Retry-After": str(self.server.retry_after)})
+            return
+        sleep = [entry for day, entries in sorted(self.server.logs.items())
+                 if first.isoformat() <= day <= last.isoformat() for entry in entries]
+        self._send(200, {"sleep": sleep})
+
+    def do_POST(self):
+        # /oauth2/token
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.refreshes += 1
+        self._send(200, {
+            "access_token": f"access{self.server.refreshes}",
+            "refresh_token": f"refresh{self.server.refreshes}",
+            "token_type": "Bearer",
+            "expires_in": 28800,
+        })
+
+    def _send(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        body = json.dumps(payload).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sleep_log(day: datetime.date, log_id: int) -> dict:
+    return {"logId": log_id, "dateOfSleep": day.isoformat(), "duration": 27_000_000}
+
+
+@pytest.fixture
+def stub():
+    logs = {}
+    server = StubFitbit(logs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # the oauth session refuses plain http, the stub doesn't do tls
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    return fitbit.Fitbit("client_id", "client_secret", access_token="access",
+                         refresh_token="refresh", expires_at=time.time() + 3600)
+
+
+def make_fetcher(client, stub, cache_dir, **kwargs) -> SleepFetcher:
+    return SleepFetcher(client, SleepCache(cache_dir), base_url=stub.url, **kwargs)
+
+
+def test_date_windows_split_at_gaps_and_window_size():
+    start = datetime.date(2025, 1, 1)
+    days = [start + datetime.timedelta(days=offset) for offset in range(5)]
+    days += [start + datetime.timedelta(days=offset) for offset in range(7, 9)]
+
+    assert date_windows(days, window_days=3) == [
+        (datetime.date(2025, 1, 1), datetime.date(2025, 1, 3)),
+        (datetime.date(2025, 1, 4), datetime.date(2025, 1, 5)),
+        (datetime.date(2025, 1, 8), datetime.date(2025, 1, 9)),
+    ]
+    assert date_windows([]) == []
+
+
+def test_rate_limit_waits_for_retry_after(client, stub, tmp_path):
+    day = datetime.date.today() - datetime.timedelta(days=10)
+    stub.logs[day.isoformat()] = [sleep_log(day, 1)]
+    stub.rate_limited = 1
+    fetcher = make_fetcher(client, stub, tmp_path, max_workers=1, settle_days=0)
+
+    started = time.monotonic()
+    entries = fetcher.fetch(day, day)
+
+    assert time.monotonic() - started >= stub.retry_after
+    assert stub.requests == [(day, day), (day, day)]
+    assert [entry["logId"] for entry in entries] == [1]
+
+
+def test_cached_days_are_reused_except_unsettled(client, stub, tmp_path):
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=20)
+    for offset in range(0, 21, 2):
+        day = start + datetime.timedelta(days=offset)
+        stub.logs[day.isoformat()] = [sleep_log(day, offset)]
+    fetcher = make_fetcher(client, stub, tmp_path, settle_days=3, window_days=7)
+
+    first = fetcher.fetch(start, today)
+    assert sorted(stub.requests) == [
+        (start, start + datetime.timedelta(days=6)),
+        (start + datetime.timedelta(days=7), start + datetime.timedelta(days=13)),
+        (start + datetime.timedelta(days=14), today),
+    ]
+
+    # only the days Fitbit may still be updating are asked for again
+    stub.requests.clear()
+    again = make_fetcher(client, stub, tmp_path, settle_days=3, window_days=7).fetch(start, today)
+    assert stub.requests == [(today - datetime.timedelta(days=3), today)]
+    assert again == first
+    assert [entry["logId"] for entry in again] == list(range(0, 21, 2))
+
+
+def test_expired_token_is_refreshed_once_before_the_workers_start(monkeypatch, stub, tmp_path):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    saved = []
+    client = fitbit.Fitbit("client_id", "client_secret", access_token="access",
+                           refresh_token="refresh", expires_at=time.time() - 60,
+                           refresh_cb=saved.append)
+    client.client.refresh_token_url = f"{stub.url}/oauth2/token"
+    client.client.session.auto_refresh_url = client.client.refresh_token_url
+
+    start = datetime.date.today() - datetime.timedelta(days=30)
+    for offset in range(0, 20, 3):
+        day = start + datetime.timedelta(days=offset)
+        stub.logs[day.isoformat()] = [sleep_log(day, offset)]
+    fetcher = make_fetcher(client, stub, tmp_path, max_workers=4, settle_days=0, window_days=5)
+
+    entries = fetcher.fetch(start, start + datetime.timedelta(days=19))
+
+    assert len(stub.requests) == 4
+    assert stub.refreshes == 1
+    assert [token["refresh_token"] for token in saved] == ["refresh1"]
+    assert [entry["logId"] for entry in entries] == list(range(0, 20, 3))